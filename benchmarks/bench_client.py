@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Compares the DELETE throughput of a new boto3 session per batch (the former
+behaviour of s3rm) with one pooled client per worker process.
+
+Requires a local S3 stand-in, moto server is used by default:
+
+    $ pip install 'moto[server]'
+    $ python benchmarks/bench_client.py --batches 200 --workers 4
+"""
+
+import os
+import sys
+import time
+import socket
+import boto3
+import logging
+import argparse as ap
+from tool_aws.s3.client import WorkerContext
+from tool_aws.s3.engines import ProcessEngine
+
+
+BUCKET_NAME = 'bench-s3rm'
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def startServer():
+    from moto.server import ThreadedMotoServer
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    port = freePort()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    return server, 'http://127.0.0.1:%s' % port
+
+
+def batches(nbBatches, batchSize):
+    for b in range(nbBatches):
+        yield {
+            'Objects': [{'Key': 'bench/%s/%s.png' % (b, i)}
+                        for i in range(batchSize)],
+            'Quiet': True
+        }
+
+
+def seed(endpointUrl, nbBatches, batchSize):
+    client = boto3.client('s3', endpoint_url=endpointUrl)
+    for keys in batches(nbBatches, batchSize):
+        for k in keys['Objects']:
+            client.put_object(Bucket=BUCKET_NAME, Key=k['Key'], Body=b'')
+
+
+def warmUp(payload, context):
+    return payload
+
+
+def deleteNewSession(keys, context):
+    session = boto3.session.Session()
+    s3 = session.resource('s3', endpoint_url=context.endpointUrl)
+    return s3.Bucket(context.bucketName).delete_objects(Delete=keys)
+
+
+def deleteWorkerClient(keys, context):
+    return context.getClient().delete_objects(
+        Bucket=context.bucketName, Delete=keys)
+
+
+def run(label, func, context, opts):
+    if opts.seed:
+        seed(context.endpointUrl, opts.batches, opts.batchSize)
+    payloads = list(batches(opts.batches, opts.batchSize))
+    with ProcessEngine(opts.workers, context=context) as engine:
+        # Warm up the pool so that process creation is not measured
+        list(engine.run(warmUp, iter(range(opts.workers))))
+        t0 = time.time()
+        list(engine.run(func, iter(payloads)))
+        elapsed = time.time() - t0
+    print('%-16s %6d requests in %6.2fs -> %8.1f requests/s' % (
+        label, opts.batches, elapsed, opts.batches / elapsed))
+    return opts.batches / elapsed
+
+
+def main():
+    parser = ap.ArgumentParser(description='s3rm client benchmark')
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--batch-size', dest='batchSize', type=int,
+                        default=100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', action='store_true', default=False,
+                        help='create the objects before deleting them')
+    parser.add_argument('--endpoint-url', dest='endpointUrl', default=None,
+                        help='use an already running S3 stand-in')
+    opts = parser.parse_args(sys.argv[1:])
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    server = None
+    endpointUrl = opts.endpointUrl
+    if endpointUrl is None:
+        server, endpointUrl = startServer()
+    try:
+        boto3.client('s3', endpoint_url=endpointUrl).create_bucket(
+            Bucket=BUCKET_NAME)
+        context = WorkerContext(
+            BUCKET_NAME, endpointUrl=endpointUrl,
+            configOptions={'maxPoolConnections': 10})
+        before = run('session/batch', deleteNewSession, context, opts)
+        after = run('client/worker', deleteWorkerClient, context, opts)
+        print('speedup: x%.2f' % (after / before))
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
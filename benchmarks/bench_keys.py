@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Compares the tiles keys generation speed of getKeysTilingScheme (one tile
+at a time) with getKeysTilingSchemeBatches (blocks of rows at a time).
+The bbox covers the whole of Switzerland in LV95.
+
+    $ python benchmarks/bench_keys.py --high-res 1
+"""
+
+import sys
+import time
+import argparse as ap
+from tool_aws.s3.utils import getKeysTilingScheme, \
+    getKeysTilingSchemeBatches
+
+
+PREFIX = '/1.0.0/ch.dummy/default/current/'
+NATIONAL_BBOX = [2485000, 1075000, 2834000, 1296000]
+
+
+def run(label, keys):
+    t0 = time.time()
+    nbKeys = 0
+    for k in keys:
+        nbKeys += 1
+    elapsed = time.time() - t0
+    print('%-16s %10d keys in %6.2fs -> %10.0f keys/s' % (
+        label, nbKeys, elapsed, nbKeys / elapsed))
+    return nbKeys / elapsed
+
+
+def batched(opts):
+    for batch in getKeysTilingSchemeBatches(
+            PREFIX, opts.srids, NATIONAL_BBOX, 'png', opts.lowRes,
+            opts.highRes, batchSize=opts.batchSize):
+        for k in batch:
+            yield k
+
+
+def main():
+    parser = ap.ArgumentParser(description='s3rm keys generation benchmark')
+    parser.add_argument('--srids', type=int, nargs='+', default=[2056])
+    parser.add_argument('--low-res', dest='lowRes', type=float, default=100)
+    parser.add_argument('--high-res', dest='highRes', type=float,
+                        default=2.5)
+    parser.add_argument('--batch-size', dest='batchSize', type=int,
+                        default=1000)
+    opts = parser.parse_args(sys.argv[1:])
+
+    before = run('per tile', getKeysTilingScheme(
+        PREFIX, opts.srids, NATIONAL_BBOX, 'png', opts.lowRes, opts.highRes))
+    after = run('batches', batched(opts))
+    print('speedup: x%.2f' % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Measures the memory and pickling cost of streaming the keys of a bbox
+deletion to the workers, with the former payloads (one {'Key': key} dict
+per key) and with compact KeysChunk payloads (common prefix + suffixes).
+Each representation runs in a fresh process so that peak RSS is comparable.
+
+    $ python benchmarks/bench_memory.py --keys 10000000
+"""
+
+import sys
+import time
+import pickle
+import resource
+import itertools
+import subprocess
+import argparse as ap
+from collections import deque
+
+
+PREFIX = '/1.0.0/ch.dummy/default/current/'
+NATIONAL_BBOX = [2485000, 1075000, 2834000, 1296000]
+# Payloads waiting in the prefetch queue and in flight
+QUEUED_PAYLOADS = 64 + 2 * 16
+
+
+def run(representation, nbKeys, chunkSize):
+    from tool_aws.s3.keys import KeysChunk
+    from tool_aws.s3.utils import getKeysTilingSchemeBatches, iterChunks
+    keys = itertools.islice(itertools.chain.from_iterable(
+        getKeysTilingSchemeBatches(
+            PREFIX, [2056, 21781], NATIONAL_BBOX, 'png', 4000, 0.1)), nbKeys)
+    queued = deque(maxlen=QUEUED_PAYLOADS)
+    pickledBytes = 0
+    count = 0
+    t0 = time.time()
+    for cKeys in iterChunks(keys, chunkSize):
+        if representation == 'dicts':
+            payload = {'Objects': [{'Key': k} for k in cKeys], 'Quiet': True}
+        else:
+            payload = KeysChunk.fromKeys(cKeys)
+        data = pickle.dumps(payload)
+        pickledBytes += len(data)
+        queued.append(data)
+        count += len(cKeys)
+    elapsed = time.time() - t0
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print('%-8s %10d keys in %6.2fs -> %9.0f keys/s, pickled: %8.1f MB, '
+          'peak RSS: %6.1f MB' % (
+              representation, count, elapsed, count / elapsed,
+              pickledBytes / 1024. ** 2, peakRss))
+
+
+def main():
+    parser = ap.ArgumentParser(description='s3rm keys memory benchmark')
+    parser.add_argument('--keys', type=int, default=10000000)
+    parser.add_argument('--chunk-size', dest='chunkSize', type=int,
+                        default=1000)
+    parser.add_argument('--representation', choices=('dicts', 'compact'),
+                        default=None, help=ap.SUPPRESS)
+    opts = parser.parse_args(sys.argv[1:])
+    if opts.representation:
+        run(opts.representation, opts.keys, opts.chunkSize)
+        return
+    for representation in ('dicts', 'compact'):
+        subprocess.check_call([
+            sys.executable, __file__, '--keys', str(opts.keys),
+            '--chunk-size', str(opts.chunkSize),
+            '--representation', representation])
+
+
+if __name__ == '__main__':
+    main()
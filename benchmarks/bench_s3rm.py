@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of s3rm against a local S3 stand-in (moto server).
+
+A synthetic tile tree (bbox, zooms and density) is seeded before every run,
+then deleted by s3rm in prefix mode (deleteWithPrefix) or in bbox mode
+(deleteWithBBox), for every combination of engine, number of workers (-n)
+and chunk size. The keys generation alone is measured as well (keys mode).
+Latency can be added to every request of the stand-in and a ratio of the
+DELETE requests can be throttled (503 SlowDown).
+
+Every run is a separate process, so that its peak memory is measured. With
+--shards N, N processes run at the same time, each deleting its --shard i/N
+of the keys, as N hosts would: their keys/s are added up, which tells how
+the deletion scales, and every key must be deleted exactly once. The
+results (keys/s, peak memory, requests, throttles...) are saved as JSON, and
+compared with the results of a previous release with --baseline:
+
+    $ pip install 'moto[server]'
+    $ python benchmarks/bench_s3rm.py --engines process thread -n 4 16 \\
+        --chunk-sizes 100 1000 --latency 0.02 --throttle 0.01 \\
+        --output bench-0.2.6.json
+    $ python benchmarks/bench_s3rm.py ... --baseline bench-0.2.6.json
+    $ python benchmarks/bench_s3rm.py --modes prefix bbox --shards 1 2 4 \
+        --latency 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import platform
+import resource
+import tempfile
+import itertools
+import subprocess
+import argparse as ap
+from tool_aws.s3.tiles import getGrid
+from tool_aws.s3.utils import getKeysTilingSchemeBatches
+
+
+BUCKET_NAME = 'bench-s3rm'
+PREFIX = '/1.0.0/ch.bench/default/current/2056/'
+SRID = 2056
+BBOX = [2600000, 1200000, 2610000, 1210000]
+MODES = ('prefix', 'bbox', 'keys')
+# Listing depth of the sharded prefix deletions (zoom/col below the srid)
+SHARD_LIST_DEPTH = 2
+# Linux reports ru_maxrss in kilobytes, macOS in bytes
+RUSAGE_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+SLOW_DOWN = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message>
+</Error>"""
+
+
+class FaultInjection:
+    """
+    WSGI middleware of the S3 stand-in adding latency to every request and
+    throttling a ratio of the DELETE requests.
+    """
+
+    def __init__(self, app, latency=0, throttle=0, seed=0):
+        self._app = app
+        self._latency = latency
+        self._throttle = throttle
+        self._random = random.Random(seed)
+        self.nbThrottled = 0
+
+    def __call__(self, environ, startResponse):
+        if self._latency:
+            time.sleep(self._latency)
+        if self._throttle and environ['REQUEST_METHOD'] == 'POST' and \
+                'delete' in environ.get('QUERY_STRING', '') and \
+                self._random.random() < self._throttle:
+            self.nbThrottled += 1
+            startResponse('503 Slow Down', [
+                ('Content-Type', 'application/xml'),
+                ('Content-Length', str(len(SLOW_DOWN)))])
+            return [SLOW_DOWN]
+        return self._app(environ, startResponse)
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def startServer(latency, throttle):
+    import threading
+    from werkzeug.serving import make_server
+    from moto.server import DomainDispatcherApplication, create_backend_app
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = FaultInjection(
+        DomainDispatcherApplication(create_backend_app), latency, throttle)
+    server = make_server('127.0.0.1', freePort(), app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, app, 'http://127.0.0.1:%s' % server.server_address[1]
+
+
+def getBackend():
+    # The stand-in runs in this process, its backend is seeded directly
+    from moto.core import DEFAULT_ACCOUNT_ID
+    from moto.s3.models import s3_backends
+    return s3_backends[DEFAULT_ACCOUNT_ID]['global']
+
+
+def getTreeKeys(opts):
+    # Keys of the synthetic tile tree, density is the ratio of tiles seeded
+    g = getGrid(SRID, opts.bbox)
+    keys = itertools.chain.from_iterable(getKeysTilingSchemeBatches(
+        PREFIX, [SRID], opts.bbox, 'png', g.getResolution(opts.minZoom),
+        g.getResolution(opts.maxZoom)))
+    if opts.density >= 1:
+        return list(keys)
+    rand = random.Random(0)
+    return [k for k in keys if rand.random() < opts.density]
+
+
+def seed(keys):
+    backend = getBackend()
+    for k in keys:
+        backend.put_object(BUCKET_NAME, k, b'')
+
+
+def countObjects():
+    return len(getBackend().get_bucket(BUCKET_NAME).keys)
+
+
+def getScenarios(opts):
+    for mode in opts.modes:
+        if mode == 'keys':
+            yield {'id': 'keys', 'mode': mode}
+            continue
+        for engine, nbWorkers, chunkSize, nbShards in itertools.product(
+                opts.engines, opts.workers, opts.chunkSizes, opts.shards):
+            scenarioId = '%s/%s/n%s/c%s' % (
+                mode, engine, nbWorkers, chunkSize)
+            if nbShards > 1:
+                scenarioId += '/s%s' % nbShards
+            yield {
+                'id': scenarioId,
+                'mode': mode,
+                'engine': engine,
+                'workers': nbWorkers,
+                'chunkSize': chunkSize,
+                'shards': nbShards
+            }
+
+
+def getS3rmArgs(scenario, opts, endpointUrl, metricsPath, shard=None):
+    g = getGrid(SRID, opts.bbox)
+    args = ['s3rm', '-b', BUCKET_NAME, '-p', PREFIX, '--force',
+            '--engine', scenario['engine'],
+            '-n', str(scenario['workers']),
+            '-s', str(scenario['chunkSize']),
+            '--endpoint-url', endpointUrl,
+            '--metrics-json', metricsPath]
+    if scenario['mode'] == 'bbox':
+        args += ['--bbox', ','.join(str(c) for c in opts.bbox),
+                 '-i', 'png',
+                 '-lr', str(g.getResolution(opts.minZoom)),
+                 '-hr', str(g.getResolution(opts.maxZoom))]
+    if shard is not None:
+        args += ['--shard', '%s/%s' % (shard, scenario['shards'])]
+        if scenario['mode'] == 'prefix':
+            args += ['--list-depth', str(SHARD_LIST_DEPTH)]
+    return args
+
+
+def runChild(spec):
+    # Runs a scenario in this (child) process
+    spec = json.loads(spec)
+    logging.disable(logging.INFO)
+    t0 = time.time()
+    if spec['mode'] == 'keys':
+        g = getGrid(SRID, spec['bbox'])
+        nbKeys = 0
+        for batch in getKeysTilingSchemeBatches(
+                PREFIX, [SRID], spec['bbox'], 'png',
+                g.getResolution(spec['minZoom']),
+                g.getResolution(spec['maxZoom'])):
+            nbKeys += len(batch)
+        result = {'keys': nbKeys}
+    else:
+        from tool_aws.s3 import rm
+        sys.argv = spec['args']
+        rm.main()
+        result = {}
+    result['elapsed'] = time.time() - t0
+    result['peakRss'] = getPeakRss()
+    # Largest worker process, pages shared with the parent included
+    result['peakWorkerRss'] = resource.getrusage(
+        resource.RUSAGE_CHILDREN).ru_maxrss * RUSAGE_UNIT
+    print(json.dumps(result))
+
+
+def getPeakRss():
+    # ru_maxrss survives exec on Linux, it would include the peak memory
+    # of the benchmark process itself
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RUSAGE_UNIT
+
+
+def runChildren(specs, workDir):
+    # The children run at the same time, each in its own directory where
+    # the journal of s3rm is written
+    procs = []
+    for i, spec in enumerate(specs):
+        cwd = os.path.join(workDir, str(i))
+        if not os.path.isdir(cwd):
+            os.makedirs(cwd)
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--child',
+             json.dumps(spec)],
+            cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True))
+    children = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        children.append(json.loads(out.strip().splitlines()[-1]))
+    return children
+
+
+def runScenario(scenario, opts, app, endpointUrl, treeKeys, workDir):
+    spec = {'mode': scenario['mode'], 'bbox': opts.bbox,
+            'minZoom': opts.minZoom, 'maxZoom': opts.maxZoom}
+    nbShards = scenario.get('shards', 1)
+    metricsPaths = [os.path.join(workDir, str(i), 'metrics.json')
+                    for i in range(nbShards)]
+    specs = [spec]
+    if scenario['mode'] != 'keys':
+        seed(treeKeys)
+        specs = [dict(spec, args=getS3rmArgs(
+            scenario, opts, endpointUrl, path,
+            i + 1 if nbShards > 1 else None))
+            for i, path in enumerate(metricsPaths)]
+    nbThrottled = app.nbThrottled
+    children = runChildren(specs, workDir)
+    result = dict(scenario)
+    result.update({
+        'peakRssMB': round(max(
+            c['peakRss'] for c in children) / 1e6, 1),
+        'peakWorkerRssMB': round(max(
+            c['peakWorkerRss'] for c in children) / 1e6, 1),
+        'elapsed': round(max(c['elapsed'] for c in children), 3)
+    })
+    if scenario['mode'] == 'keys':
+        child = children[0]
+        result.update({
+            'keys': child['keys'],
+            'keysPerSecond': round(child['keys'] / child['elapsed'], 1)
+        })
+        return result
+    shards = []
+    for path in metricsPaths:
+        with open(path) as f:
+            shards.append(json.load(f))
+    deleted = sum(m['deleted'] for m in shards)
+    # The shards delete at the same time
+    deletion = max(m['phases'].get('deletion', 0) for m in shards)
+    result.update({
+        'keys': len(treeKeys),
+        'deleted': deleted,
+        'remaining': countObjects(),
+        'failed': sum(m['failed'] for m in shards),
+        'requests': sum(m['requests'] for m in shards),
+        'throttles': sum(m['counters'].get('throttles', 0) for m in shards),
+        'injectedThrottles': app.nbThrottled - nbThrottled,
+        'keysPerSecond': round(deleted / deletion, 1) if deletion else None,
+        'requestLatencyP50': max(
+            m['requestLatency']['p50'] or 0 for m in shards),
+        'requestLatencyP99': max(
+            m['requestLatency']['p99'] or 0 for m in shards),
+        'phases': shards[0]['phases'] if nbShards == 1 else [
+            m['phases'] for m in shards]
+    })
+    if nbShards > 1:
+        # Keys deleted by each shard, a key deleted by two shards is
+        # counted twice
+        result['shardsDeleted'] = [m['deleted'] for m in shards]
+    return result
+
+
+def getVersion():
+    try:
+        from importlib.metadata import version
+        return version('tool_aws')
+    except Exception:
+        return 'unknown'
+
+
+def compare(results, baselinePath, tolerance):
+    # Returns the ids of the scenarios slower than the baseline
+    with open(baselinePath) as f:
+        baseline = dict((r['id'], r) for r in json.load(f)['results'])
+    regressions = []
+    print('\n%-32s %12s %12s %8s' % (
+        'scenario', 'baseline', 'keys/s', 'ratio'))
+    for r in results:
+        before = baseline.get(r['id'], {}).get('keysPerSecond')
+        if not before or not r['keysPerSecond']:
+            continue
+        ratio = r['keysPerSecond'] / before
+        slower = ratio < 1 - tolerance
+        if slower:
+            regressions.append(r['id'])
+        print('%-32s %12.1f %12.1f %7.2fx%s' % (
+            r['id'], before, r['keysPerSecond'], ratio,
+            ' REGRESSION' if slower else ''))
+    return regressions
+
+
+def main():
+    parser = ap.ArgumentParser(description='s3rm benchmark suite')
+    parser.add_argument('--modes', nargs='+', choices=MODES,
+                        default=list(MODES))
+    parser.add_argument('--engines', nargs='+', default=['process'],
+                        choices=['process', 'thread', 'hybrid', 'asyncio'])
+    parser.add_argument('-n', '--workers', nargs='+', type=int, default=[4])
+    parser.add_argument('--chunk-sizes', dest='chunkSizes', nargs='+',
+                        type=int, default=[1000])
+    parser.add_argument('--shards', nargs='+', type=int, default=[1],
+                        help='numbers of s3rm processes sharing a deletion '
+                             'with --shard, as many hosts would')
+    parser.add_argument('--bbox', type=float, nargs=4, default=BBOX,
+                        help='extent of the tile tree (LV95)')
+    parser.add_argument('--min-zoom', dest='minZoom', type=int, default=20)
+    parser.add_argument('--max-zoom', dest='maxZoom', type=int, default=26)
+    parser.add_argument('--density', type=float, default=1.0,
+                        help='ratio of the tiles of the tree that exist')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every S3 request')
+    parser.add_argument('--throttle', type=float, default=0,
+                        help='ratio of DELETE requests throttled')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of runs per scenario, the fastest '
+                             'one is kept')
+    parser.add_argument('--output', default=None,
+                        help='path of the JSON results')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--child', default=None, help=ap.SUPPRESS)
+    opts = parser.parse_args(sys.argv[1:])
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if opts.child:
+        return runChild(opts.child)
+
+    server, app, endpointUrl = startServer(opts.latency, opts.throttle)
+    getBackend().create_bucket(BUCKET_NAME, 'us-east-1')
+    treeKeys = getTreeKeys(opts)
+    print('%s keys in the tree, %s' % (len(treeKeys), endpointUrl))
+    results = []
+    workDir = tempfile.mkdtemp()
+    try:
+        for scenario in getScenarios(opts):
+            runs = [runScenario(scenario, opts, app, endpointUrl, treeKeys,
+                                workDir)
+                    for i in range(opts.repeat)]
+            result = max(runs, key=lambda r: r['keysPerSecond'] or 0)
+            results.append(result)
+            print('%-32s %9s keys %10s keys/s %8.1f MB peak%s' % (
+                result['id'], result['keys'], result['keysPerSecond'],
+                result['peakRssMB'], ' %s per shard' % (
+                    result['shardsDeleted'],)
+                if 'shardsDeleted' in result else ''))
+    finally:
+        server.shutdown()
+    output = {
+        'meta': {
+            'version': getVersion(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': vars(opts)
+        },
+        'results': results
+    }
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    if opts.baseline and compare(results, opts.baseline, opts.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,7 +29,6 @@ setup(name=u'tool_aws',
           'Intended Audience :: Developers',
           'License :: OSI Approved :: MIT License',
           'Operating System :: OS Independent',
-          'Programming Language :: Python :: 3.6',
           'Programming Language :: Python :: 3.7',
           'Programming Language :: Python :: 3.8',
           'Programming Language :: Python :: 3.9',
@@ -41,10 +40,17 @@ setup(name=u'tool_aws',
       zip_safe=False,
       test_suite='nose.collector',
       install_requires=install_requires,
-      python_requires='>=3.6, <4',
+      extras_require={
+          'async': ['aiobotocore'],
+          'inventory': ['pyarrow'],
+          'zstd': ['zstandard'],
+          'yaml': ['PyYAML'],
+      },
+      python_requires='>=3.7, <4',
       entry_points={
           'console_scripts': [
               's3rm=tool_aws.s3.rm:main',
+              's3du=tool_aws.s3.rm:planMain',
           ]
       },
       )
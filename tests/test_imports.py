@@ -0,0 +1,75 @@
+import re
+import sys
+import json
+import subprocess
+import unittest
+from textwrap import dedent
+
+
+# Modules that parsing the arguments of s3rm does not need
+HEAVY_MODULES = ('boto3', 'botocore', 'pyproj', 'gatilegrid',
+                 'concurrent.futures', 'asyncio', 'multiprocessing')
+
+PARSE_SCRIPT = dedent('''
+    import sys
+    import json
+    from tool_aws.s3.rm import createParser, parseArguments
+    opts, srids = parseArguments(createParser(), %s)
+    from tool_aws.s3.utils import countTiles
+    for srid in srids:
+        countTiles(srid, opts.lowRes, opts.highRes, opts.bbox)
+    json.dump({'modules': [
+        m for m in %s if m in sys.modules]}, sys.stdout)
+''')
+
+# Importing s3rm costs at most this fraction of importing boto3
+IMPORT_TIME_RATIO = 0.5
+
+
+def runParse(argv):
+    # A new interpreter, the modules of the tests are already imported
+    output = subprocess.check_output([sys.executable, '-c', PARSE_SCRIPT % (
+        repr(argv), repr(HEAVY_MODULES))])
+    return json.loads(output.decode('utf-8'))
+
+
+def importTimes(modules):
+    # The cumulative import times (in us) of modules, imported one after
+    # the other in a new interpreter, they are measured under the same load
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c',
+         '; '.join('import %s' % m for m in modules)],
+        stderr=subprocess.STDOUT)
+    times = {}
+    for line in output.decode('utf-8').splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S+)$', line)
+        if match and match.group(2) in modules:
+            times[match.group(2)] = int(match.group(1))
+    return times
+
+
+class TestImports(unittest.TestCase):
+
+    def test_parse_prefix_without_heavy_imports(self):
+        result = runParse([
+            's3rm', '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*'])
+        self.assertEqual(result['modules'], [])
+
+    def test_parse_bbox_imports_tile_grids(self):
+        result = runParse([
+            's3rm', '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--bbox', '2600000,1200000,2610000,1210000',
+            '--image-format', 'png', '--lowest-resolution', '100',
+            '--highest-resolution', '50'])
+        self.assertEqual(result['modules'], ['gatilegrid'])
+
+    def test_import_time_budget(self):
+        # Relative to boto3 (which s3rm imports lazily) rather than a wall
+        # clock budget, the best of a few runs
+        ratios = []
+        for i in range(3):
+            times = importTimes(['tool_aws.s3.rm', 'boto3'])
+            ratios.append(float(times['tool_aws.s3.rm']) / times['boto3'])
+        self.assertLess(min(ratios), IMPORT_TIME_RATIO)
@@ -1,5 +1,9 @@
+import os
 import sys
+import json
 import mock
+import shutil
+import tempfile
 import unittest
 from tool_aws.s3.rm import createParser, parseArguments
 
@@ -260,3 +264,435 @@ class TestS3Utils(unittest.TestCase):
         with mock.patch.object(sys, 'argv', testArgvs):
             with self.assertRaises(BaseException):
                 parseArguments(parser, sys.argv)
+
+    def test_parser_with_connection_options(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--max-pool-connections', '25',
+            '--connect-timeout', '2.5',
+            '--read-timeout', '30']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.maxPoolConnections, 25)
+            self.assertEqual(opts.connectTimeout, 2.5)
+            self.assertEqual(opts.readTimeout, 30)
+            self.assertEqual(opts.endpointUrl, None)
+
+    def test_parser_with_bad_pool_connections(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--max-pool-connections', '0']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_list_depth(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--list-depth', '2',
+            '-n', '8']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.listDepth, 2)
+            self.assertEqual(opts.listParallelism, 8)
+
+    def test_parser_with_bad_list_depth(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--list-depth', '-1']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_engine(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--engine', 'hybrid',
+            '--threads-per-process', '16']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.engine, 'hybrid')
+            self.assertEqual(opts.threadsPerProcess, 16)
+            self.assertEqual(opts.concurrency, 100)
+
+    def test_parser_with_bad_engine(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--engine', 'gevent']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_retry_options(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--max-retries', '3',
+            '--retry-base-delay', '0.1',
+            '--retry-max-delay', '5']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.maxRetries, 3)
+            self.assertEqual(opts.retryBaseDelay, 0.1)
+            self.assertEqual(opts.retryMaxDelay, 5)
+
+    def test_parser_with_skip_missing(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/',
+            '--bbox', '1200000,2200000,1500000,2500000',
+            '--image-format', 'png',
+            '--skip-missing',
+            '--density-threshold', '0.8']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertTrue(opts.skipMissing)
+            self.assertEqual(opts.densityThreshold, 0.8)
+
+    def test_parser_with_skip_missing_no_bbox(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--skip-missing']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_bad_density_threshold(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/',
+            '--bbox', '1200000,2200000,1500000,2500000',
+            '--image-format', 'png',
+            '--skip-missing',
+            '--density-threshold', '2']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_resume(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--resume',
+            '--journal', '/tmp/s3rm.journal']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertTrue(opts.resume)
+            self.assertEqual(opts.journal, '/tmp/s3rm.journal')
+
+    def test_parser_with_bad_inventory(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--inventory', '/does/not/exist/manifest.json']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_keys_from_stdin(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--keys-from', '-', '--force']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.keysFrom, '-')
+        with mock.patch.object(sys, 'argv', testArgvs[:-1]):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_missing_keys_file(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--keys-from', '/does/not/exist.txt']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_plan(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--plan', '--plan-depth', '2']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertTrue(opts.plan)
+            self.assertEqual(opts.planDepth, 2)
+        with mock.patch.object(sys, 'argv', testArgvs + [
+                '--keys-from', '-', '--force']):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_parser_with_via_lifecycle(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/*',
+            '--via-lifecycle']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertTrue(opts.viaLifecycle)
+        for argv in (testArgvs[:-2] + ['/1.0.0/ch.dummy', '--via-lifecycle'],
+                     testArgvs[:-2] + ['/', '--via-lifecycle'],
+                     testArgvs + ['--lifecycle-finish'],
+                     testArgvs + ['--bbox', '2600000,1200000,2620000,1220000',
+                                  '-i', 'png']):
+            with mock.patch.object(sys, 'argv', argv):
+                with self.assertRaises(BaseException):
+                    parseArguments(parser, sys.argv)
+
+    def test_parser_with_all_versions(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/*',
+            '--all-versions']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertTrue(opts.allVersions)
+        for argv in (testArgvs + ['--keys-from', '-', '--force'],
+                     testArgvs + ['--skip-missing']):
+            with mock.patch.object(sys, 'argv', argv):
+                with self.assertRaises(BaseException):
+                    parseArguments(parser, sys.argv)
+
+    def test_parser_with_job_manifest(self):
+        parser = createParser()
+        tmpDir = tempfile.mkdtemp()
+        path = os.path.join(tmpDir, 'job.json')
+        with open(path, 'w') as f:
+            json.dump({'bucketName': 'myDummyBucket', 'targets': [
+                {'prefix': '/1.0.0/ch.dummy/default/20200101/'},
+                {'prefix': '/1.0.0/ch.dummy/default/20210101/2056/*',
+                 'bbox': [2600000, 1200000, 2620000, 1220000],
+                 'imageFormat': 'png', 'lowRes': 100}]}, f)
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--job-manifest', path,
+            '-n', '4']
+        try:
+            with mock.patch.object(sys, 'argv', testArgvs):
+                opts, srids = parseArguments(parser, sys.argv)
+                self.assertEqual(srids, [])
+                self.assertEqual(len(opts.jobTargets), 2)
+                name, targetOpts, targetSrids = opts.jobTargets[1]
+                self.assertEqual(targetOpts.prefix,
+                                 '/1.0.0/ch.dummy/default/20210101/2056/')
+                self.assertEqual(targetOpts.bbox,
+                                 [2600000, 1200000, 2620000, 1220000])
+                self.assertEqual(targetOpts.lowRes, 100)
+                self.assertEqual(targetOpts.imageFormat, 'png')
+                self.assertEqual(targetOpts.nbThreads, 4)
+                self.assertEqual(targetSrids, [2056])
+            # The image format is only valid with a bbox
+            for argv in (testArgvs + ['-i', 'png'],
+                         testArgvs + ['--prefix', '/1.0.0/'],
+                         testArgvs + ['--resume'],
+                         ['s3rm', '--bucket-name', 'otherBucket',
+                          '--job-manifest', path]):
+                with mock.patch.object(sys, 'argv', argv):
+                    with self.assertRaises(BaseException):
+                        parseArguments(parser, sys.argv)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_parser_with_job_manifest_paths_and_flags(self):
+        parser = createParser()
+        tmpDir = tempfile.mkdtemp()
+        path = os.path.join(tmpDir, 'job.json')
+        with open(os.path.join(tmpDir, 'keys.txt'), 'w') as f:
+            f.write('a/1.png\n')
+        with open(path, 'w') as f:
+            json.dump({'targets': [
+                {'prefix': '/a/', 'keysFrom': 'keys.txt',
+                 'allVersions': False},
+                {'prefix': '/b/'}]}, f)
+        testArgvs = [
+            's3rm', '--bucket-name', 'myDummyBucket', '--job-manifest', path,
+            '--all-versions']
+        try:
+            with mock.patch.object(sys, 'argv', testArgvs):
+                opts, srids = parseArguments(parser, sys.argv)
+            [(nameA, optsA, sridsA), (nameB, optsB, sridsB)] = \
+                opts.jobTargets
+            # Relative to the manifest, not to the current directory
+            self.assertEqual(optsA.keysFrom, os.path.join(tmpDir, 'keys.txt'))
+            # A false flag unsets the one of the command line
+            self.assertFalse(optsA.allVersions)
+            self.assertTrue(optsB.allVersions)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_parser_with_shard(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--shard', '2/4']
+        with mock.patch.object(sys, 'argv', testArgvs + [
+                '--bbox', '2600000,1200000,2620000,1220000', '-i', 'png']):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual((opts.shard.index, opts.shard.count), (2, 4))
+        with mock.patch.object(sys, 'argv', testArgvs + ['--list-depth', '2']):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(str(opts.shard), '2/4')
+        # The keys of a prefix are split by the sharded listing
+        for argv in (testArgvs,
+                     testArgvs[:-1] + ['5/4'],
+                     testArgvs[:-1] + ['2'],
+                     testArgvs[:-2] + ['/1.0.0/ch.dummy/', '--shard', '1/2',
+                                       '--list-depth', '1',
+                                       '--via-lifecycle']):
+            with mock.patch.object(sys, 'argv', argv):
+                with self.assertRaises(BaseException):
+                    parseArguments(parser, sys.argv)
+
+    def test_parser_with_geometry(self):
+        parser = createParser()
+        tmpDir = tempfile.mkdtemp()
+        path = os.path.join(tmpDir, 'geometry.wkt')
+        with open(path, 'w') as f:
+            f.write('POLYGON ((2600000 1200000, 2620000 1200000, '
+                    '2600000 1220000, 2600000 1200000))')
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--geometry', path]
+        try:
+            with mock.patch.object(sys, 'argv', testArgvs + ['-i', 'png']):
+                opts, srids = parseArguments(parser, sys.argv)
+                self.assertEqual(len(opts.geometry.polygons), 1)
+                # The bbox of the tiles is the envelope of the geometry
+                self.assertEqual(opts.bbox,
+                                 [2600000, 1200000, 2620000, 1220000])
+                self.assertEqual(srids, [2056])
+            badPath = os.path.join(tmpDir, 'bad.wkt')
+            with open(badPath, 'w') as f:
+                f.write('POINT (2600000 1200000)')
+            for argv in (testArgvs,
+                         testArgvs + ['-i', 'png', '--bbox',
+                                      '2600000,1200000,2620000,1220000'],
+                         testArgvs[:-1] + [badPath, '-i', 'png'],
+                         testArgvs[:-1] + [os.path.join(tmpDir, 'missing'),
+                                           '-i', 'png']):
+                with mock.patch.object(sys, 'argv', argv):
+                    with self.assertRaises(BaseException):
+                        parseArguments(parser, sys.argv)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_parser_with_rate_limits(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertIsNone(opts.maxRequestsPerSecond)
+            self.assertIsNone(opts.maxKeysPerSecond)
+        with mock.patch.object(sys, 'argv', testArgvs + [
+                '--max-requests-per-second', '20',
+                '--max-keys-per-second', '2500.5']):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.maxRequestsPerSecond, 20)
+            self.assertEqual(opts.maxKeysPerSecond, 2500.5)
+        for value in ('0', '-1', 'fast'):
+            with mock.patch.object(sys, 'argv', testArgvs + [
+                    '--max-keys-per-second', value]):
+                with self.assertRaises(BaseException):
+                    parseArguments(parser, sys.argv)
+
+    def test_parser_with_progress(self):
+        parser = createParser()
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*']
+        with mock.patch.object(sys, 'argv', testArgvs):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.progressInterval, 5)
+            self.assertFalse(opts.debug)
+        with mock.patch.object(sys, 'argv', testArgvs + [
+                '--progress-interval', '0.5', '--debug']):
+            opts, srids = parseArguments(parser, sys.argv)
+            self.assertEqual(opts.progressInterval, 0.5)
+            self.assertTrue(opts.debug)
+        with mock.patch.object(sys, 'argv', testArgvs + [
+                '--progress-interval', '0']):
+            with self.assertRaises(BaseException):
+                parseArguments(parser, sys.argv)
+
+    def test_planned_total(self):
+        from tool_aws.s3.rm import getPlannedTotal
+        parser = createParser()
+        tmpDir = tempfile.mkdtemp()
+        planPath = os.path.join(tmpDir, 'plan.json')
+        testArgvs = [
+            's3rm',
+            '--bucket-name', 'myDummyBucket',
+            '--prefix', '/1.0.0/ch.dummy/default/current/2056/*',
+            '--plan-json', planPath]
+        try:
+            with mock.patch.object(sys, 'argv', testArgvs):
+                opts, srids = parseArguments(parser, sys.argv)
+            self.assertIsNone(getPlannedTotal(opts))
+            plan = {
+                'bucketName': 'myDummyBucket',
+                'prefix': '/1.0.0/ch.dummy/default/current/2056/',
+                'bbox': None, 'geometry': None, 'shard': None,
+                'allVersions': False, 'total': {'count': 1234, 'size': 1}}
+            with open(planPath, 'w') as f:
+                json.dump(plan, f)
+            self.assertEqual(getPlannedTotal(opts), 1234)
+            # The plan of another deletion
+            opts.allVersions = True
+            self.assertIsNone(getPlannedTotal(opts))
+            with open(planPath, 'w') as f:
+                f.write('{')
+            self.assertIsNone(getPlannedTotal(opts))
+        finally:
+            shutil.rmtree(tmpDir)
@@ -0,0 +1,56 @@
+import mock
+import unittest
+from botocore.credentials import ReadOnlyCredentials
+from tool_aws.s3 import client as s3client
+
+
+class TestS3Client(unittest.TestCase):
+
+    def setUp(self):
+        self.createClient_patch = mock.patch(
+            'tool_aws.s3.client.createClient',
+            side_effect=lambda **kwargs: mock.Mock())
+        self.createClient = self.createClient_patch.start()
+
+    def tearDown(self):
+        self.createClient_patch.stop()
+
+    def test_context_client_is_reused(self):
+        context = s3client.WorkerContext(
+            'myDummyBucket', 'default', None, {'maxPoolConnections': 20})
+        client = context.getClient()
+        self.assertIs(client, context.getClient())
+        self.assertEqual(self.createClient.call_count, 1)
+        self.createClient.assert_called_with(
+            profileName='default', endpointUrl=None, credentials=None,
+            regionName=None, maxPoolConnections=20)
+
+    def test_context_client_per_pid(self):
+        context = s3client.WorkerContext('myDummyBucket')
+        with mock.patch('os.getpid', return_value=1):
+            client = context.getClient()
+        with mock.patch('os.getpid', return_value=2):
+            self.assertIsNot(client, context.getClient())
+        self.assertEqual(self.createClient.call_count, 2)
+
+    def test_given_client_is_used_by_its_process(self):
+        client = mock.Mock()
+        context = s3client.WorkerContext('myDummyBucket', client=client)
+        self.assertIs(context.getClient(), client)
+        self.assertFalse(self.createClient.called)
+
+    def test_client_config(self):
+        config = s3client.getClientConfig(
+            maxPoolConnections=50, connectTimeout=5, readTimeout=30)
+        self.assertEqual(config.max_pool_connections, 50)
+        self.assertEqual(config.connect_timeout, 5)
+        self.assertEqual(config.read_timeout, 30)
+
+    def test_client_options(self):
+        self.assertEqual(s3client.getClientOptions(), {})
+        self.assertEqual(s3client.getClientOptions(
+            ReadOnlyCredentials('key', 'secret', 'token'), 'eu-central-1'), {
+                'region_name': 'eu-central-1',
+                'aws_access_key_id': 'key',
+                'aws_secret_access_key': 'secret',
+                'aws_session_token': 'token'})
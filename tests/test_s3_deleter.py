@@ -0,0 +1,168 @@
+import mock
+import pickle
+import asyncio
+import logging
+import unittest
+from botocore.credentials import ReadOnlyCredentials
+from tool_aws.s3 import Deleter
+from tool_aws.s3.client import WorkerContext
+from tool_aws.s3.deleter import initWorkerLogging
+
+
+def deleteObjects(denied):
+    # delete_objects of a client, the keys of denied are not deleted
+    def delete_objects(Bucket, Delete):
+        return {'Errors': [
+            dict(o, Code='AccessDenied', Message='Access Denied')
+            for o in Delete['Objects'] if o['Key'] in denied]}
+    return delete_objects
+
+
+class TestDeleter(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.delete_objects.side_effect = deleteObjects(['denied'])
+        self.progress = []
+        self.errors = []
+        self.deleter = Deleter(
+            'myDummyBucket', client=self.client, concurrency=2, chunkSize=2,
+            endpointUrl='http://localhost', onProgress=self.progress.append,
+            onError=self.errors.append)
+
+    def sentObjects(self):
+        return [o for c in self.client.delete_objects.call_args_list
+                for o in c[1]['Delete']['Objects']]
+
+    def test_delete_keys(self):
+        stats = self.deleter.delete(['a', 'b', 'c', 'denied'])
+        self.assertEqual(stats.toDict(), {
+            'deleted': 3, 'failed': 1, 'retried': 0, 'requests': 2,
+            'requestRetries': 0, 'failedKeys': ['denied']})
+        self.assertEqual(sorted(o['Key'] for o in self.sentObjects()),
+                         ['a', 'b', 'c', 'denied'])
+        for c in self.client.delete_objects.call_args_list:
+            self.assertEqual(c[1]['Bucket'], 'myDummyBucket')
+        # The last progress is the one of the end of the deletion
+        self.assertIs(self.progress[-1], stats)
+        self.assertEqual(self.errors, [{
+            'Key': 'denied', 'Code': 'AccessDenied',
+            'Message': 'Access Denied'}])
+
+    def test_delete_versions(self):
+        self.deleter.delete(iter([('a', 'v1'), {'Key': 'b'},
+                                  {'Key': 'c', 'VersionId': 'v2'}]))
+        self.assertEqual(sorted(self.sentObjects(), key=lambda o: o['Key']), [
+            {'Key': 'a', 'VersionId': 'v1'}, {'Key': 'b'},
+            {'Key': 'c', 'VersionId': 'v2'}])
+
+    def test_delete_async(self):
+        stats = asyncio.run(self.deleter.deleteAsync(['a', 'b', 'c']))
+        self.assertEqual(stats.deleted, 3)
+        self.assertEqual(stats.requests, 2)
+
+    def test_delete_prefix_requires_keys(self):
+        with self.assertRaises(TypeError):
+            self.deleter.delete('/1.0.0/ch.dummy/')
+
+    def test_run_yields_stats(self):
+        from tool_aws.s3.keys import KeysChunk
+        payloads = [KeysChunk.fromKeys(['a', 'b']),
+                    KeysChunk.fromKeys(['c'])]
+        stats = list(self.deleter.run(iter(payloads), total=3))
+        self.assertEqual(stats[-1].deleted, 3)
+        self.assertEqual(self.progress, stats)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            Deleter('myDummyBucket', engine='fibers')
+
+    def test_concurrency(self):
+        deleter = Deleter('myDummyBucket', engine='hybrid', concurrency=3,
+                          threadsPerProcess=4, maxPoolConnections=2)
+        self.assertEqual(deleter.requestConcurrency, 12)
+        # The threads of a process share its client
+        self.assertEqual(deleter.configOptions['maxPoolConnections'], 4)
+        self.assertEqual(deleter.configOptions['maxAttempts'], 1)
+
+    def test_session(self):
+        session = mock.Mock(profile_name='default')
+        deleter = Deleter('myDummyBucket', session=session,
+                          endpointUrl='http://localhost')
+        self.assertIs(deleter.client, session.client.return_value)
+        self.assertEqual(deleter.profileName, 'default')
+        self.assertEqual(
+            session.client.call_args[1]['endpoint_url'], 'http://localhost')
+
+    def test_context_is_sent_without_client(self):
+        context = pickle.loads(pickle.dumps(WorkerContext(
+            'myDummyBucket', 'default', configOptions={'maxAttempts': 1},
+            client=object())))
+        self.assertEqual(context.bucketName, 'myDummyBucket')
+        self.assertEqual(context.configOptions, {'maxAttempts': 1})
+        with mock.patch('tool_aws.s3.client.createClient') as createClient:
+            self.assertIs(context.getClient(), createClient.return_value)
+        createClient.assert_called_with(
+            profileName='default', endpointUrl=None, credentials=None,
+            regionName=None, maxAttempts=1)
+
+    def test_session_credentials_are_sent(self):
+        session = mock.Mock(profile_name=None, region_name='eu-central-1')
+        session.get_credentials.return_value.get_frozen_credentials. \
+            return_value = ReadOnlyCredentials('key', 'secret', 'token')
+        deleter = Deleter('myDummyBucket', session=session, engine='process',
+                          endpointUrl='http://localhost')
+        # The context of a worker process
+        context = pickle.loads(pickle.dumps(deleter.context))
+        with mock.patch('boto3.session.Session') as Session:
+            context.getClient()
+        Session.assert_called_with(profile_name=None)
+        options = Session.return_value.client.call_args[1]
+        self.assertEqual(options['endpoint_url'], 'http://localhost')
+        self.assertEqual(options['region_name'], 'eu-central-1')
+        self.assertEqual(options['aws_access_key_id'], 'key')
+        self.assertEqual(options['aws_secret_access_key'], 'secret')
+        self.assertEqual(options['aws_session_token'], 'token')
+
+    def test_client_requires_thread_engine(self):
+        for engine in ('process', 'hybrid', 'asyncio'):
+            with self.assertRaises(ValueError):
+                Deleter('myDummyBucket', client=self.client, engine=engine)
+
+    def test_worker_log_level(self):
+        logger = logging.getLogger('tool_aws')
+        level = logger.level
+        try:
+            initWorkerLogging(logging.DEBUG)
+            self.assertEqual(logger.level, logging.DEBUG)
+        finally:
+            logger.setLevel(level)
+
+    def test_tile_keys(self):
+        keys = self.deleter.tileKeys(
+            '1.0.0/ch.dummy/default/current/2056/*',
+            bbox=[2600000, 1200000, 2610000, 1210000], lowRes=100,
+            highRes=50)
+        total = self.deleter.countKeys(keys)
+        self.assertGreater(total, 0)
+        stats = self.deleter.delete(keys)
+        self.assertEqual(stats.deleted, total)
+        for o in self.sentObjects():
+            self.assertTrue(o['Key'].startswith(
+                '1.0.0/ch.dummy/default/current/2056/'))
+            self.assertTrue(o['Key'].endswith('.png'))
+
+    def test_tile_keys_errors(self):
+        bbox = [2600000, 1200000, 2610000, 1210000]
+        with self.assertRaises(ValueError):
+            self.deleter.tileKeys('/1.0.0/ch.dummy/default/current/')
+        with self.assertRaises(ValueError):
+            self.deleter.tileKeys('/1.0.0/ch.dummy/', bbox=bbox)
+        with self.assertRaises(ValueError):
+            self.deleter.tileKeys(
+                '/1.0.0/ch.dummy/default/current/1234/', bbox=bbox)
+
+    def test_prefix_keys_shard(self):
+        from tool_aws.s3.shards import Shard
+        with self.assertRaises(ValueError):
+            self.deleter.prefixKeys('/1.0.0/ch.dummy/', shard=Shard(1, 2))
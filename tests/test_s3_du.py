@@ -0,0 +1,93 @@
+import mock
+import unittest
+from tool_aws.s3.du import getSubPrefix, getUsage, estimateDeletion, \
+    median, humanSize, humanDuration
+
+
+PREFIX = '1.0.0/ch.dummy/default/current/2056/'
+KEYS = sorted(
+    [PREFIX + '%s/%s/%s.png' % (z, c, r)
+     for z in range(3) for c in range(4) for r in range(5)] +
+    [PREFIX + 'legend.png'])
+
+
+class DummyPaginator:
+
+    def paginate(self, Bucket, Prefix, Delimiter=None, StartAfter=None,
+                 PaginationConfig=None):
+        contents = []
+        commonPrefixes = []
+        for k in KEYS:
+            if not k.startswith(Prefix):
+                continue
+            rest = k[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                p = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if p not in commonPrefixes:
+                    commonPrefixes.append(p)
+            else:
+                contents.append({'Key': k, 'Size': 10})
+        yield {
+            'Contents': contents,
+            'CommonPrefixes': [{'Prefix': p} for p in commonPrefixes]
+        }
+
+
+def dummyS3Bucket():
+    s3Bucket = mock.Mock()
+    s3Bucket.name = 'myDummyBucketName'
+    s3Bucket.meta.client.get_paginator.return_value = DummyPaginator()
+    return s3Bucket
+
+
+class TestS3Du(unittest.TestCase):
+
+    def test_get_sub_prefix(self):
+        self.assertEqual(getSubPrefix(PREFIX + '20/5/7.png', PREFIX, 1),
+                         PREFIX + '20/')
+        self.assertEqual(getSubPrefix(PREFIX + '20/5/7.png', PREFIX, 2),
+                         PREFIX + '20/5/')
+        self.assertEqual(getSubPrefix(PREFIX + '20/5/7.png', PREFIX, 3),
+                         PREFIX)
+        self.assertEqual(getSubPrefix(PREFIX + 'legend.png', PREFIX, 1),
+                         PREFIX)
+
+    def test_get_usage(self):
+        for listDepth in range(4):
+            usage, latencies = getUsage(
+                dummyS3Bucket(), '/' + PREFIX, depth=1, listDepth=listDepth,
+                parallelism=3)
+            self.assertEqual(sorted(usage), [PREFIX] + [
+                PREFIX + '%s/' % z for z in range(3)])
+            self.assertEqual(usage[PREFIX + '1/'].count, 20)
+            self.assertEqual(usage[PREFIX + '1/'].size, 200)
+            self.assertEqual(usage[PREFIX].count, 1)
+            # Below 3 levels there are no shards left to list
+            self.assertEqual(len(latencies) > 0, listDepth < 3)
+
+    def test_get_usage_filter(self):
+        usage, latencies = getUsage(
+            dummyS3Bucket(), PREFIX, depth=2, parallelism=2,
+            keysFilter=lambda k: k.startswith(PREFIX + '2/1/'))
+        self.assertEqual(list(usage), [PREFIX + '2/1/'])
+        self.assertEqual(usage[PREFIX + '2/1/'].count, 5)
+
+    def test_estimate_deletion(self):
+        estimate = estimateDeletion(10500, 1000, 4, 0.2, rate=3500)
+        self.assertEqual(estimate['requests'], 11)
+        self.assertAlmostEqual(estimate['latencyBound'], 0.55)
+        self.assertAlmostEqual(estimate['rateBound'], 3)
+        self.assertAlmostEqual(estimate['seconds'], 3)
+        estimate = estimateDeletion(10500, 100, 1, 0.2, rate=3500)
+        self.assertAlmostEqual(estimate['seconds'], 21)
+
+    def test_humanize(self):
+        self.assertEqual(median([]), None)
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+        self.assertEqual(humanSize(512), '512 B')
+        self.assertEqual(humanSize(1536), '1.5 KB')
+        self.assertEqual(humanSize(3 * 1024 ** 4), '3.0 TB')
+        self.assertEqual(humanDuration(0.2), '1s')
+        self.assertEqual(humanDuration(61), '1m01s')
+        self.assertEqual(humanDuration(3 * 3600 + 5), '3h00m05s')
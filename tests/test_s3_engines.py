@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+from tool_aws.s3.engines import ThreadEngine, ProcessEngine, \
+    HybridEngine, AsyncioEngine
+
+
+initialized = []
+
+
+def init(value):
+    initialized.append(value)
+
+
+def square(x):
+    return x * x
+
+
+def power(x, context):
+    return x ** context
+
+
+async def asyncSquare(x):
+    await asyncio.sleep(0)
+    return x * x
+
+
+class TestS3Engines(unittest.TestCase):
+
+    def setUp(self):
+        del initialized[:]
+
+    def assertRuns(self, engine, func, nbPayloads=50):
+        with engine:
+            results = dict(engine.run(func, iter(range(nbPayloads))))
+        self.assertEqual(
+            results, dict((x, x * x) for x in range(nbPayloads)))
+
+    def test_thread_engine(self):
+        engine = ThreadEngine(4, init, ('thread',))
+        self.assertEqual(engine.concurrency, 4)
+        self.assertRuns(engine, square)
+        self.assertIn('thread', initialized)
+
+    def test_process_engine(self):
+        engine = ProcessEngine(2, init, ('process',))
+        self.assertEqual(engine.concurrency, 2)
+        self.assertRuns(engine, square)
+
+    def test_hybrid_engine(self):
+        engine = HybridEngine(2, 3, init, ('hybrid',))
+        self.assertEqual(engine.concurrency, 6)
+        self.assertRuns(engine, square, nbPayloads=51)
+
+    def test_context(self):
+        # Sent once to the worker processes, not with every payload
+        for engine in (ThreadEngine(2, context=2),
+                       ProcessEngine(2, context=2),
+                       HybridEngine(2, 3, context=2)):
+            self.assertRuns(engine, power)
+
+    def test_asyncio_engine(self):
+        closed = []
+
+        async def finalizer():
+            closed.append(True)
+
+        engine = AsyncioEngine(10, init, ('asyncio',), finalizer=finalizer)
+        self.assertEqual(engine.concurrency, 10)
+        self.assertRuns(engine, asyncSquare)
+        self.assertEqual(initialized, ['asyncio'])
+        self.assertEqual(closed, [True])
+
+    def test_asyncio_engine_raises_errors(self):
+        async def fail(x):
+            raise RuntimeError('request failed')
+
+        with AsyncioEngine(5) as engine:
+            with self.assertRaises(RuntimeError):
+                list(engine.run(fail, iter(range(10))))
@@ -0,0 +1,179 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from tool_aws.s3.tiles import getGrid
+from tool_aws.s3.geometry import Geometry, TileSelection, loadGeometry, \
+    parseCRS, parseGeoJSON, parseWKT, segmentIntersectsBox, containsPoint, \
+    selectTiles
+
+
+SQUARE = [(2600000, 1200000), (2610000, 1200000), (2610000, 1210000),
+          (2600000, 1210000), (2600000, 1200000)]
+HOLE = [(2604000, 1204000), (2606000, 1204000), (2606000, 1206000),
+        (2604000, 1206000), (2604000, 1204000)]
+# A triangle crossing the square
+TRIANGLE = [(2595000, 1195000), (2625000, 1195000), (2595000, 1225000)]
+
+
+def getTilesIntersecting(g, zoom, geometry):
+    # Tile by tile
+    geometry = geometry.reproject(g.spatialReference)
+    edges = geometry.edges
+    [minRow, minCol, maxRow, maxCol] = g.getExtentAddress(zoom)
+    tiles = set()
+    for row in range(minRow, maxRow + 1):
+        for col in range(minCol, maxCol + 1):
+            b = g.tileBounds(zoom, col, row)
+            center = ((b[0] + b[2]) / 2., (b[1] + b[3]) / 2.)
+            if any(segmentIntersectsBox(e, b) for e in edges) or \
+                    containsPoint(edges, center):
+                tiles.add((row, col))
+    return tiles
+
+
+class TestS3Geometry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeFile(self, name, content):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_parse_crs(self):
+        self.assertEqual(parseCRS('EPSG:21781'), 21781)
+        self.assertEqual(parseCRS('urn:ogc:def:crs:EPSG::2056'), 2056)
+        with self.assertRaises(ValueError):
+            parseCRS('CRS84x')
+
+    def test_parse_geojson(self):
+        polygon = {'type': 'Polygon', 'coordinates': [SQUARE, HOLE]}
+        geometry = parseGeoJSON({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {}, 'geometry': polygon}]})
+        self.assertEqual(geometry.srid, 2056)
+        self.assertEqual(geometry.polygons, [[
+            [(float(x), float(y)) for x, y in ring]
+            for ring in (SQUARE, HOLE)]])
+        self.assertEqual(geometry, Geometry([[SQUARE, HOLE]]))
+        self.assertEqual(geometry.bounds, [2600000, 1200000, 2610000, 1210000])
+        geometry = parseGeoJSON({
+            'type': 'MultiPolygon', 'coordinates': [[SQUARE], [TRIANGLE]],
+            'crs': {'type': 'name', 'properties': {'name': 'EPSG:21781'}}})
+        self.assertEqual(geometry.srid, 21781)
+        self.assertEqual(len(geometry.polygons), 2)
+        with self.assertRaises(ValueError):
+            parseGeoJSON({'type': 'LineString', 'coordinates': SQUARE})
+
+    def test_parse_wkt(self):
+        geometry = parseWKT(
+            'POLYGON ((2600000 1200000, 2610000 1200000, 2610000 1210000, '
+            '2600000 1210000, 2600000 1200000), (2604000 1204000, '
+            '2606000 1204000, 2606000 1206000, 2604000 1206000, '
+            '2604000 1204000))')
+        self.assertEqual(geometry, Geometry([[SQUARE, HOLE]]))
+        geometry = parseWKT(
+            'SRID=21781;MULTIPOLYGON Z(((600000 200000 1, 610000 200000 1, '
+            '610000 210000 1, 600000 200000 1)), ((0 0 1, 1 0 1, 1 1 1)))')
+        self.assertEqual(geometry.srid, 21781)
+        self.assertEqual(len(geometry.polygons), 2)
+        with self.assertRaises(ValueError):
+            parseWKT('POINT (2600000 1200000)')
+
+    def test_load_geometry(self):
+        path = self.writeFile('geometry.wkt', 'POLYGON ((%s))' % ', '.join(
+            '%s %s' % p for p in SQUARE))
+        self.assertEqual(loadGeometry(path), Geometry([[SQUARE]]))
+        # Reprojected in 2056
+        path = self.writeFile('geometry.geojson', json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[(x - 2000000, y - 1000000)
+                             for x, y in SQUARE]],
+            'crs': {'type': 'name',
+                    'properties': {'name': 'urn:ogc:def:crs:EPSG::21781'}}}))
+        geometry = loadGeometry(path)
+        self.assertEqual(geometry.srid, 2056)
+        for a, b in zip(geometry.bounds, [2600000, 1200000, 2610000,
+                                          1210000]):
+            self.assertAlmostEqual(a, b, delta=2)
+
+    def test_reproject_long_edge(self):
+        from tool_aws.utils import getTransformer
+        # The long straight edge of latitude 46.5 is a curve in 2056
+        geometry = Geometry([[[(6, 46.5), (10, 46.5), (10, 47.5),
+                               (6, 47.5)]]], srid=4326)
+        reprojected = geometry.reproject(2056)
+        transformer = getTransformer(4326, 2056)
+        (x1, x2, xm), (y1, y2, ym) = transformer.transform(
+            [6, 10, 8], [46.5, 46.5, 46.5])
+        chordY = y1 + (y2 - y1) * (xm - x1) / (x2 - x1)
+        self.assertGreater(abs(ym - chordY), 1000)
+        # The middle of the edge is a point of the reprojected geometry
+        ring = reprojected.polygons[0][0]
+        self.assertLess(min(abs(x - xm) + abs(y - ym) for x, y in ring), 1)
+        self.assertEqual(len(ring), 4 * 22)
+
+    def test_segment_intersects_box(self):
+        box = [0, 0, 10, 10]
+        self.assertTrue(segmentIntersectsBox((-5, 5, 15, 5, 0), box))
+        self.assertTrue(segmentIntersectsBox((2, 2, 3, 3), box))
+        self.assertTrue(segmentIntersectsBox((-5, 15, 0, 10), box))
+        self.assertFalse(segmentIntersectsBox((-5, 9, 1, 15), box))
+        self.assertFalse(segmentIntersectsBox((11, -5, 11, 15), box))
+
+    def test_contains_point(self):
+        edges = Geometry([[SQUARE, HOLE]]).edges
+        self.assertTrue(containsPoint(edges, (2601000, 1201000)))
+        self.assertFalse(containsPoint(edges, (2605000, 1205000)))
+        self.assertFalse(containsPoint(edges, (2611000, 1201000)))
+        # Overlapping polygons
+        edges = Geometry([[TRIANGLE], [SQUARE]]).edges
+        self.assertTrue(containsPoint(edges, (2605000, 1205000)))
+
+    def test_tile_selection(self):
+        selection = TileSelection({3: [(5, 8), (7, 10), (12, 13)], 4: []})
+        self.assertEqual(selection.rows(), [3, 4])
+        self.assertEqual(selection.getColumnRanges(3),
+                         [range(5, 10), range(12, 13)])
+        self.assertEqual(selection.getColumnRanges(3, range(8, 20)),
+                         [range(8, 10), range(12, 13)])
+        self.assertIn((3, 9), selection)
+        self.assertNotIn((3, 10), selection)
+        self.assertNotIn((4, 9), selection)
+        self.assertEqual(len(selection), 6)
+        self.assertEqual(selection.count(cols=range(0, 6)), 1)
+        self.assertEqual(selection.getColumns(),
+                         [range(5, 10), range(12, 13)])
+        self.assertIn(9, selection.getKeysColumn(3, swap=True))
+        self.assertEqual(len(selection.getKeysColumn(3, swap=True)), 6)
+        self.assertIn(3, selection.getKeysColumn(9))
+        self.assertEqual(len(selection.getKeysColumn(9)), 1)
+
+    def test_select_tiles(self):
+        for geometry in (Geometry([[SQUARE, HOLE]]),
+                         Geometry([[TRIANGLE], [SQUARE]])):
+            for srid in (2056, 21781, 4326):
+                g = getGrid(srid, geometry.bounds)
+                for zoom in range(0, 40):
+                    [minRow, minCol, maxRow, maxCol] = \
+                        g.getExtentAddress(zoom)
+                    if (maxRow - minRow) * (maxCol - minCol) > 5000:
+                        break
+                    selection = selectTiles(g, zoom, geometry)
+                    expected = getTilesIntersecting(g, zoom, geometry)
+                    self.assertEqual(len(selection), len(expected))
+                    self.assertTrue(all(t in selection for t in expected))
+        # Only the tiles of the triangle
+        geometry = Geometry([[TRIANGLE]])
+        g = getGrid(2056, geometry.bounds)
+        zoom = g.getClosestZoom(5)
+        [minRow, minCol, maxRow, maxCol] = g.getExtentAddress(zoom)
+        ratio = float(len(selectTiles(g, zoom, geometry))) / (
+            (maxRow - minRow + 1) * (maxCol - minCol + 1))
+        self.assertTrue(0.5 < ratio < 0.6)
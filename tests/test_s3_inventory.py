@@ -0,0 +1,115 @@
+import os
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from tool_aws.s3.inventory import loadManifest, getInventoryFiles, \
+    readCsvKeys, readInventoryFile, getKeysFromInventory
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+SCHEMA = 'Bucket, Key, Size, IsLatest, IsDeleteMarker'
+ROWS = [
+    ['myDummyBucketName', '1.0.0/ch.dummy/default/current/2056/20/1/1.png',
+     '10', 'true', 'false'],
+    ['myDummyBucketName', '1.0.0/ch.dummy/default/current/2056/20/1/2.png',
+     '10', 'false', 'false'],
+    ['myDummyBucketName', '1.0.0/ch.dummy/default/current/2056/20/1/3.png',
+     '0', 'true', 'true'],
+    ['myDummyBucketName', '1.0.0/ch.other/default/current/2056/20/1/1.png',
+     '10', 'true', 'false'],
+    ['myDummyBucketName', '1.0.0/ch.dummy/default/current/legend+with%2Bplus',
+     '10', 'true', 'false']
+]
+
+
+class TestS3Inventory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        # Layout of an inventory synced from its destination bucket
+        self.manifestDir = os.path.join(
+            self.tmpDir, 'myDummyBucketName', 'config', '2020-01-01T00-00Z')
+        os.makedirs(self.manifestDir)
+        os.makedirs(os.path.join(
+            self.tmpDir, 'myDummyBucketName', 'config', 'data'))
+        files = []
+        for i in range(3):
+            key = 'myDummyBucketName/config/data/%s.csv.gz' % i
+            with gzip.open(os.path.join(self.tmpDir, key), 'wt',
+                           newline='') as f:
+                csv.writer(f).writerows(ROWS)
+            files.append({'key': key, 'size': 0})
+        self.manifestPath = self.writeManifest(files)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeManifest(self, files, fileFormat='CSV'):
+        path = os.path.join(self.manifestDir, 'manifest.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'sourceBucket': 'myDummyBucketName',
+                'fileFormat': fileFormat,
+                'fileSchema': SCHEMA,
+                'files': files
+            }, f)
+        return path
+
+    def test_load_manifest(self):
+        manifest = loadManifest(self.manifestPath)
+        self.assertEqual(manifest['sourceBucket'], 'myDummyBucketName')
+        self.writeManifest([], fileFormat='JSON')
+        with self.assertRaises(ValueError):
+            loadManifest(self.manifestPath)
+
+    def test_get_inventory_files(self):
+        manifest = loadManifest(self.manifestPath)
+        paths = getInventoryFiles(manifest, self.manifestPath)
+        self.assertEqual(len(paths), 3)
+        self.assertTrue(all(os.path.exists(p) for p in paths))
+        manifest['files'].append({'key': 'missing.csv.gz'})
+        with self.assertRaises(IOError):
+            getInventoryFiles(manifest, self.manifestPath)
+
+    def test_read_csv_keys(self):
+        path = getInventoryFiles(
+            loadManifest(self.manifestPath), self.manifestPath)[0]
+        self.assertEqual(list(readCsvKeys(path, SCHEMA)), [
+            ROWS[0][1], ROWS[3][1],
+            '1.0.0/ch.dummy/default/current/legend with+plus'])
+
+    def test_read_inventory_file(self):
+        path = getInventoryFiles(
+            loadManifest(self.manifestPath), self.manifestPath)[0]
+        keys = readInventoryFile(
+            (path, 'CSV', SCHEMA, '1.0.0/ch.dummy/', lambda k: 'legend' in k))
+        self.assertEqual(
+            keys, ['1.0.0/ch.dummy/default/current/legend with+plus'])
+
+    def test_get_keys_from_inventory(self):
+        keys = list(getKeysFromInventory(
+            self.manifestPath, '/1.0.0/ch.dummy/default/current/2056/',
+            parallelism=2))
+        self.assertEqual(keys, [ROWS[0][1]] * 3)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_read_parquet_inventory(self):
+        import pyarrow.parquet
+        path = os.path.join(self.manifestDir, 'data.parquet')
+        pyarrow.parquet.write_table(pyarrow.table({
+            'bucket': [r[0] for r in ROWS],
+            'key': [r[1] for r in ROWS],
+            'is_latest': [r[3] == 'true' for r in ROWS],
+            'is_delete_marker': [r[4] == 'true' for r in ROWS]
+        }), path)
+        self.writeManifest([{'key': 'data.parquet'}], fileFormat='Parquet')
+        keys = list(getKeysFromInventory(
+            self.manifestPath, '/1.0.0/ch.dummy/'))
+        self.assertEqual(keys, [ROWS[0][1], ROWS[4][1]])
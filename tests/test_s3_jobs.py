@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from tool_aws.s3.keys import KeysChunk
+from tool_aws.s3.jobs import loadJobManifest, getTargetArgs, \
+    getTargetFlags, getTargetName, JobProgress
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+TARGETS = [
+    {'prefix': '/1.0.0/ch.dummy/default/20200101/'},
+    {'prefix': '/1.0.0/ch.dummy/default/20210101/2056/',
+     'bbox': [2600000, 1200000, 2620000, 1220000],
+     'imageFormat': 'png', 'skipMissing': True, 'name': 'dummy 2021'}
+]
+
+
+class TestS3Jobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeFile(self, name, content):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_load_job_manifest(self):
+        path = self.writeFile('job.json', json.dumps(
+            {'bucketName': 'myDummyBucket', 'targets': TARGETS}))
+        manifest = loadJobManifest(path)
+        self.assertEqual(manifest['bucketName'], 'myDummyBucket')
+        self.assertEqual(manifest['targets'], TARGETS)
+        # A list of targets
+        path = self.writeFile('list.json', json.dumps(TARGETS))
+        self.assertEqual(loadJobManifest(path), {'targets': TARGETS})
+
+    @unittest.skipIf(yaml is None, 'PyYAML is not installed')
+    def test_load_job_manifest_yaml(self):
+        path = self.writeFile('job.yaml', yaml.safe_dump(
+            {'targets': TARGETS}))
+        self.assertEqual(loadJobManifest(path)['targets'], TARGETS)
+
+    def test_load_bad_job_manifest(self):
+        for content in ([], {'targets': []}, [{'bbox': [1, 2, 3, 4]}],
+                        [{'prefix': '/a/', 'format': 'png'}]):
+            path = self.writeFile('job.json', json.dumps(content))
+            with self.assertRaises(ValueError):
+                loadJobManifest(path)
+
+    def test_get_target_args(self):
+        self.assertEqual(getTargetArgs(TARGETS[0]), [
+            '--prefix', '/1.0.0/ch.dummy/default/20200101/'])
+        self.assertEqual(getTargetArgs(TARGETS[1]), [
+            '--bbox', '2600000,1200000,2620000,1220000',
+            '--image-format', 'png',
+            '--prefix', '/1.0.0/ch.dummy/default/20210101/2056/',
+            '--skip-missing'])
+        self.assertEqual(getTargetArgs(
+            {'prefix': '/a/', 'allVersions': False, 'listDepth': 2}),
+            ['--list-depth', '2', '--prefix', '/a/'])
+
+    def test_get_target_paths_and_flags(self):
+        target = {'prefix': '/a/', 'geometry': 'area.geojson',
+                  'keysFrom': '/tmp/keys.txt', 'skipMissing': False}
+        self.assertEqual(getTargetArgs(target, '/jobs'), [
+            '--geometry', '/jobs/area.geojson',
+            '--keys-from', '/tmp/keys.txt', '--prefix', '/a/'])
+        self.assertEqual(getTargetArgs({'prefix': '/a/', 'keysFrom': '-'},
+                                       '/jobs'),
+                         ['--keys-from', '-', '--prefix', '/a/'])
+        self.assertEqual(getTargetFlags(target), {'skipMissing': False})
+        path = self.writeFile('job.json', json.dumps(
+            [{'prefix': '/a/', 'skipMissing': 'no'}]))
+        with self.assertRaises(ValueError):
+            loadJobManifest(path)
+
+    def test_get_target_name(self):
+        self.assertEqual(getTargetName(TARGETS[0]),
+                         '/1.0.0/ch.dummy/default/20200101/')
+        self.assertEqual(getTargetName(TARGETS[1]), 'dummy 2021')
+        self.assertEqual(
+            getTargetName({'prefix': '/a/', 'bbox': '1,2,3,4'}),
+            '/a/ (bbox 1,2,3,4)')
+        self.assertEqual(
+            getTargetName({'prefix': '/a/', 'geometry': 'canton.geojson'}),
+            '/a/ (geometry canton.geojson)')
+
+    def test_job_progress(self):
+        progress = JobProgress(['a', 'ab', 'c'], ['/a/', '/a/b/', '/c/'])
+        payloads = [
+            KeysChunk.fromKeys(['a/1', 'a/2', 'a/b/3']),
+            KeysChunk.fromKeys(['a/b/4', 'a/b/5'])]
+        tagged = progress.tag(0, iter(payloads[:1]))
+        first = next(tagged)
+        self.assertEqual(progress.completed(), [])
+        progress.record(first, [{'Key': 'a/2', 'Code': 'InternalError'}], [])
+        # The target has not been fully produced yet
+        self.assertEqual(progress.completed(), [])
+        self.assertEqual(list(tagged), [])
+        self.assertEqual(progress.completed(), [0])
+        second = next(progress.tag(1, iter(payloads[1:])))
+        progress.record(second, [{'Key': 'a/b/5', 'Code': 'AccessDenied'}],
+                        [{'Key': 'a/b/5', 'Code': 'AccessDenied'}])
+        # Keys sent again are counted for the target of their prefix
+        retry = KeysChunk.fromKeys(['a/2', 'c/6'])
+        progress.record(retry, [], [])
+        self.assertEqual(
+            [(s.deleted, s.retried, s.failed, s.requests)
+             for s in progress.stats],
+            [(3, 1, 0, 1), (1, 0, 1, 1), (1, 0, 0, 0)])
+        self.assertEqual(progress.nbCompleted, 1)
+        self.assertEqual(progress.active(), [1, 2])
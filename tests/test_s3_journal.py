@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from tool_aws.s3.journal import Journal, getJournalPath, loadJournal
+
+
+JOB = {'bucketName': 'myDummyBucketName', 'prefix': 'a/'}
+
+
+def payload(i):
+    return {'Objects': [{'Key': 'a/%03d' % i}], 'Quiet': True}
+
+
+def lastKey(payload):
+    return payload['Objects'][-1]['Key']
+
+
+class TestS3Journal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpDir, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_get_journal_path(self):
+        self.assertEqual(getJournalPath(JOB), getJournalPath(dict(JOB)))
+        self.assertNotEqual(getJournalPath(JOB),
+                            getJournalPath({'prefix': 'b/'}))
+
+    def test_cursor_out_of_order(self):
+        journal = Journal(self.path, JOB, lastKey)
+        payloads = list(journal.track([payload(i) for i in range(4)]))
+        journal.done(payloads[1], 0, True)
+        self.assertIsNone(journal.cursor)
+        journal.done(payloads[0], 0, True)
+        self.assertEqual(journal.cursor, 'a/001')
+        journal.done(payloads[3], 0, True)
+        self.assertEqual(journal.cursor, 'a/001')
+        journal.done(payloads[2], 0, True)
+        self.assertEqual(journal.cursor, 'a/003')
+
+    def test_cursor_blocked_by_retries(self):
+        journal = Journal(self.path, JOB, lastKey)
+        payloads = list(journal.track([payload(i) for i in range(3)]))
+        journal.done(payloads[0], 0, True)
+        journal.done(payloads[1], 1, False)
+        journal.done(payloads[2], 0, False)
+        self.assertEqual(journal.cursor, 'a/000')
+        # The retried keys have been deleted
+        journal.done({'Objects': [{'Key': 'a/001'}]}, 0, True)
+        self.assertEqual(journal.cursor, 'a/002')
+
+    def test_write_and_load(self):
+        self.assertIsNone(loadJournal(self.path))
+        with Journal(self.path, JOB, lastKey, interval=0.01) as journal:
+            journal.done(next(journal.track([payload(7)])), 0, True)
+        self.assertEqual(loadJournal(self.path),
+                         {'job': JOB, 'cursor': 'a/007'})
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_nothing_to_write(self):
+        with Journal(self.path, JOB, lastKey, interval=0.01):
+            pass
+        self.assertIsNone(loadJournal(self.path))
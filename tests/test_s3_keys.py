@@ -0,0 +1,50 @@
+import pickle
+import unittest
+from tool_aws.s3.keys import KeysChunk
+
+
+KEYS = ['1.0.0/ch.dummy/default/current/2056/20/%s/%s.png' % (c, r)
+        for c in range(10, 12) for r in range(5)]
+
+
+class TestS3Keys(unittest.TestCase):
+
+    def test_keys_chunk(self):
+        chunk = KeysChunk.fromKeys(KEYS)
+        self.assertEqual(chunk.prefix,
+                         '1.0.0/ch.dummy/default/current/2056/20/1')
+        self.assertEqual(len(chunk), 10)
+        self.assertEqual(list(chunk), KEYS)
+        self.assertEqual(chunk[-1], KEYS[-1])
+        self.assertEqual(list(chunk[2:4]), KEYS[2:4])
+        self.assertEqual(chunk.payload(), {
+            'Objects': [{'Key': k} for k in KEYS], 'Quiet': True})
+        self.assertFalse(hasattr(chunk, '__dict__'))
+
+    def test_keys_chunk_empty(self):
+        chunk = KeysChunk.fromKeys([])
+        self.assertEqual(len(chunk), 0)
+        self.assertEqual(chunk.payload(), {'Objects': [], 'Quiet': True})
+
+    def test_keys_chunk_versions(self):
+        objects = [{'Key': 'a/1', 'VersionId': 'v1'}, {'Key': 'a/2'}]
+        chunk = KeysChunk.fromObjects(objects)
+        self.assertEqual(chunk.objects(), objects)
+        self.assertEqual(chunk[:1].objects(), objects[:1])
+        self.assertIsNone(KeysChunk.fromObjects([{'Key': 'a'}]).versionIds)
+
+    def test_keys_chunk_from_items(self):
+        versions = [('a/1', 'v1'), ('a/1', 'v2'), ('a/2', 'null')]
+        chunk = KeysChunk.fromItems(versions)
+        self.assertEqual(chunk.objects(), [
+            {'Key': k, 'VersionId': v} for k, v in versions])
+        self.assertEqual(list(chunk), ['a/1', 'a/1', 'a/2'])
+        self.assertEqual(KeysChunk.fromItems(KEYS), KeysChunk.fromKeys(KEYS))
+        self.assertEqual(len(KeysChunk.fromItems([])), 0)
+
+    def test_keys_chunk_pickle(self):
+        chunk = KeysChunk.fromKeys(KEYS)
+        self.assertEqual(pickle.loads(pickle.dumps(chunk)), chunk)
+        self.assertLess(
+            len(pickle.dumps(chunk)),
+            len(pickle.dumps(chunk.payload())) // 2)
@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import gzip
+import mock
+import shutil
+import tempfile
+import unittest
+from tool_aws.s3.keysfile import readKeysFile
+from tool_aws.s3.utils import S3Keys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+KEYS = ['foo/%s.png' % i for i in range(2500)] + ['bar/1.png']
+CONTENT = ('\n'.join(KEYS[:10]) + '\r\n\n' +
+           '\n'.join(KEYS[10:]) + '\n').encode('utf-8')
+
+
+class DummyS3Bucket(dict):
+    pass
+
+
+class TestS3KeysFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeFile(self, name, content):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_read_keys_file(self):
+        path = self.writeFile('keys.txt', CONTENT)
+        self.assertEqual(list(readKeysFile(path)), KEYS)
+
+    def test_read_keys_file_start_after(self):
+        path = self.writeFile('keys.txt', CONTENT)
+        self.assertEqual(list(readKeysFile(path, startAfter=KEYS[99])),
+                         KEYS[100:])
+
+    def test_read_keys_file_start_after_missing(self):
+        path = self.writeFile('keys.txt', CONTENT)
+        with self.assertRaises(ValueError):
+            list(readKeysFile(path, startAfter='foo/missing.png'))
+
+    def test_job_of_changed_keys_file(self):
+        from tool_aws.s3.rm import createParser, parseArguments, getJob
+        path = self.writeFile('keys.txt', CONTENT)
+        argv = ['s3rm', '-b', 'myDummyBucket', '-p', '/foo/',
+                '--keys-from', path]
+        opts, srids = parseArguments(createParser(), argv)
+        job = getJob(opts, srids)
+        self.assertEqual(job['keysFrom'], path)
+        self.assertEqual(getJob(opts, srids), job)
+        self.writeFile('keys.txt', CONTENT + b'foo/new.png\n')
+        self.assertNotEqual(getJob(opts, srids), job)
+
+    def test_resume_after_missing_key(self):
+        import json
+        from tool_aws.s3 import rm
+        path = self.writeFile('keys.txt', CONTENT)
+        journalPath = os.path.join(self.tmpDir, 'journal')
+        argv = ['s3rm', '-b', 'myDummyBucket', '-p', '/foo/',
+                '--keys-from', path, '--journal', journalPath, '--resume',
+                '--force']
+        opts, srids = rm.parseArguments(rm.createParser(), argv)
+        with open(journalPath, 'w') as f:
+            json.dump({'job': rm.getJob(opts, srids),
+                       'cursor': 'foo/missing.png'}, f)
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch('tool_aws.s3.rm.usage') as usage, \
+                mock.patch('tool_aws.s3.rm.runDeletion') as runDeletion:
+            with self.assertRaises(SystemExit) as cm:
+                rm.main()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertTrue(usage.called)
+        self.assertFalse(runDeletion.called)
+
+    def test_read_keys_file_gzip(self):
+        path = self.writeFile('keys.txt.gz', gzip.compress(CONTENT))
+        self.assertEqual(list(readKeysFile(path)), KEYS)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_read_keys_file_zstd(self):
+        path = self.writeFile(
+            'keys.txt.zst', zstandard.ZstdCompressor().compress(CONTENT))
+        self.assertEqual(list(readKeysFile(path)), KEYS)
+
+    def test_read_keys_stdin(self):
+        stdin = io.TextIOWrapper(io.BytesIO(gzip.compress(CONTENT)))
+        with mock.patch.object(sys, 'stdin', stdin):
+            self.assertEqual(list(readKeysFile('-')), KEYS)
+
+    def test_s3_keys_from_file(self):
+        path = self.writeFile('keys.txt', CONTENT)
+        s3Bucket = DummyS3Bucket()
+        s3Bucket.name = 'myDummyBucketName'
+        keys = S3Keys(s3Bucket, '/foo/', maxKeys=1000, keysFrom=path)
+        self.assertEqual(len(keys), 1000)
+        keys.chunk(1000)
+        self.assertEqual(
+            [k for chunk in keys for k in chunk] +
+            list(keys.remainingKeys()), KEYS[:-1])
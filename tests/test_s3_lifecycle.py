@@ -0,0 +1,135 @@
+import copy
+import unittest
+from botocore.exceptions import ClientError
+from tool_aws.s3.lifecycle import getRuleId, getLifecycleRules, \
+    getLifecycleConfiguration, createExpirationRules, mergeRules, \
+    addExpirationRules, removeExpirationRules, isPrefixEmpty
+
+
+PREFIX = '/1.0.0/ch.dummy/default/20200101/'
+OTHER_RULE = {
+    'ID': 'archive-logs',
+    'Filter': {'Prefix': 'logs/'},
+    'Status': 'Enabled',
+    'Transitions': [{'Days': 30, 'StorageClass': 'GLACIER'}]
+}
+
+
+class DummyClient:
+
+    def __init__(self, rules=None, versioning=None, keys=(),
+                 minimumObjectSize=None):
+        self.rules = copy.deepcopy(rules)
+        self.minimumObjectSize = minimumObjectSize
+        self.versioning = versioning
+        self.keys = list(keys)
+        self.nbPuts = 0
+
+    def get_bucket_lifecycle_configuration(self, Bucket):
+        if self.rules is None:
+            raise ClientError({'Error': {
+                'Code': 'NoSuchLifecycleConfiguration'}},
+                'GetBucketLifecycleConfiguration')
+        response = {'Rules': copy.deepcopy(self.rules)}
+        if self.minimumObjectSize:
+            response['TransitionDefaultMinimumObjectSize'] = \
+                self.minimumObjectSize
+        return response
+
+    def put_bucket_lifecycle_configuration(
+            self, Bucket, LifecycleConfiguration,
+            TransitionDefaultMinimumObjectSize=None):
+        self.nbPuts += 1
+        self.rules = copy.deepcopy(LifecycleConfiguration['Rules'])
+        # Reset to the default when it is not given, as S3 does
+        self.minimumObjectSize = TransitionDefaultMinimumObjectSize
+
+    def delete_bucket_lifecycle(self, Bucket):
+        self.rules = None
+
+    def get_bucket_versioning(self, Bucket):
+        return {'Status': self.versioning} if self.versioning else {}
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys):
+        keys = [k for k in self.keys if k.startswith(Prefix)][:MaxKeys]
+        return {'Contents': [{'Key': k} for k in keys]} if keys else {}
+
+    def list_object_versions(self, Bucket, Prefix, MaxKeys):
+        return {}
+
+
+class TestS3Lifecycle(unittest.TestCase):
+
+    def test_rule_id(self):
+        self.assertEqual(getRuleId(PREFIX), getRuleId(PREFIX[1:]))
+        self.assertTrue(getRuleId(PREFIX).startswith('s3rm-'))
+        self.assertNotEqual(getRuleId(PREFIX), getRuleId('/other/'))
+
+    def test_no_lifecycle_configuration(self):
+        self.assertEqual(getLifecycleRules(DummyClient(), 'b'), [])
+
+    def test_create_expiration_rules(self):
+        [rule] = createExpirationRules(PREFIX)
+        self.assertEqual(rule['Filter'], {'Prefix': PREFIX[1:]})
+        self.assertEqual(rule['Expiration'], {'Days': 1})
+        [rule] = createExpirationRules(PREFIX, legacy=True)
+        self.assertEqual(rule['Prefix'], PREFIX[1:])
+        self.assertNotIn('Filter', rule)
+        rule, markersRule = createExpirationRules(PREFIX, versioned=True)
+        self.assertIn('NoncurrentVersionExpiration', rule)
+        self.assertEqual(markersRule['Expiration'],
+                         {'ExpiredObjectDeleteMarker': True})
+
+    def test_merge_rules(self):
+        prefixRules = createExpirationRules(PREFIX)
+        merged = mergeRules([OTHER_RULE], prefixRules, PREFIX)
+        self.assertEqual(merged, [OTHER_RULE] + prefixRules)
+        # Added again, the rule is replaced
+        self.assertEqual(mergeRules(merged, prefixRules, PREFIX), merged)
+        with self.assertRaises(ValueError):
+            mergeRules([dict(OTHER_RULE, ID=str(i)) for i in range(1000)],
+                       prefixRules, PREFIX)
+
+    def test_add_and_remove_expiration_rules(self):
+        client = DummyClient(rules=[OTHER_RULE])
+        prefixRules = addExpirationRules(client, 'b', PREFIX)
+        self.assertEqual(client.rules, [OTHER_RULE] + prefixRules)
+        self.assertEqual(removeExpirationRules(client, 'b', PREFIX),
+                         prefixRules)
+        self.assertEqual(client.rules, [OTHER_RULE])
+        self.assertEqual(removeExpirationRules(client, 'b', PREFIX), [])
+
+    def test_configuration_settings_are_kept(self):
+        client = DummyClient(rules=[OTHER_RULE],
+                             minimumObjectSize='varies_by_storage_class')
+        self.assertEqual(getLifecycleConfiguration(client, 'b'), {
+            'Rules': [OTHER_RULE],
+            'TransitionDefaultMinimumObjectSize': 'varies_by_storage_class'})
+        prefixRules = addExpirationRules(client, 'b', PREFIX)
+        self.assertEqual(client.rules, [OTHER_RULE] + prefixRules)
+        self.assertEqual(client.minimumObjectSize, 'varies_by_storage_class')
+        removeExpirationRules(client, 'b', PREFIX)
+        self.assertEqual(client.rules, [OTHER_RULE])
+        self.assertEqual(client.minimumObjectSize, 'varies_by_storage_class')
+
+    def test_add_expiration_rules_versioned_legacy(self):
+        legacyRule = {'ID': 'old', 'Prefix': 'tmp/', 'Status': 'Enabled',
+                      'Expiration': {'Days': 7}}
+        client = DummyClient(rules=[legacyRule], versioning='Suspended')
+        prefixRules = addExpirationRules(client, 'b', PREFIX)
+        self.assertEqual(len(prefixRules), 2)
+        self.assertTrue(all('Prefix' in r for r in prefixRules))
+        removeExpirationRules(client, 'b', PREFIX)
+        self.assertEqual(client.rules, [legacyRule])
+
+    def test_remove_last_rule(self):
+        client = DummyClient()
+        addExpirationRules(client, 'b', PREFIX)
+        removeExpirationRules(client, 'b', PREFIX)
+        self.assertIsNone(client.rules)
+
+    def test_is_prefix_empty(self):
+        client = DummyClient(keys=[PREFIX[1:] + '20/1/2.png', 'other/key'])
+        self.assertFalse(isPrefixEmpty(client, 'b', PREFIX))
+        self.assertTrue(isPrefixEmpty(client, 'b', '/1.0.0/ch.other/'))
+        self.assertTrue(isPrefixEmpty(client, 'b', PREFIX, versioned=True))
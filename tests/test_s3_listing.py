@@ -0,0 +1,120 @@
+import mock
+import unittest
+from tool_aws.s3.listing import getKeysPagesFromS3, getShards, \
+    getKeysPagesSharded, getVersionsPagesFromS3, getVersionsPagesSharded
+from tool_aws.s3.shards import Shard
+
+
+KEYS = sorted(
+    ['1.0.0/ch.dummy/default/current/2056/%s/%s/%s.png' % (z, c, r)
+     for z in range(3) for c in range(4) for r in range(5)] +
+    ['1.0.0/ch.dummy/default/current/2056/legend.png'])
+
+
+class DummyPaginator:
+
+    def paginate(self, Bucket, Prefix, Delimiter=None, StartAfter=None,
+                 PaginationConfig=None):
+        pageSize = (PaginationConfig or {}).get('PageSize', 1000)
+        contents = []
+        commonPrefixes = []
+        for k in KEYS:
+            if not k.startswith(Prefix) or (StartAfter and k <= StartAfter):
+                continue
+            rest = k[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                p = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if p not in commonPrefixes:
+                    commonPrefixes.append(p)
+            else:
+                contents.append({'Key': k})
+        for i in range(0, max(len(contents), 1), pageSize):
+            yield {
+                'Contents': contents[i:i + pageSize],
+                'CommonPrefixes': [{'Prefix': p} for p in commonPrefixes]
+                if i == 0 else []
+            }
+
+
+class DummyVersionsPaginator(DummyPaginator):
+    # Two versions of every key, the legend is deleted
+
+    def paginate(self, Bucket, Prefix, Delimiter=None,
+                 PaginationConfig=None):
+        for page in DummyPaginator.paginate(
+                self, Bucket, Prefix, Delimiter=Delimiter,
+                PaginationConfig=PaginationConfig):
+            contents = page.pop('Contents')
+            page['Versions'] = [dict(o, VersionId=v) for o in contents
+                                for v in ('v1', 'v2')]
+            page['DeleteMarkers'] = [
+                dict(o, VersionId='v3') for o in contents
+                if o['Key'].endswith('legend.png')]
+            yield page
+
+
+VERSIONS = sorted([(k, v) for k in KEYS for v in ('v1', 'v2')] +
+                  [(KEYS[-1], 'v3')])
+
+
+def dummyS3Bucket():
+    s3Bucket = mock.Mock()
+    s3Bucket.name = 'myDummyBucketName'
+    s3Bucket.meta.client.get_paginator.side_effect = lambda name: \
+        DummyVersionsPaginator() if name == 'list_object_versions' \
+        else DummyPaginator()
+    return s3Bucket
+
+
+class TestS3Listing(unittest.TestCase):
+
+    prefix = '/1.0.0/ch.dummy/default/current/2056/'
+
+    def test_get_keys_pages(self):
+        pages = list(getKeysPagesFromS3(dummyS3Bucket(), self.prefix,
+                                        pageSize=10))
+        self.assertEqual(len(pages), 7)
+        self.assertEqual([k for p in pages for k in p], KEYS)
+
+    def test_get_keys_pages_start_after(self):
+        pages = list(getKeysPagesFromS3(dummyS3Bucket(), self.prefix,
+                                        startAfter=KEYS[9]))
+        self.assertEqual([k for p in pages for k in p], KEYS[10:])
+
+    def test_get_shards(self):
+        shards, looseObjects = getShards(dummyS3Bucket(), self.prefix, 2, 4)
+        self.assertEqual(len(shards), 12)
+        self.assertIn('1.0.0/ch.dummy/default/current/2056/1/3/', shards)
+        self.assertEqual(looseObjects, [{'Key': KEYS[-1]}])
+
+    def test_get_shards_no_depth(self):
+        shards, looseObjects = getShards(dummyS3Bucket(), self.prefix, 0, 4)
+        self.assertEqual(shards, ['1.0.0/ch.dummy/default/current/2056/'])
+        self.assertEqual(looseObjects, [])
+
+    def test_get_keys_pages_sharded(self):
+        for depth in range(5):
+            pages = list(getKeysPagesSharded(
+                dummyS3Bucket(), self.prefix, depth, 3, pageSize=4))
+            keys = [k for p in pages for k in p]
+            self.assertEqual(sorted(keys), KEYS)
+            self.assertTrue(all(len(p) <= 4 for p in pages))
+
+    def test_get_keys_pages_sharded_shards(self):
+        for depth in (1, 2):
+            shards = [[k for p in getKeysPagesSharded(
+                dummyS3Bucket(), self.prefix, depth, 3,
+                shard=Shard(i, 2)) for k in p] for i in (1, 2)]
+            self.assertEqual(sorted(shards[0] + shards[1]), KEYS)
+            self.assertEqual(shards[0], [k for k in shards[0] if Shard(
+                1, 2).ownsKey(k, self.prefix, depth)])
+
+    def test_get_versions_pages(self):
+        pages = list(getVersionsPagesFromS3(dummyS3Bucket(), self.prefix))
+        self.assertEqual(sorted(v for p in pages for v in p), VERSIONS)
+
+    def test_get_versions_pages_sharded(self):
+        for depth in range(4):
+            pages = list(getVersionsPagesSharded(
+                dummyS3Bucket(), self.prefix, depth, 3, pageSize=4))
+            self.assertEqual(sorted(v for p in pages for v in p), VERSIONS)
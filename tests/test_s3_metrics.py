@@ -0,0 +1,105 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from botocore.exceptions import ClientError
+from tool_aws.s3.keys import KeysChunk
+from tool_aws.s3.metrics import Histogram, Metrics, RequestTrace, errorCode
+from tool_aws.s3.results import DeleteStats
+
+
+def result(latencies, errors=[], throttles=0, requestErrors=[]):
+    return {'Errors': errors, 'Retries': len(requestErrors),
+            'Throttles': throttles, 'Latencies': latencies,
+            'RequestErrors': requestErrors, 'Elapsed': sum(latencies)}
+
+
+class TestS3Metrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_histogram(self):
+        h = Histogram(buckets=(0.1, 1, 10))
+        for v in (0.05, 0.1, 0.5, 2, 20):
+            h.observe(v)
+        self.assertEqual(h.counts, [2, 1, 1, 1])
+        self.assertEqual(h.quantile(0.5), 1)
+        self.assertEqual(h.quantile(1), float('inf'))
+        self.assertEqual(list(h.cumulativeCounts()),
+                         [(0.1, 2), (1, 3), (10, 4), (float('inf'), 5)])
+        other = Histogram(buckets=(0.1, 1, 10))
+        other.observe(0.01)
+        h.merge(other)
+        self.assertEqual(h.counts, [3, 1, 1, 1])
+        self.assertEqual(h.count, 6)
+
+    def test_request_trace(self):
+        trace = RequestTrace()
+        trace.attempt(0, ClientError(
+            {'Error': {'Code': 'SlowDown'}}, 'DeleteObjects'))
+        trace.retries += 1
+        trace.attempt(0)
+        res = trace.result([])
+        self.assertEqual(res['RequestErrors'], ['SlowDown'])
+        self.assertEqual(len(res['Latencies']), 2)
+        self.assertEqual(res['Retries'], 1)
+        self.assertEqual(errorCode(ValueError()), 'ValueError')
+
+    def test_metrics_record(self):
+        metrics = Metrics(labels={'bucket': 'b'})
+        payloads = [KeysChunk.fromKeys(['a', 'b']),
+                    KeysChunk.fromKeys(['c'])]
+        payloads = list(metrics.track(
+            metrics.timeIterator('keys', payloads, 'keys')))
+        metrics.record(payloads[0], result([0.02]))
+        metrics.record(payloads[1], result(
+            [0.3, 0.04], errors=[{'Key': 'c', 'Code': 'AccessDenied'}],
+            throttles=1, requestErrors=['SlowDown']))
+        stats = DeleteStats()
+        stats.deleted = 2
+        stats.failed = 1
+        summary = metrics.summary(stats)
+        self.assertEqual(summary['counters'], {'keys': 3, 'throttles': 1})
+        self.assertEqual(summary['requestErrors'], {'SlowDown': 1})
+        self.assertEqual(summary['keyErrors'], {'AccessDenied': 1})
+        self.assertEqual(summary['requestLatency']['count'], 3)
+        self.assertEqual(summary['roundTrip']['count'], 2)
+        self.assertAlmostEqual(summary['phases']['requests'], 0.36)
+        self.assertEqual(summary['deleted'], 2)
+
+    def test_metrics_outputs(self):
+        metrics = Metrics(labels={'bucket': 'b', 'prefix': 'p/'})
+        metrics.record(KeysChunk.fromKeys(['a']), result([0.02]))
+        with metrics.timer('deletion'):
+            pass
+        stats = DeleteStats()
+        stats.deleted = 1
+        jsonPath = os.path.join(self.tmpDir, 'metrics.json')
+        metrics.writeJson(jsonPath, stats)
+        with open(jsonPath) as f:
+            self.assertEqual(json.load(f)['deleted'], 1)
+        promPath = os.path.join(self.tmpDir, 's3rm.prom')
+        metrics.writePrometheus(promPath, stats)
+        with open(promPath) as f:
+            content = f.read()
+        self.assertIn('s3rm_deleted_total{bucket="b",prefix="p/"} 1\n',
+                      content)
+        self.assertIn('s3rm_request_latency_seconds_bucket{bucket="b",' +
+                      'prefix="p/",le="0.025"} 1\n', content)
+        self.assertIn('s3rm_request_latency_seconds_count{bucket="b",' +
+                      'prefix="p/"} 1\n', content)
+        self.assertFalse(os.path.exists(promPath + '.tmp'))
+
+    def test_metrics_tick(self):
+        path = os.path.join(self.tmpDir, 's3rm.prom')
+        metrics = Metrics(textfile=path, interval=3600)
+        metrics.tick()
+        self.assertFalse(os.path.exists(path))
+        metrics.interval = 0
+        metrics.tick()
+        self.assertTrue(os.path.exists(path))
@@ -0,0 +1,60 @@
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tool_aws.s3.pipeline import prefetch, runPipeline
+
+
+class TestS3Pipeline(unittest.TestCase):
+
+    def test_prefetch_keeps_order(self):
+        self.assertEqual(list(prefetch(range(100), 5)), list(range(100)))
+
+    def test_prefetch_is_bounded(self):
+        produced = []
+
+        def produce():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        items = prefetch(produce(), 5)
+        self.assertEqual(next(items), 0)
+        # queue size + the item being put + the item consumed
+        self.assertLessEqual(len(produced), 7)
+        items.close()
+
+    def test_prefetch_raises_producer_errors(self):
+        def produce():
+            yield 1
+            raise ValueError('listing failed')
+
+        items = prefetch(produce(), 5)
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_run_pipeline(self):
+        lock = threading.Lock()
+        state = {'inFlight': 0, 'maxInFlight': 0}
+
+        def square(x):
+            with lock:
+                state['inFlight'] += 1
+                state['maxInFlight'] = max(
+                    state['maxInFlight'], state['inFlight'])
+            with lock:
+                state['inFlight'] -= 1
+            return x * x
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = dict(runPipeline(executor, square, range(50), 3))
+        self.assertEqual(results, dict((x, x * x) for x in range(50)))
+        self.assertLessEqual(state['maxInFlight'], 3)
+
+    def test_run_pipeline_raises_worker_errors(self):
+        def fail(x):
+            raise RuntimeError('worker failed')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with self.assertRaises(RuntimeError):
+                list(runPipeline(executor, fail, range(5), 2))
@@ -0,0 +1,54 @@
+import mock
+import unittest
+from tool_aws.s3.progress import ProgressReporter
+from tool_aws.s3.results import DeleteStats
+
+
+def deleteStats(deleted, failed=0, retried=0, requestRetries=0):
+    stats = DeleteStats()
+    stats.deleted = deleted
+    stats.failed = failed
+    stats.retried = retried
+    stats.requestRetries = requestRetries
+    return stats
+
+
+class TestS3Progress(unittest.TestCase):
+
+    @mock.patch('tool_aws.s3.progress.time.time')
+    def test_render(self, now):
+        now.return_value = 1000.
+        reporter = ProgressReporter(total=1000, interval=5)
+        now.return_value = 1010.
+        self.assertEqual(
+            reporter.render(deleteStats(250, 2, 3, 1)),
+            'deleted 250/1000 keys (25.0%), 25.0 keys/s, 2 failed, '
+            '4 retried, ETA 30s')
+        # The total is an upper bound
+        self.assertEqual(
+            reporter.render(deleteStats(2000)),
+            'deleted 2000 keys, 200.0 keys/s, 0 failed, 0 retried')
+        reporter = ProgressReporter(details=[
+            lambda stats: '%s requests' % stats.requests])
+        self.assertEqual(
+            reporter.render(deleteStats(0)),
+            'deleted 0 keys, 0.0 keys/s, 0 failed, 0 retried, 0 requests')
+
+    @mock.patch('tool_aws.s3.progress.time.time')
+    def test_update(self, now):
+        now.return_value = 1000.
+        reporter = ProgressReporter(total=1000, interval=5)
+        now.return_value = 1004.
+        self.assertFalse(reporter.update(deleteStats(100)))
+        now.return_value = 1005.
+        with mock.patch('tool_aws.s3.progress.logger') as logger:
+            self.assertTrue(reporter.update(deleteStats(100)))
+            logger.info.assert_called_once_with(
+                'Progress: deleted 100/1000 keys (10.0%), 20.0 keys/s, '
+                '0 failed, 0 retried, ETA 45s')
+        # The rate is the one since the last line
+        now.return_value = 1006.
+        self.assertFalse(reporter.update(deleteStats(300)))
+        with mock.patch('tool_aws.s3.progress.logger') as logger:
+            self.assertTrue(reporter.update(deleteStats(300), force=True))
+            self.assertIn('200.0 keys/s', logger.info.call_args[0][0])
@@ -0,0 +1,78 @@
+import mock
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from tool_aws.s3.ratelimit import RateLimiter
+
+# Rate limiter of the worker processes
+_limiter = {}
+
+
+def initLimiter(rateLimiter):
+    _limiter['rateLimiter'] = rateLimiter
+
+
+def reserveKeys(nbKeys):
+    return _limiter['rateLimiter'].reserve(nbKeys)
+
+
+class TestS3RateLimit(unittest.TestCase):
+
+    @mock.patch('tool_aws.s3.ratelimit.time.time')
+    def test_reserve(self, now):
+        now.return_value = 1000.
+        rateLimiter = RateLimiter(requestsPerSecond=10, keysPerSecond=100)
+        # One second of tokens is available at the start
+        self.assertEqual(rateLimiter.reserve(50), 0)
+        self.assertAlmostEqual(rateLimiter.reserve(100), 0.5)
+        # A chunk larger than the budget of a second waits longer
+        self.assertAlmostEqual(rateLimiter.reserve(200), 2.5)
+        now.return_value = 1003.
+        # The buckets are refilled with time, up to one second of tokens
+        self.assertAlmostEqual(rateLimiter.reserve(50), 0)
+        now.return_value = 1100.
+        for i in range(10):
+            self.assertEqual(rateLimiter.reserve(1), 0)
+        self.assertAlmostEqual(rateLimiter.reserve(1), 0.1)
+        self.assertEqual(rateLimiter.stats(), {
+            'requests': 15, 'keys': 411, 'delayed': 3, 'waited': 3.1})
+
+    @mock.patch('tool_aws.s3.ratelimit.time.time')
+    def test_reserve_keys_only(self, now):
+        now.return_value = 1000.
+        rateLimiter = RateLimiter(keysPerSecond=1000)
+        for i in range(100):
+            self.assertEqual(rateLimiter.reserve(10), 0)
+        self.assertAlmostEqual(rateLimiter.reserve(1000), 1)
+        self.assertEqual(str(rateLimiter), '1000 keys/s')
+        self.assertEqual(str(RateLimiter(20.5, 1000)),
+                         '20.5 requests/s, 1000 keys/s')
+
+    def test_shared_by_processes(self):
+        rateLimiter = RateLimiter(requestsPerSecond=1000)
+        with ProcessPoolExecutor(
+                max_workers=2, initializer=initLimiter,
+                initargs=(rateLimiter,)) as executor:
+            delays = list(executor.map(reserveKeys, [2] * 2000))
+        self.assertEqual(rateLimiter.stats()['requests'], 2000)
+        self.assertEqual(rateLimiter.stats()['keys'], 4000)
+        # 2000 requests take about a second after the first second of
+        # tokens, whatever the process
+        self.assertGreater(max(delays), 0.5)
+
+    @mock.patch('tool_aws.s3.ratelimit.time.time')
+    def test_report(self, now):
+        now.return_value = 1000.
+        rateLimiter = RateLimiter(requestsPerSecond=2)
+        for i in range(4):
+            rateLimiter.reserve(10)
+        now.return_value = 1002.
+        self.assertEqual(
+            rateLimiter.report(4, 40),
+            '2.0/2 requests/s, 20.0 keys/s, 2 requests delayed '
+            '(1.5s waited in total)')
+        now.return_value = 1004.
+        # Since the previous report
+        self.assertEqual(
+            rateLimiter.report(5, 50),
+            '0.5/2 requests/s, 5.0 keys/s, 2 requests delayed '
+            '(1.5s waited in total)')
@@ -0,0 +1,173 @@
+import unittest
+from tool_aws.s3.results import RetryQueue, isRetryableCode
+from tool_aws.s3.keys import KeysChunk
+
+
+def errors(keys, code='InternalError'):
+    return [{'Key': k, 'Code': code, 'Message': code} for k in keys]
+
+
+class TestS3Results(unittest.TestCase):
+
+    def test_is_retryable_code(self):
+        self.assertTrue(isRetryableCode('InternalError'))
+        self.assertTrue(isRetryableCode('SlowDown'))
+        self.assertTrue(isRetryableCode('RequestFailed'))
+        self.assertFalse(isRetryableCode('AccessDenied'))
+
+    def test_retry_queue_chunks(self):
+        retryQueue = RetryQueue(3, 2)
+        failed = retryQueue.put(errors(['a', 'b', 'c', 'd']))
+        self.assertEqual(failed, [])
+        self.assertEqual(len(retryQueue), 4)
+        ready = list(retryQueue.iterReady())
+        self.assertEqual(len(ready), 1)
+        self.assertEqual(ready[0].objects(),
+                         [{'Key': 'a'}, {'Key': 'b'}, {'Key': 'c'}])
+        self.assertEqual(len(retryQueue), 1)
+        retryQueue.flush()
+        self.assertEqual(list(retryQueue.iterReady()),
+                         [KeysChunk.fromKeys(['d'])])
+        self.assertEqual(len(retryQueue), 0)
+
+    def test_retry_queue_budget(self):
+        retryQueue = RetryQueue(10, 2)
+        self.assertEqual(retryQueue.put(errors(['a'])), [])
+        self.assertEqual(retryQueue.put(errors(['a'])), [])
+        failed = retryQueue.put(errors(['a']))
+        self.assertEqual([e['Key'] for e in failed], ['a'])
+
+    def test_retry_queue_non_retryable(self):
+        retryQueue = RetryQueue(10, 2)
+        failed = retryQueue.put(errors(['a', 'b'], code='AccessDenied'))
+        self.assertEqual(len(failed), 2)
+        self.assertEqual(len(retryQueue), 0)
+
+    def test_retry_queue_versions(self):
+        retryQueue = RetryQueue(1, 2)
+        retryQueue.put([{'Key': 'a', 'VersionId': 'v1', 'Code': 'SlowDown'}])
+        self.assertEqual(next(retryQueue.iterReady()).objects(),
+                         [{'Key': 'a', 'VersionId': 'v1'}])
+
+    def test_retry_queue_drained(self):
+        retryQueue = RetryQueue(2, 2)
+        self.assertTrue(retryQueue.drained)
+        retryQueue.put(errors(['a', 'b', 'c']))
+        self.assertFalse(retryQueue.drained)
+        retryQueue.flush()
+        ready = list(retryQueue.iterReady())
+        retryQueue.done(ready[0])
+        self.assertFalse(retryQueue.drained)
+        retryQueue.done(ready[1])
+        self.assertTrue(retryQueue.drained)
+
+
+class TestRunDeletion(unittest.TestCase):
+
+    def test_run_deletion_requeues_failed_keys(self):
+        import sys
+        import mock
+        from tool_aws.s3.rm import createParser, parseArguments, runDeletion
+        from tool_aws.s3.metrics import Metrics
+        metrics = Metrics()
+        calls = []
+
+        def deleteKeys(keys, context):
+            calls.append(list(keys))
+            # Every key fails once, 'denied' always fails
+            errs = errors([k for k in keys if k != 'denied' and
+                           sum(c.count(k) for c in calls) == 1])
+            errs += errors([k for k in keys if k == 'denied'],
+                           code='AccessDenied')
+            return {'Errors': errs, 'Retries': 0, 'Throttles': 0}
+
+        argv = ['s3rm', '-b', 'myDummyBucket', '-p', '/foo/',
+                '--engine', 'thread', '-n', '2']
+        with mock.patch.object(sys, 'argv', argv):
+            opts, srids = parseArguments(createParser(), sys.argv)
+        payloads = [KeysChunk.fromKeys(['%s' % i for i in range(j, j + 5)])
+                    for j in range(0, 20, 5)]
+        payloads.append(KeysChunk.fromKeys(['denied']))
+        with mock.patch('tool_aws.s3.deleter.deleteKeys', deleteKeys), \
+                mock.patch('time.sleep'):
+            stats = list(runDeletion(opts, iter(payloads), 1000, 5,
+                                     metrics=metrics))[-1]
+        self.assertEqual(stats.deleted, 20)
+        self.assertEqual(stats.retried, 20)
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(stats.failedKeys, ['denied'])
+        # Retried keys are not counted twice as produced keys
+        self.assertEqual(metrics.counters['keys'], 21)
+        self.assertEqual(metrics.keyErrors,
+                         {'InternalError': 20, 'AccessDenied': 1})
+        self.assertEqual(metrics.roundTrip.count, stats.requests)
+        self.assertIn('deletion', metrics.phases)
+
+    def test_run_deletion_journal(self):
+        import os
+        import sys
+        import mock
+        import tempfile
+        from tool_aws.s3.rm import createParser, parseArguments, \
+            runDeletion, lastKey
+        from tool_aws.s3.journal import Journal, loadJournal
+
+        def deleteKeys(keys, context):
+            if keys[0] == 'k15':
+                raise RuntimeError('crash')
+            return {'Errors': [], 'Retries': 0, 'Throttles': 0}
+
+        argv = ['s3rm', '-b', 'myDummyBucket', '-p', '/foo/',
+                '--engine', 'thread', '-n', '1']
+        with mock.patch.object(sys, 'argv', argv):
+            opts, srids = parseArguments(createParser(), sys.argv)
+        payloads = [KeysChunk.fromKeys(['k%s' % i for i in range(j, j + 5)])
+                    for j in range(10, 30, 5)]
+        path = os.path.join(tempfile.mkdtemp(), 'journal')
+        journal = Journal(path, {'prefix': 'foo/'}, lastKey)
+        with mock.patch('tool_aws.s3.deleter.deleteKeys', deleteKeys):
+            with self.assertRaises(RuntimeError):
+                list(runDeletion(opts, iter(payloads), 1000, 5, journal))
+        # Only the first payload was processed
+        self.assertEqual(loadJournal(path)['cursor'], 'k14')
+        journal = Journal(path, {'prefix': 'foo/'}, lastKey)
+        with mock.patch('tool_aws.s3.deleter.deleteKeys', deleteKeys):
+            stats = list(runDeletion(opts, iter(payloads[2:]), 1000, 5,
+                                     journal))[-1]
+        self.assertEqual(stats.deleted, 10)
+        self.assertIsNone(loadJournal(path))
+
+    def test_run_deletion_job_progress(self):
+        import sys
+        import mock
+        from tool_aws.s3.rm import createParser, parseArguments, runDeletion
+        from tool_aws.s3.jobs import JobProgress
+        from tool_aws.s3.pipeline import prefetchMany
+        failed = set()
+
+        def deleteKeys(keys, context):
+            # The first key of b/ fails once
+            errs = errors([k for k in keys if k == 'b/0' and
+                           k not in failed])
+            failed.update(k for k in keys if k == 'b/0')
+            return {'Errors': errs, 'Retries': 0, 'Throttles': 0}
+
+        argv = ['s3rm', '-b', 'myDummyBucket', '-p', '/foo/',
+                '--engine', 'thread', '-n', '2']
+        with mock.patch.object(sys, 'argv', argv):
+            opts, srids = parseArguments(createParser(), sys.argv)
+        progress = JobProgress(['a', 'b'], ['/a/', '/b/'])
+        targets = [
+            [KeysChunk.fromKeys(['%s/%s' % (t, i) for i in range(j, j + 5)])
+             for j in range(0, n, 5)] for t, n in (('a', 20), ('b', 10))]
+        payloads = prefetchMany(
+            [progress.tag(i, iter(p)) for i, p in enumerate(targets)], 2, 4)
+        with mock.patch('tool_aws.s3.deleter.deleteKeys', deleteKeys), \
+                mock.patch('time.sleep'):
+            stats = list(runDeletion(opts, payloads, 1000, 5,
+                                     progress=progress))[-1]
+        self.assertEqual(stats.deleted, 30)
+        progress.completed()
+        self.assertEqual(progress.nbCompleted, 2)
+        self.assertEqual([(s.deleted, s.retried, s.requests)
+                          for s in progress.stats], [(20, 0, 4), (10, 1, 2)])
@@ -0,0 +1,135 @@
+import time
+import mock
+import unittest
+from http.client import IncompleteRead
+from botocore.exceptions import ClientError
+from tool_aws.s3.retry import Backoff, ConcurrencyController, isThrottle, \
+    isThrottleCode, isRetryableError
+from tool_aws.s3.deleter import deleteKeys
+from tool_aws.s3.client import WorkerContext
+from tool_aws.s3.keys import KeysChunk
+from tool_aws.s3.ratelimit import RateLimiter
+
+
+def clientError(code, status=400):
+    return ClientError({
+        'Error': {'Code': code, 'Message': code},
+        'ResponseMetadata': {'HTTPStatusCode': status}}, 'DeleteObjects')
+
+
+class TestS3Retry(unittest.TestCase):
+
+    def test_backoff_delays(self):
+        backoff = Backoff(maxRetries=5, baseDelay=1, maxDelay=10)
+        for attempt in range(10):
+            delay = backoff.delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(10, 2 ** attempt))
+
+    def test_is_throttle(self):
+        self.assertTrue(isThrottle(clientError('SlowDown', 503)))
+        self.assertTrue(isThrottle(clientError('Unknown', 503)))
+        self.assertFalse(isThrottle(clientError('AccessDenied', 403)))
+        self.assertFalse(isThrottle(ValueError('SlowDown')))
+        self.assertTrue(isThrottleCode('SlowDown'))
+        self.assertFalse(isThrottleCode('InternalError'))
+
+    def test_is_retryable_error(self):
+        self.assertTrue(isRetryableError(clientError('SlowDown', 503)))
+        self.assertTrue(isRetryableError(clientError('InternalError', 500)))
+        self.assertTrue(isRetryableError(clientError('BadGateway', 502)))
+        self.assertTrue(isRetryableError(IncompleteRead(b'')))
+        self.assertFalse(isRetryableError(clientError('AccessDenied', 403)))
+        self.assertFalse(isRetryableError(clientError('NoSuchBucket', 404)))
+
+    def test_concurrency_controller(self):
+        controller = ConcurrencyController(32, cooldown=60)
+        self.assertEqual(controller.limit, 32)
+        controller.record(1)
+        self.assertEqual(controller.limit, 16)
+        # Only one decrease per cooldown period
+        controller.record(1)
+        self.assertEqual(controller.limit, 16)
+        self.assertEqual(controller.nbDecreases, 1)
+        # About one more request per round trip
+        for i in range(17):
+            controller.record(0)
+        self.assertEqual(controller.limit, 17)
+        for i in range(10000):
+            controller.record(0)
+        self.assertEqual(controller.limit, 32)
+
+    def test_concurrency_controller_min_limit(self):
+        controller = ConcurrencyController(4, minLimit=2, cooldown=0)
+        for i in range(5):
+            controller.record(3)
+        self.assertEqual(controller.limit, 2)
+
+
+class TestDeleteKeysRetry(unittest.TestCase):
+
+    keys = KeysChunk.fromKeys(['a', 'b'])
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.context = WorkerContext(
+            'myDummyBucket', backoff=Backoff(maxRetries=2),
+            client=self.client)
+        self.sleep = mock.patch('time.sleep')
+        self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+
+    def test_delete_keys_retries_throttling(self):
+        self.client.delete_objects.side_effect = [
+            clientError('SlowDown', 503), {'Errors': []}]
+        result = deleteKeys(self.keys, self.context)
+        self.assertEqual(result['Retries'], 1)
+        self.assertEqual(result['Throttles'], 1)
+        self.assertEqual(result['RequestErrors'], ['SlowDown'])
+        self.assertEqual(len(result['Latencies']), 2)
+        self.assertEqual(self.client.delete_objects.call_count, 2)
+        self.assertEqual(
+            self.client.delete_objects.call_args[1]['Delete'],
+            {'Objects': [{'Key': 'a'}, {'Key': 'b'}], 'Quiet': True})
+        self.assertEqual(
+            self.client.delete_objects.call_args[1]['Bucket'],
+            'myDummyBucket')
+
+    def test_delete_keys_retry_budget(self):
+        self.client.delete_objects.side_effect = clientError('SlowDown', 503)
+        result = deleteKeys(self.keys, self.context)
+        self.assertEqual(self.client.delete_objects.call_count, 3)
+        # The keys are reported as failed to the parent
+        self.assertEqual([e['Key'] for e in result['Errors']], ['a', 'b'])
+        self.assertEqual(result['Errors'][0]['Code'], 'SlowDown')
+        self.assertEqual(result['Throttles'], 3)
+
+    def test_delete_keys_fails_fast(self):
+        self.client.delete_objects.side_effect = clientError(
+            'AccessDenied', 403)
+        result = deleteKeys(self.keys, self.context)
+        # Permanent errors are not retried
+        self.assertEqual(self.client.delete_objects.call_count, 1)
+        self.assertEqual(result['Retries'], 0)
+        self.assertEqual(result['Throttles'], 0)
+        self.assertEqual([e['Code'] for e in result['Errors']],
+                         ['AccessDenied', 'AccessDenied'])
+        time.sleep.assert_not_called()
+
+    def test_delete_keys_rate_limit(self):
+        self.client.delete_objects.side_effect = [
+            clientError('SlowDown', 503), {'Errors': []}]
+        rateLimiter = RateLimiter(keysPerSecond=1)
+        self.context.rateLimiter = rateLimiter
+        result = deleteKeys(self.keys, self.context)
+        # Each attempt waits for its keys
+        self.assertEqual(rateLimiter.stats()['requests'], 2)
+        self.assertEqual(rateLimiter.stats()['keys'], 4)
+        self.assertGreater(result['RateWait'], 3)
+
+    def test_delete_keys_raises_unexpected_errors(self):
+        self.client.delete_objects.side_effect = ValueError('bug')
+        with self.assertRaises(ValueError):
+            deleteKeys(self.keys, self.context)
@@ -0,0 +1,57 @@
+import pickle
+import unittest
+from tool_aws.s3.shards import Shard, ShardFilter
+
+
+PREFIX = '/1.0.0/ch.dummy/default/current/2056/'
+KEYS = ['1.0.0/ch.dummy/default/current/2056/%s/%s/%s.png' % (z, c, r)
+        for z in range(4) for c in range(10) for r in range(3)] + \
+    ['1.0.0/ch.dummy/default/current/2056/legend.png']
+
+
+class TestS3Shards(unittest.TestCase):
+
+    def test_shard_from_string(self):
+        self.assertEqual(Shard.fromString('2/4'), Shard(2, 4))
+        self.assertEqual(str(Shard(2, 4)), '2/4')
+        for val in ('0/4', '5/4', '1/0', '1', 'a/b', '1/2/3'):
+            with self.assertRaises(ValueError):
+                Shard.fromString(val)
+
+    def test_get_range(self):
+        for n in (1, 3, 4, 7):
+            for count in (1, 2, 3, 5):
+                for offset in (0, 1, 9):
+                    # Contiguous ranges of about the same size
+                    parts = [Shard(i, count).getRange(
+                        range(10, 10 + n), offset)
+                        for i in range(1, count + 1)]
+                    self.assertEqual(sorted(v for p in parts for v in p),
+                                     list(range(10, 10 + n)))
+                    self.assertTrue(all(
+                        n // count <= len(p) <= n // count + 1
+                        for p in parts))
+
+    def test_owns_key(self):
+        for depth in (1, 2, 3):
+            owners = [[i for i in range(1, 4)
+                       if Shard(i, 3).ownsKey(k, PREFIX, depth)]
+                      for k in KEYS]
+            # Every key belongs to exactly one shard
+            self.assertTrue(all(len(o) == 1 for o in owners))
+            # The keys of a sub-prefix belong to the same shard
+            for k, o in zip(KEYS[:-1], owners):
+                subPrefix = '/'.join(k.split('/')[:5 + depth]) + '/'
+                if depth < 3:
+                    self.assertTrue(Shard(o[0], 3).ownsPrefix(subPrefix))
+        self.assertEqual(
+            len(set(tuple(i for i in range(1, 4)
+                          if Shard(i, 3).ownsKey(k, PREFIX, 2))
+                    for k in KEYS)), 3)
+
+    def test_shard_filter(self):
+        keysFilter = pickle.loads(pickle.dumps(
+            ShardFilter(Shard(2, 3), PREFIX, 2)))
+        self.assertEqual([k for k in KEYS if keysFilter(k)],
+                         [k for k in KEYS if Shard(2, 3).ownsKey(
+                             k, PREFIX, 2)])
@@ -0,0 +1,222 @@
+import mock
+import unittest
+from gatilegrid import getTileGrid
+from tool_aws.s3.utils import getKeysTilingScheme
+from tool_aws.s3.tiles import getGrid, getTilesBase, getKeysRanges, \
+    getColumnKeys, sampleColumns, generateZoomKeys, getKeysExistingTiles, \
+    getZoomKeysBatches, getTileCursor, getTilesVersions, TilesFilter
+from tool_aws.s3.shards import Shard
+from tool_aws.s3.geometry import Geometry
+
+
+PREFIX = '1.0.0/ch.dummy/default/current/2056/'
+BBOX = [2600000, 1200000, 2620000, 1220000]
+# A triangle whose envelope is BBOX
+GEOMETRY = Geometry([[[(2600000, 1200000), (2620000, 1200000),
+                       (2600000, 1220000)]]])
+
+
+def dummyS3Bucket(keys):
+    def paginate(Bucket, Prefix, StartAfter=None, PaginationConfig=None):
+        yield {'Contents': [{'Key': k} for k in sorted(keys)
+                            if k.startswith(Prefix)]}
+
+    def paginateVersions(Bucket, Prefix, PaginationConfig=None):
+        yield {'Versions': [{'Key': k, 'VersionId': 'v1'}
+                            for k in sorted(keys) if k.startswith(Prefix)],
+               'DeleteMarkers': [{'Key': k, 'VersionId': 'v2'}
+                                 for k in sorted(keys)
+                                 if k.startswith(Prefix)]}
+
+    def getPaginator(name):
+        paginator = mock.Mock()
+        paginator.paginate = paginateVersions \
+            if name == 'list_object_versions' else paginate
+        return paginator
+    s3Bucket = mock.Mock()
+    s3Bucket.name = 'myDummyBucketName'
+    s3Bucket.meta.client.get_paginator.side_effect = getPaginator
+    return s3Bucket
+
+
+class TestS3Tiles(unittest.TestCase):
+
+    def test_get_grid(self):
+        g = getGrid(2056, BBOX)
+        self.assertIs(g, getGrid(2056, list(BBOX)))
+        self.assertIsNot(g, getGrid(21781, BBOX))
+        self.assertEqual(list(g.extent), BBOX)
+        self.assertEqual(getGrid(2056).extent, getTileGrid(2056)().extent)
+
+    def test_get_grid_clipped(self):
+        g = getGrid(21781, [2420000, 1030000, 2900000, 1350000])
+        self.assertEqual(list(g.extent), [420000, 30000, 900000, 350000])
+
+    def test_get_tiles_base(self):
+        self.assertEqual(getTilesBase('/' + PREFIX, 2056), PREFIX)
+        self.assertEqual(
+            getTilesBase('/1.0.0/ch.dummy/default/current/', 21781),
+            '1.0.0/ch.dummy/default/current/21781/')
+
+    def test_get_keys_ranges(self):
+        g = getTileGrid(21781)(extent=[600000, 200000, 620000, 220000])
+        [minRow, minCol, maxRow, maxCol] = g.getExtentAddress(20)
+        cols, rows = getKeysRanges(g, 20)
+        # Columns and rows are swapped in the keys of 21781
+        self.assertEqual(cols, range(minRow, maxRow + 1))
+        self.assertEqual(rows, range(minCol, maxCol + 1))
+
+    def test_get_column_keys(self):
+        keys = [PREFIX + '20/5/%s.png' % r for r in range(10)] + \
+            [PREFIX + '20/5/3.jpeg', PREFIX + '20/5/legend.png',
+             PREFIX + '20/50/3.png']
+        pages = list(getColumnKeys(
+            dummyS3Bucket(keys), PREFIX, 20, 5, range(2, 5), 'png'))
+        self.assertEqual([k for p in pages for k in p],
+                         [PREFIX + '20/5/%s.png' % r for r in range(2, 5)])
+
+    def test_sample_columns(self):
+        self.assertEqual(sampleColumns(range(10), 4), [0, 2, 4, 6])
+        self.assertEqual(sampleColumns(range(2), 4), [0, 1])
+
+    def test_generate_zoom_keys(self):
+        g = getTileGrid(2056)(extent=BBOX)
+        keys = list(generateZoomKeys(g, PREFIX, 18, 'png'))
+        self.assertEqual(
+            keys, [k['Key'] for k in getKeysTilingScheme(
+                '/' + PREFIX, [2056], BBOX, 'png', g.getResolution(18),
+                g.getResolution(18))])
+
+    def test_get_zoom_keys_batches_after(self):
+        for srid in (2056, 21781):
+            g = getGrid(srid, BBOX)
+            base = getTilesBase('/1.0.0/ch.dummy/default/current/', srid)
+            keys = list(generateZoomKeys(g, base, 20, 'png'))
+            for i in (0, 7, len(keys) // 2, len(keys) - 1):
+                [s, zoom, row, col] = getTileCursor(keys[i])
+                self.assertEqual((s, zoom), (srid, 20))
+                after = [k for b in getZoomKeysBatches(
+                    g, base, 20, 'png', 10, after=(row, col)) for k in b]
+                self.assertEqual(after, keys[i + 1:])
+
+    def test_get_tile_cursor(self):
+        self.assertEqual(getTileCursor(PREFIX + '20/5/7.png'),
+                         [2056, 20, 7, 5])
+        self.assertEqual(getTileCursor('a/b/c/d/21781/20/5/7.jpeg'),
+                         [21781, 20, 5, 7])
+
+    def test_get_keys_existing_tiles_sparse(self):
+        g = getTileGrid(2056)(extent=BBOX)
+        cols, rows = getKeysRanges(g, 20)
+        existing = [PREFIX + '20/%s/%s.png' % (cols[1], rows[0]),
+                    PREFIX + '20/%s/%s.png' % (cols[-1], rows[-1])]
+        keys = list(getKeysExistingTiles(
+            dummyS3Bucket(existing), '/' + PREFIX, [2056], BBOX, 'png',
+            g.getResolution(20), g.getResolution(20), parallelism=2))
+        self.assertEqual(sorted(keys), sorted(existing))
+
+    def test_get_keys_existing_tiles_dense(self):
+        g = getTileGrid(2056)(extent=BBOX)
+        expected = list(generateZoomKeys(g, PREFIX, 18, 'png'))
+        s3Bucket = dummyS3Bucket(expected)
+        keys = list(getKeysExistingTiles(
+            s3Bucket, '/' + PREFIX, [2056], BBOX, 'png',
+            g.getResolution(18), g.getResolution(18), densityThreshold=0.5))
+        self.assertEqual(keys, expected)
+
+    def test_tiles_filter(self):
+        g = getGrid(2056, BBOX)
+        keysFilter = TilesFilter('/' + PREFIX, [2056], BBOX, 'png',
+                                 g.getResolution(18), g.getResolution(20))
+        for zoom in (18, 20):
+            for k in generateZoomKeys(g, PREFIX, zoom, 'png'):
+                self.assertTrue(keysFilter(k))
+        cols, rows = getKeysRanges(g, 20)
+        self.assertFalse(keysFilter(PREFIX + '17/%s/%s.png' % (
+            cols[0], rows[0])))
+        self.assertFalse(keysFilter(PREFIX + '20/%s/%s.png' % (
+            cols[-1] + 1, rows[0])))
+        self.assertFalse(keysFilter(PREFIX + '20/%s/%s.jpeg' % (
+            cols[0], rows[0])))
+        self.assertFalse(keysFilter(PREFIX + 'legend.png'))
+        self.assertFalse(keysFilter(
+            '1.0.0/ch.other/default/current/2056/20/%s/%s.png' % (
+                cols[0], rows[0])))
+
+    def test_get_tiles_versions(self):
+        g = getTileGrid(2056)(extent=BBOX)
+        cols, rows = getKeysRanges(g, 20)
+        inside = [PREFIX + '20/%s/%s.png' % (cols[1], rows[0]),
+                  PREFIX + '20/%s/%s.png' % (cols[-1], rows[-1])]
+        outside = [PREFIX + '20/%s/%s.png' % (cols[-1] + 1, rows[0]),
+                   PREFIX + '20/%s/%s.jpeg' % (cols[1], rows[0]),
+                   PREFIX + '19/%s/%s.png' % (cols[1], rows[0])]
+        versions = list(getTilesVersions(
+            dummyS3Bucket(inside + outside), '/' + PREFIX, [2056], BBOX,
+            'png', g.getResolution(20), g.getResolution(20), parallelism=2))
+        self.assertEqual(sorted(versions), sorted(
+            [(k, v) for k in inside for v in ('v1', 'v2')]))
+
+    def test_get_keys_existing_tiles_shards(self):
+        g = getGrid(2056, BBOX)
+        # Sparse zoom 18 (listed), dense zoom 19 (generated)
+        cols, rows = getKeysRanges(g, 18)
+        existing = [PREFIX + '18/%s/%s.png' % (col, rows[0])
+                    for col in cols] + \
+            list(generateZoomKeys(g, PREFIX, 19, 'png'))
+        s3Bucket = dummyS3Bucket(existing)
+        shards = [list(getKeysExistingTiles(
+            s3Bucket, '/' + PREFIX, [2056], BBOX, 'png',
+            g.getResolution(18), g.getResolution(19),
+            densityThreshold=0.9, shard=Shard(i, 3))) for i in range(1, 4)]
+        self.assertEqual(sorted(k for keys in shards for k in keys),
+                         sorted(existing))
+        self.assertTrue(all(keys for keys in shards))
+        for i, keys in enumerate(shards):
+            keysFilter = TilesFilter(
+                '/' + PREFIX, [2056], BBOX, 'png', g.getResolution(18),
+                g.getResolution(19), Shard(i + 1, 3))
+            self.assertTrue(all(keysFilter(k) for k in keys))
+            self.assertFalse(any(keysFilter(k) for k in shards[i - 1]))
+
+    def test_get_zoom_keys_batches_geometry(self):
+        for srid in (2056, 21781):
+            g = getGrid(srid, BBOX)
+            prefix = PREFIX.replace('2056', str(srid))
+            keysFilter = TilesFilter(
+                '/' + prefix, [srid], BBOX, 'png', g.getResolution(22),
+                g.getResolution(22), geometry=GEOMETRY)
+            allKeys = list(generateZoomKeys(g, prefix, 22, 'png'))
+            expected = [k for k in allKeys if keysFilter(k)]
+            self.assertTrue(len(allKeys) / 2 < len(expected) <
+                            0.6 * len(allKeys))
+            keys = [k for b in getZoomKeysBatches(
+                g, prefix, 22, 'png', 100, geometry=GEOMETRY) for k in b]
+            self.assertEqual(keys, expected)
+            # Resumed after a tile
+            [srid, zoom, row, col] = getTileCursor(expected[100])
+            self.assertEqual([k for b in getZoomKeysBatches(
+                g, prefix, 22, 'png', 100, after=(row, col),
+                geometry=GEOMETRY) for k in b], expected[101:])
+
+    def test_get_keys_existing_tiles_geometry(self):
+        g = getGrid(2056, BBOX)
+        # Every tile of the bbox exists
+        existing = list(generateZoomKeys(g, PREFIX, 18, 'png')) + \
+            list(generateZoomKeys(g, PREFIX, 19, 'png'))
+        keysFilter = TilesFilter(
+            '/' + PREFIX, [2056], BBOX, 'png', g.getResolution(18),
+            g.getResolution(19), geometry=GEOMETRY)
+        expected = sorted(k for k in existing if keysFilter(k))
+        s3Bucket = dummyS3Bucket(existing)
+        for densityThreshold in (0, 1.1):
+            keys = list(getKeysExistingTiles(
+                s3Bucket, '/' + PREFIX, [2056], BBOX, 'png',
+                g.getResolution(18), g.getResolution(19),
+                densityThreshold=densityThreshold, geometry=GEOMETRY))
+            self.assertEqual(sorted(keys), expected)
+        versions = list(getTilesVersions(
+            s3Bucket, '/' + PREFIX, [2056], BBOX, 'png',
+            g.getResolution(18), g.getResolution(19), geometry=GEOMETRY))
+        self.assertEqual(sorted(k for k, v in versions if v == 'v1'),
+                         expected)
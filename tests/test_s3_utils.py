@@ -1,7 +1,11 @@
 import mock
 import unittest
-import collections
-from tool_aws.s3.utils import S3Keys, getMaxChunkSize
+import collections.abc
+from tool_aws.s3.utils import S3Keys, getMaxChunkSize, iterChunks, \
+    getKeysTilingScheme, getKeysTilingSchemeBatches, countTiles
+from tool_aws.s3.tiles import getTileCursor
+from tool_aws.s3.shards import Shard
+from tool_aws.s3.geometry import Geometry
 
 
 class DummyS3Bucket(dict):
@@ -18,7 +22,7 @@ NB_KEYS = 101
 class TestS3Utils(unittest.TestCase):
 
     def setUp(self):
-        def getOrderedKeys(a, b, c):
+        def getOrderedKeys(a, b, c, startAfter=None):
             return [{'Key': str(i)} for i in range(NB_KEYS)]
         self.getKeysFromS3 = getOrderedKeys
         self.getKeysFromS3_patch = mock.patch(
@@ -33,7 +37,7 @@ class TestS3Utils(unittest.TestCase):
         chunkSize = 20
         dummyKeys = S3Keys(dummyS3Bucket, prefix, chunkSize)
 
-        self.assertIsInstance(dummyKeys, collections.Iterable)
+        self.assertIsInstance(dummyKeys, collections.abc.Iterable)
         self.assertEqual(len(dummyKeys), NB_KEYS)
         self.assertEqual(dummyKeys.prefix, prefix)
         self.assertEqual(dummyKeys.chunkSize, chunkSize)
@@ -43,10 +47,10 @@ class TestS3Utils(unittest.TestCase):
 
         firstChunk = next(dummyKeys.chunkedKeys)
         self.assertEqual(len(firstChunk), chunkSize)
-        self.assertIn('Key', firstChunk[0])
+        self.assertIn('Key', firstChunk.payload()['Objects'][0])
         secondChunk = next(dummyKeys.chunkedKeys)
         self.assertEqual(len(secondChunk), chunkSize)
-        self.assertIn('Key', secondChunk[0])
+        self.assertIn('Key', secondChunk.payload()['Objects'][0])
         next(dummyKeys.chunkedKeys)
         next(dummyKeys.chunkedKeys)
         next(dummyKeys.chunkedKeys)
@@ -57,37 +61,37 @@ class TestS3Utils(unittest.TestCase):
         prefix = 'foo/'
         dummyKeys = S3Keys(dummyS3Bucket, prefix)
 
-        self.assertIsInstance(dummyKeys, collections.Iterable)
+        self.assertIsInstance(dummyKeys, collections.abc.Iterable)
         self.assertEqual(len(dummyKeys), NB_KEYS)
         self.assertEqual(dummyKeys.prefix, prefix)
         self.assertEqual(dummyKeys.chunkSize, 1)
 
         firstChunk = next(dummyKeys.chunkedKeys)
         self.assertEqual(len(firstChunk), 1)
-        self.assertIn('Key', firstChunk[0])
+        self.assertIn('Key', firstChunk.payload()['Objects'][0])
         secondChunk = next(dummyKeys.chunkedKeys)
         self.assertEqual(len(secondChunk), 1)
-        self.assertIn('Key', secondChunk[0])
+        self.assertIn('Key', secondChunk.payload()['Objects'][0])
 
     def test_s3_keys_chunk(self):
         prefix = 'foo/'
         dummyKeys = S3Keys(dummyS3Bucket, prefix)
 
-        self.assertIsInstance(dummyKeys, collections.Iterable)
+        self.assertIsInstance(dummyKeys, collections.abc.Iterable)
         self.assertEqual(len(dummyKeys), NB_KEYS)
         self.assertEqual(dummyKeys.prefix, prefix)
         self.assertEqual(dummyKeys.chunkSize, 1)
 
         chunkSize = 20
         dummyKeys.chunk(chunkSize)
-        self.assertIsInstance(dummyKeys, collections.Iterable)
+        self.assertIsInstance(dummyKeys, collections.abc.Iterable)
         self.assertEqual(len(dummyKeys), NB_KEYS)
         self.assertEqual(dummyKeys.prefix, prefix)
         self.assertEqual(dummyKeys.chunkSize, chunkSize)
 
         chunkSize = 1
         dummyKeys.chunk(chunkSize)
-        self.assertIsInstance(dummyKeys, collections.Iterable)
+        self.assertIsInstance(dummyKeys, collections.abc.Iterable)
         self.assertEqual(len(dummyKeys), NB_KEYS)
         self.assertEqual(dummyKeys.prefix, prefix)
         self.assertEqual(dummyKeys.chunkSize, chunkSize)
@@ -116,3 +120,115 @@ class TestS3Utils(unittest.TestCase):
         nbKeys = 0
         chunkSize = getMaxChunkSize(nbProc, nbKeys)
         self.assertEqual(chunkSize, 0)
+
+    def test_iter_chunks(self):
+        chunkedKeys = list(iterChunks(iter(range(NB_KEYS)), 20))
+        self.assertEqual(len(chunkedKeys), 6)
+        self.assertEqual(len(chunkedKeys[0]), 20)
+        self.assertEqual(chunkedKeys[-1], [100])
+        self.assertEqual(list(iterChunks([], 20)), [])
+
+    def _assert_same_keys(self, prefix, srids):
+        bbox = [2600000, 1200000, 2650000, 1250000]
+        expected = [k['Key'] for k in getKeysTilingScheme(
+            prefix, srids, bbox, 'png', 50, 10)]
+        batches = list(getKeysTilingSchemeBatches(
+            prefix, srids, bbox, 'png', 50, 10, batchSize=333))
+        self.assertTrue(all(len(b) == 333 for b in batches[:-1]))
+        self.assertEqual([k for b in batches for k in b], expected)
+
+    def test_get_keys_tiling_scheme_batches(self):
+        self._assert_same_keys('/1.0.0/ch.dummy/default/current/2056/',
+                               [2056])
+        self._assert_same_keys('/1.0.0/ch.dummy/default/current/',
+                               [2056, 21781])
+
+    def test_get_keys_tiling_scheme_batches_start(self):
+        prefix = '/1.0.0/ch.dummy/default/current/'
+        bbox = [2600000, 1200000, 2650000, 1250000]
+        expected = [k['Key'] for k in getKeysTilingScheme(
+            prefix, [2056, 21781], bbox, 'png', 50, 10)]
+        for i in (0, 1000, len(expected) // 2, len(expected) - 1):
+            start = getTileCursor(expected[i])
+            keys = [k for b in getKeysTilingSchemeBatches(
+                prefix, [2056, 21781], bbox, 'png', 50, 10, start=start)
+                for k in b]
+            self.assertEqual(keys, expected[i + 1:])
+
+    def test_get_keys_tiling_scheme_batches_shards(self):
+        prefix = '/1.0.0/ch.dummy/default/current/'
+        bbox = [2600000, 1200000, 2650000, 1250000]
+        expected = [k['Key'] for k in getKeysTilingScheme(
+            prefix, [2056, 21781], bbox, 'png', 50, 10)]
+        shards = []
+        for i in range(1, 5):
+            shard = Shard(i, 4)
+            keys = [k for b in getKeysTilingSchemeBatches(
+                prefix, [2056, 21781], bbox, 'png', 50, 10, shard=shard)
+                for k in b]
+            # In the order of the tile grid
+            self.assertEqual(keys, [k for k in expected if k in set(keys)])
+            self.assertEqual(len(keys), sum(countTiles(
+                srid, 50, 10, bbox, shard) for srid in (2056, 21781)))
+            # Resumed within the shard
+            start = getTileCursor(keys[len(keys) // 2])
+            self.assertEqual([k for b in getKeysTilingSchemeBatches(
+                prefix, [2056, 21781], bbox, 'png', 50, 10, start=start,
+                shard=shard) for k in b], keys[len(keys) // 2 + 1:])
+            shards.append(keys)
+        self.assertEqual(sorted(k for keys in shards for k in keys),
+                         sorted(expected))
+        self.assertTrue(all(
+            len(keys) > len(expected) / 5 for keys in shards))
+
+    def test_get_keys_tiling_scheme_batches_geometry(self):
+        prefix = '/1.0.0/ch.dummy/default/current/'
+        geometry = Geometry([[[(2600000, 1200000), (2650000, 1200000),
+                               (2650000, 1250000)]]])
+        bbox = geometry.bounds
+        allKeys = [k for b in getKeysTilingSchemeBatches(
+            prefix, [2056, 21781], bbox, 'png', 50, 10) for k in b]
+        keys = [k for b in getKeysTilingSchemeBatches(
+            prefix, [2056, 21781], bbox, 'png', 50, 10, geometry=geometry)
+            for k in b]
+        # In the order of the tile grid, about half of the tiles
+        self.assertEqual(keys, [k for k in allKeys if k in set(keys)])
+        self.assertTrue(len(allKeys) / 2 < len(keys) < 0.6 * len(allKeys))
+        self.assertEqual(len(keys), sum(countTiles(
+            srid, 50, 10, bbox, geometry=geometry) for srid in (2056, 21781)))
+        shards = []
+        for i in range(1, 4):
+            shard = Shard(i, 3)
+            shards.append([k for b in getKeysTilingSchemeBatches(
+                prefix, [2056, 21781], bbox, 'png', 50, 10, shard=shard,
+                geometry=geometry) for k in b])
+            self.assertEqual(len(shards[-1]), sum(countTiles(
+                srid, 50, 10, bbox, shard, geometry)
+                for srid in (2056, 21781)))
+        self.assertEqual(sorted(k for keys in shards for k in keys),
+                         sorted(keys))
+
+    def test_get_keys_tiling_scheme_batches_bad_prefix(self):
+        self.assertEqual(list(getKeysTilingSchemeBatches(
+            '/1.0.0/ch.dummy/', [2056], [2600000, 1200000, 2650000, 1250000],
+            'png', 50, 10)), [])
+
+    def test_s3_keys_versions(self):
+        versions = [('foo/%s' % i, 'v%s' % j)
+                    for i in range(NB_KEYS) for j in range(2)]
+
+        def getVersionsPages(s3Bucket, prefix):
+            yield versions[:150]
+            yield versions[150:]
+        with mock.patch('tool_aws.s3.utils.getVersionsPagesFromS3',
+                        getVersionsPages):
+            keys = S3Keys(dummyS3Bucket, 'foo/', maxKeys=100, versions=True)
+        self.assertEqual(len(keys), 100)
+        keys.chunk(30)
+        chunks = list(keys)
+        self.assertEqual(chunks[0].objects()[:2], [
+            {'Key': 'foo/0', 'VersionId': 'v0'},
+            {'Key': 'foo/0', 'VersionId': 'v1'}])
+        self.assertEqual(
+            [(k, v) for c in chunks for k, v in zip(c, c.versionIds)] +
+            list(keys.remainingKeys()), versions)
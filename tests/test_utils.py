@@ -0,0 +1,35 @@
+import unittest
+from tool_aws.utils import getTransformer, reprojectBBox
+
+
+BBOX = [2485000, 1075000, 2834000, 1296000]
+
+
+class TestUtils(unittest.TestCase):
+
+    def test_get_transformer_cached(self):
+        self.assertIs(getTransformer(2056, 4326), getTransformer(2056, 4326))
+        self.assertIsNot(getTransformer(2056, 4326),
+                         getTransformer(2056, 3857))
+
+    def test_reproject_bbox_same_srid(self):
+        self.assertEqual(reprojectBBox(BBOX, 2056), BBOX)
+
+    def test_reproject_bbox(self):
+        [minX, minY, maxX, maxY] = reprojectBBox(BBOX, 21781)
+        self.assertAlmostEqual(minX, 485000, places=3)
+        self.assertAlmostEqual(maxY, 296000, places=3)
+
+    def test_reproject_bbox_covers_edges(self):
+        [minX, minY, maxX, maxY] = reprojectBBox(BBOX, 4326)
+        transformer = getTransformer(2056, 4326)
+        # Points along the edges, not only the corners, are covered
+        for i in range(11):
+            x = BBOX[0] + (BBOX[2] - BBOX[0]) * i / 10.
+            for y in (BBOX[1], BBOX[3]):
+                lon, lat = transformer.transform(x, y)
+                self.assertTrue(minX <= lon <= maxX)
+                self.assertTrue(minY <= lat <= maxY)
+        corners = [transformer.transform(BBOX[0], BBOX[1]),
+                   transformer.transform(BBOX[2], BBOX[3])]
+        self.assertTrue(maxY > corners[1][1])
@@ -0,0 +1,4 @@
+from tool_aws.s3.deleter import Deleter
+from tool_aws.s3.results import DeleteStats
+
+__all__ = ['Deleter', 'DeleteStats']
@@ -0,0 +1,175 @@
+import os
+import threading
+
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+"""
+Function that returns a botocore config for long lived S3 clients.
+"""
+
+
+def getClientConfig(maxPoolConnections=DEFAULT_MAX_POOL_CONNECTIONS,
+                    connectTimeout=DEFAULT_CONNECT_TIMEOUT,
+                    readTimeout=DEFAULT_READ_TIMEOUT,
+                    maxAttempts=None,
+                    configClass=None):
+    if configClass is None:
+        from botocore.config import Config as configClass
+    options = {}
+    if maxAttempts is not None:
+        # Disable or limit the retries of botocore
+        options['retries'] = {
+            'total_max_attempts': maxAttempts, 'mode': 'standard'}
+    return configClass(
+        max_pool_connections=maxPoolConnections,
+        connect_timeout=connectTimeout,
+        read_timeout=readTimeout,
+        tcp_keepalive=True,
+        **options)
+
+
+"""
+Function that returns the options of a new client with the region and the
+(frozen) credentials of another session, the ones of the profile are used
+otherwise.
+"""
+
+
+def getClientOptions(credentials=None, regionName=None):
+    options = {}
+    if regionName is not None:
+        options['region_name'] = regionName
+    if credentials is not None:
+        options.update(
+            aws_access_key_id=credentials.access_key,
+            aws_secret_access_key=credentials.secret_key,
+            aws_session_token=credentials.token)
+    return options
+
+
+"""
+Function that returns a new S3 client.
+Connections are pooled by the client and kept alive between requests,
+so the client should be reused as much as possible.
+"""
+
+
+def createClient(profileName=None, endpointUrl=None, credentials=None,
+                 regionName=None, **configOptions):
+    import boto3
+    session = boto3.session.Session(profile_name=profileName)
+    return session.client(
+        's3', endpoint_url=endpointUrl,
+        config=getClientConfig(**configOptions),
+        **getClientOptions(credentials, regionName))
+
+
+"""
+Function that returns a new asynchronous S3 client context manager.
+aiobotocore is an optional dependency (pip install tool_aws[async]).
+"""
+
+
+def createAsyncClient(profileName=None, endpointUrl=None, credentials=None,
+                      regionName=None, **configOptions):
+    try:
+        from aiobotocore.session import AioSession
+        from aiobotocore.config import AioConfig
+    except ImportError:
+        raise RuntimeError(
+            'The asyncio engine requires aiobotocore '
+            '(pip install tool_aws[async])')
+    session = AioSession(profile=profileName)
+    return session.create_client(
+        's3', endpoint_url=endpointUrl,
+        config=getClientConfig(configClass=AioConfig, **configOptions),
+        **getClientOptions(credentials, regionName))
+
+
+class WorkerContext:
+    """
+    What the workers of a deletion need to send its requests: the bucket,
+    the retry policy, the optional rate limiter shared by all the workers
+    and the S3 clients. A given client is only used by the process that
+    created the context, otherwise a client is created lazily once per
+    process with profileName, endpointUrl, credentials, regionName and
+    configOptions. When using SSL and multiprocessing one needs to create
+    one connection per process.
+    See also: http://stackoverflow.com/questions/
+    3724900/python-ssl-problem-with-multiprocessing
+    credentials are the frozen credentials of a session (e.g. of an assumed
+    role), they are not refreshed by the clients of the context.
+    The asynchronous client is created on the event loop of the deletion,
+    it is closed by close.
+    """
+
+    def __init__(self, bucketName, profileName=None, endpointUrl=None,
+                 configOptions=None, backoff=None, rateLimiter=None,
+                 client=None, credentials=None, regionName=None):
+        self.bucketName = bucketName
+        self.profileName = profileName
+        self.endpointUrl = endpointUrl
+        self.credentials = credentials
+        self.regionName = regionName
+        self.configOptions = configOptions or {}
+        self.backoff = backoff
+        self.rateLimiter = rateLimiter
+        self._client = client
+        self._pid = os.getpid() if client is not None else None
+        self._lock = threading.Lock()
+        self._asyncClient = None
+        self._asyncClientContext = None
+        self._asyncLock = None
+
+    def __getstate__(self):
+        # The clients and locks are not sent to the worker processes
+        state = self.__dict__.copy()
+        state.update(_client=None, _pid=None, _lock=None, _asyncClient=None,
+                     _asyncClientContext=None, _asyncLock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def getClient(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._client = createClient(
+                        profileName=self.profileName,
+                        endpointUrl=self.endpointUrl,
+                        credentials=self.credentials,
+                        regionName=self.regionName,
+                        **self.configOptions)
+                    self._pid = pid
+        return self._client
+
+    async def getAsyncClient(self):
+        import asyncio
+        if self._asyncLock is None:
+            self._asyncLock = asyncio.Lock()
+        async with self._asyncLock:
+            if self._asyncClient is None:
+                context = createAsyncClient(
+                    profileName=self.profileName,
+                    endpointUrl=self.endpointUrl,
+                    credentials=self.credentials,
+                    regionName=self.regionName,
+                    **self.configOptions)
+                self._asyncClient = await context.__aenter__()
+                self._asyncClientContext = context
+        return self._asyncClient
+
+    async def close(self):
+        # Closes the asynchronous client created by the context
+        context = self._asyncClientContext
+        self._asyncLock = None
+        if context is not None:
+            self._asyncClient = None
+            self._asyncClientContext = None
+            await context.__aexit__(None, None, None)
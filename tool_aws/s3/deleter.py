@@ -0,0 +1,490 @@
+import os
+import time
+import logging
+import functools
+from contextlib import nullcontext
+from tool_aws.s3.keys import KeysChunk
+from tool_aws.s3.utils import S3Keys, iterChunks
+from tool_aws.s3.tiles import getPrefixSrids, DEFAULT_DENSITY_THRESHOLD
+from tool_aws.s3.listing import ClientBucket
+from tool_aws.s3.pipeline import prefetch
+from tool_aws.s3.ratelimit import RateLimiter
+from tool_aws.s3.results import DeleteStats, RetryQueue, REQUEST_FAILED_CODE
+from tool_aws.s3.metrics import Metrics, RequestTrace
+from tool_aws.s3.progress import ProgressReporter, DEFAULT_PROGRESS_INTERVAL
+from tool_aws.s3.engines import ENGINES, ProcessEngine, ThreadEngine, \
+    HybridEngine, AsyncioEngine, DEFAULT_THREADS_PER_PROCESS
+from tool_aws.s3.retry import Backoff, ConcurrencyController, isThrottle, \
+    isThrottleCode, isRetryableError, getRetryableErrors, \
+    DEFAULT_MAX_RETRIES, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY
+from tool_aws.s3.client import WorkerContext, getClientConfig, \
+    DEFAULT_MAX_POOL_CONNECTIONS, DEFAULT_CONNECT_TIMEOUT, \
+    DEFAULT_READ_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_CHUNK_SIZE = 1000
+# Number of chunks listed or generated ahead of the workers
+PREFETCH_CHUNKS = 64
+# Number of keys that could not be deleted kept in the stats
+MAX_REPORTED_FAILED_KEYS = 100
+
+
+def deleteResult(response, trace):
+    logger.debug('result: %s', response)
+    errors = response.get('Errors', [])
+    if any(isThrottleCode(e.get('Code')) for e in errors):
+        trace.throttles += 1
+    return trace.result(errors)
+
+
+def failedResult(keys, error, trace):
+    # The retry budget is exhausted (or the error is not transient), the
+    # parent decides whether the keys are sent again later
+    logger.error(error, exc_info=True)
+    logger.error('Giving up after %s retries' % trace.retries)
+    from botocore.exceptions import ClientError
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+    else:
+        code = REQUEST_FAILED_CODE
+    errors = [dict(obj, Code=code, Message=str(error))
+              for obj in keys.objects()]
+    return trace.result(errors)
+
+
+def retryDelay(backoff, error, retries):
+    delay = backoff.delay(retries)
+    logger.error('An error occurred (%s), retry %s/%s in %.1f sec...' % (
+        error, retries + 1, backoff.maxRetries, delay))
+    return delay
+
+
+"""
+Executor initializer of the worker processes. Spawned processes do not
+inherit the logging setup of the parent, it is set from logLevel.
+"""
+
+
+def initWorkerLogging(logLevel):
+    if logLevel is not None:
+        if not logging.getLogger().handlers:
+            logging.basicConfig(level=logging.INFO)
+        logging.getLogger('tool_aws').setLevel(logLevel)
+
+
+"""
+Function that deletes a chunk of keys with a single request with the
+client of the context, retried with the backoff of the context.
+"""
+
+
+def deleteKeys(keys, context):
+    client = context.getClient()
+    backoff = context.backoff or Backoff()
+    rateLimiter = context.rateLimiter
+    logger.debug('Worker pid %s and parent pid %s', os.getpid(),
+                 os.getppid())
+    logger.debug('Deleting %s keys at a time', len(keys))
+    trace = RequestTrace()
+    while True:
+        if rateLimiter is not None:
+            trace.rateWait += rateLimiter.acquire(len(keys))
+        start = time.time()
+        try:
+            response = client.delete_objects(
+                Bucket=context.bucketName, Delete=keys.payload())
+            trace.attempt(start)
+            return deleteResult(response, trace)
+        except getRetryableErrors() as e:
+            trace.attempt(start, e)
+            trace.throttles += isThrottle(e)
+            if trace.retries >= backoff.maxRetries or \
+                    not isRetryableError(e):
+                return failedResult(keys, e, trace)
+            time.sleep(retryDelay(backoff, e, trace.retries))
+            trace.retries += 1
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise e
+
+
+"""
+Coroutine that deletes a chunk of keys with the asynchronous client of the
+context.
+"""
+
+
+async def deleteKeysAsync(keys, context):
+    import asyncio
+    client = await context.getAsyncClient()
+    backoff = context.backoff or Backoff()
+    rateLimiter = context.rateLimiter
+    logger.debug('Deleting %s keys at a time', len(keys))
+    trace = RequestTrace()
+    while True:
+        if rateLimiter is not None:
+            delay = rateLimiter.reserve(len(keys))
+            if delay:
+                await asyncio.sleep(delay)
+            trace.rateWait += delay
+        start = time.time()
+        try:
+            response = await client.delete_objects(
+                Bucket=context.bucketName, Delete=keys.payload())
+            trace.attempt(start)
+            return deleteResult(response, trace)
+        except getRetryableErrors() as e:
+            trace.attempt(start, e)
+            trace.throttles += isThrottle(e)
+            if trace.retries >= backoff.maxRetries or \
+                    not isRetryableError(e):
+                return failedResult(keys, e, trace)
+            await asyncio.sleep(retryDelay(backoff, e, trace.retries))
+            trace.retries += 1
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise e
+
+
+def iterPayloads(keys, chunkSize):
+    # The first batch has already been loaded for the confirmation
+    for payload in keys:
+        yield payload
+    for cKeys in iterChunks(keys.remainingKeys(), chunkSize):
+        yield KeysChunk.fromItems(cKeys)
+
+
+def toObject(item):
+    # A key, a (key, versionId) pair or an object of a listing
+    if isinstance(item, dict):
+        return item
+    if isinstance(item, tuple):
+        return {'Key': item[0], 'VersionId': item[1]}
+    return {'Key': item}
+
+
+def withRetries(payloads, retryQueue):
+    # Failed keys are sent again as soon as they fill a chunk
+    for payload in payloads:
+        for retryPayload in retryQueue.iterReady():
+            yield retryPayload
+        yield payload
+
+
+def processResults(engine, func, payloads, stats, retryQueue, journal=None,
+                   metrics=None, progress=None, onError=None):
+    for payload, result in engine.run(func, payloads):
+        engine.controller.record(result['Throttles'])
+        if metrics is not None:
+            metrics.record(payload, result)
+        errors = result['Errors']
+        retryQueue.done(payload)
+        failed = retryQueue.put(errors)
+        if journal is not None:
+            journal.done(
+                payload, len(errors) - len(failed), retryQueue.drained)
+        stats.requests += 1 + result['Retries']
+        stats.requestRetries += result['Retries']
+        stats.deleted += len(payload) - len(errors)
+        stats.retried += len(errors) - len(failed)
+        stats.failed += len(failed)
+        for error in failed:
+            logger.error('Could not delete %s: %s (%s)' % (
+                error['Key'], error.get('Code'), error.get('Message')))
+            if len(stats.failedKeys) < MAX_REPORTED_FAILED_KEYS:
+                stats.failedKeys.append(error['Key'])
+            if onError is not None:
+                onError(error)
+        if progress is not None:
+            progress.record(payload, errors, failed)
+            for i in progress.completed():
+                logger.info('Target %s done: %s' % (
+                    progress.names[i], progress.stats[i]))
+        if metrics is not None:
+            metrics.tick(stats)
+        yield stats
+
+
+class Deleter:
+    """
+    Deletes keys of a bucket with delete_objects requests of chunkSize keys
+    sent by the workers of an engine: concurrency threads sharing a client,
+    processes, processes running threadsPerProcess threads or coroutines
+    (see tool_aws.s3.engines).
+    The threads use the given client, or the one of session, or a client
+    created once from profileName and endpointUrl. The processes and the
+    event loops of the asyncio engine create their own clients, with the
+    endpoint, the region and the (frozen) credentials of session. A client
+    alone can only be used by the threads.
+    delete deletes the keys of prefixKeys, of tileKeys or of any iterable
+    and returns the DeleteStats of the deletion, deleteAsync awaits it and
+    run yields the stats along the way. A deleter holds no state of its
+    deletions, it can be used for several of them.
+    A request is retried maxRetries times with an exponential backoff by
+    its worker, the keys failing in a response are sent again maxRetries
+    times at most. maxRequestsPerSecond and maxKeysPerSecond limit all the
+    workers of all the deletions of the deleter.
+    onProgress is called with the stats of a deletion every
+    progressInterval seconds and once it is done, onError with each key
+    that could not be deleted (Key, VersionId, Code and Message).
+    logLevel is the level of the tool_aws logs of the worker processes.
+    """
+
+    def __init__(self, bucketName, client=None, session=None,
+                 profileName=None, endpointUrl=None, engine='thread',
+                 concurrency=DEFAULT_CONCURRENCY,
+                 threadsPerProcess=DEFAULT_THREADS_PER_PROCESS,
+                 chunkSize=DEFAULT_CHUNK_SIZE,
+                 maxRetries=DEFAULT_MAX_RETRIES,
+                 retryBaseDelay=DEFAULT_RETRY_BASE_DELAY,
+                 retryMaxDelay=DEFAULT_RETRY_MAX_DELAY,
+                 maxRequestsPerSecond=None, maxKeysPerSecond=None,
+                 maxPoolConnections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 connectTimeout=DEFAULT_CONNECT_TIMEOUT,
+                 readTimeout=DEFAULT_READ_TIMEOUT,
+                 progressInterval=DEFAULT_PROGRESS_INTERVAL,
+                 onProgress=None, onError=None, logLevel=None):
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine %s, use one of %s' % (
+                engine, ', '.join(ENGINES)))
+        self.bucketName = bucketName
+        self.engine = engine
+        self.concurrency = concurrency
+        self.threadsPerProcess = threadsPerProcess
+        self.chunkSize = chunkSize
+        self.progressInterval = progressInterval
+        self.onProgress = onProgress
+        self.onError = onError
+        self.backoff = Backoff(maxRetries, retryBaseDelay, retryMaxDelay)
+        # The budget is shared by the workers of all the deletions
+        self.rateLimiter = None
+        if maxRequestsPerSecond or maxKeysPerSecond:
+            self.rateLimiter = RateLimiter(
+                maxRequestsPerSecond, maxKeysPerSecond)
+        self.configOptions = {
+            'maxPoolConnections': max(
+                maxPoolConnections, self.clientConcurrency),
+            'connectTimeout': connectTimeout,
+            'readTimeout': readTimeout,
+            # Retries are handled by the workers
+            'maxAttempts': 1
+        }
+        self.logLevel = logLevel
+        credentials = None
+        regionName = None
+        if session is not None:
+            profileName = profileName or session.profile_name
+            regionName = session.region_name
+            # The clients of the worker processes use the same credentials
+            # (e.g. of an assumed role), until they expire
+            credentials = session.get_credentials()
+            if credentials is not None:
+                credentials = credentials.get_frozen_credentials()
+            if client is None:
+                client = session.client(
+                    's3', endpoint_url=endpointUrl,
+                    config=getClientConfig(**self.configOptions))
+        elif client is not None and engine != 'thread':
+            raise ValueError('The credentials of a client can not be sent to '
+                             'the workers of the %s engine, give its '
+                             'session instead' % engine)
+        if client is not None and endpointUrl is None:
+            # The clients of the worker processes use the same endpoint
+            endpointUrl = client.meta.endpoint_url
+        self.profileName = profileName
+        self.endpointUrl = endpointUrl
+        self.credentials = credentials
+        self.regionName = regionName
+        self.context = WorkerContext(
+            bucketName, profileName, endpointUrl, self.configOptions,
+            self.backoff, self.rateLimiter, client=client,
+            credentials=credentials, regionName=regionName)
+
+    @property
+    def clientConcurrency(self):
+        # Number of concurrent requests sharing the same client
+        return {
+            'process': 1,
+            'thread': self.concurrency,
+            'hybrid': self.threadsPerProcess,
+            'asyncio': self.concurrency
+        }[self.engine]
+
+    @property
+    def requestConcurrency(self):
+        # Number of DELETE requests sent at a time
+        if self.engine == 'hybrid':
+            return self.concurrency * self.threadsPerProcess
+        return self.concurrency
+
+    @property
+    def client(self):
+        return self.context.getClient()
+
+    def createEngine(self):
+        # Returns the engine of a deletion and the function of its workers
+        if self.engine == 'thread':
+            engine = ThreadEngine(self.concurrency, context=self.context)
+            func = deleteKeys
+        elif self.engine == 'asyncio':
+            # The asynchronous client is bound to the loop of the deletion
+            context = WorkerContext(
+                self.bucketName, self.profileName, self.endpointUrl,
+                self.configOptions, self.backoff, self.rateLimiter,
+                credentials=self.credentials, regionName=self.regionName)
+            engine = AsyncioEngine(
+                self.concurrency, finalizer=context.close, context=context)
+            func = deleteKeysAsync
+        elif self.engine == 'hybrid':
+            engine = HybridEngine(
+                self.concurrency, self.threadsPerProcess, initWorkerLogging,
+                (self.logLevel,), context=self.context)
+            func = deleteKeys
+        else:
+            engine = ProcessEngine(
+                self.concurrency, initWorkerLogging, (self.logLevel,),
+                context=self.context)
+            func = deleteKeys
+        # Concurrency is reduced on throttling signals from any worker
+        engine.controller = ConcurrencyController(engine.concurrency)
+        return engine, func
+
+    def run(self, payloads, total=None, journal=None, metrics=None,
+            progress=None):
+        # Listing (or keys generation) and deletion overlap: payloads are
+        # produced in a background thread while a single engine deletes
+        # them. The stats are yielded with each progress line, every
+        # progressInterval seconds, and at the end
+        metrics = metrics or Metrics()
+        payloads = metrics.timeIterator('keys', payloads, 'keys')
+        if journal is not None:
+            payloads = journal.track(payloads)
+        stats = DeleteStats()
+        retryQueue = RetryQueue(self.chunkSize, self.backoff.maxRetries)
+        reporter = ProgressReporter(total, self.progressInterval)
+        rateLimiter = self.rateLimiter
+        if rateLimiter is not None:
+            logger.info('The deletion is limited to %s' % rateLimiter)
+            reporter.details.append(
+                lambda stats: 'rate: %s' % rateLimiter.report(
+                    stats.requests,
+                    stats.deleted + stats.retried + stats.failed))
+        if progress is not None:
+            reporter.details.append(lambda stats: progress.describe())
+        nbRounds = 0
+        engine, func = self.createEngine()
+        with engine, journal or nullcontext(), metrics.timer('deletion'):
+            payloads = prefetch(
+                withRetries(payloads, retryQueue), PREFETCH_CHUNKS)
+            while payloads is not None:
+                for stats in processResults(
+                        engine, func, metrics.track(payloads), stats,
+                        retryQueue, journal, metrics, progress,
+                        self.onError):
+                    if reporter.update(stats):
+                        yield self.notify(stats)
+                payloads = None
+                # Remaining failed keys, the number of rounds is bounded by
+                # the number of retries per key
+                if len(retryQueue):
+                    delay = self.backoff.delay(nbRounds)
+                    logger.info('Retrying %s failed keys in %.1f sec...' % (
+                        len(retryQueue), delay))
+                    with metrics.timer('retryWait'):
+                        time.sleep(delay)
+                    retryQueue.flush()
+                    payloads = retryQueue.iterReady()
+                    nbRounds += 1
+        if journal is not None:
+            # The job is complete
+            journal.remove()
+        reporter.update(stats, force=True)
+        yield self.notify(stats)
+
+    def notify(self, stats):
+        if self.onProgress is not None:
+            self.onProgress(stats)
+        return stats
+
+    def getPayloads(self, source):
+        if isinstance(source, S3Keys):
+            source.chunk(self.chunkSize)
+            return iterPayloads(source, self.chunkSize)
+        if isinstance(source, str):
+            raise TypeError('Use prefixKeys to delete the keys of a prefix')
+        return (KeysChunk.fromObjects([toObject(i) for i in items])
+                for items in iterChunks(source, self.chunkSize))
+
+    def countKeys(self, source):
+        # The number of keys of a source, if known before listing it
+        if isinstance(source, S3Keys):
+            return source.countTiles() or None
+        if hasattr(source, '__len__'):
+            return len(source)
+        return None
+
+    def delete(self, source, total=None, metrics=None):
+        # Deletes the keys of source and returns the DeleteStats of the
+        # deletion. source is the S3Keys of prefixKeys or tileKeys or any
+        # iterable of keys, (key, versionId) pairs or listed objects.
+        stats = DeleteStats()
+        for stats in self.run(self.getPayloads(source),
+                              total or self.countKeys(source),
+                              metrics=metrics):
+            pass
+        return stats
+
+    async def deleteAsync(self, source, total=None, metrics=None):
+        # The deletion blocks a thread of the default executor of the loop,
+        # the callbacks are called from that thread
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.delete, source, total, metrics))
+
+    def getBucket(self):
+        return ClientBucket(self.client, self.bucketName)
+
+    def prefixKeys(self, prefix, listDepth=0, listParallelism=None,
+                   allVersions=False, shard=None):
+        # Returns the keys of a prefix (every version of them with
+        # allVersions), listed in shards listDepth levels below the prefix by
+        # listParallelism threads. With a shard, only the keys of the
+        # sub-prefixes listDepth levels below the prefix falling in the shard
+        # are listed.
+        if shard is not None and listDepth < 1:
+            raise ValueError('The keys of a prefix are split by sub-prefix, '
+                             'a shard requires a listDepth of 1 or more')
+        return S3Keys(
+            self.getBucket(), '/' + prefix.lstrip('/'),
+            listDepth=listDepth,
+            listParallelism=listParallelism or self.concurrency,
+            versions=allVersions, shard=shard)
+
+    def tileKeys(self, prefix, bbox=None, geometry=None, imageFormat='png',
+                 lowRes=float('inf'), highRes=0, skipMissing=False,
+                 allVersions=False, shard=None, listParallelism=None,
+                 densityThreshold=DEFAULT_DENSITY_THRESHOLD):
+        # Returns the keys of the tiles of a prefix stopping at the timestamp
+        # or the srid level, in a bbox (in 2056) or intersecting a geometry,
+        # between the lowest and the highest resolution. With skipMissing,
+        # the existing tiles are listed, with allVersions, every version of
+        # them. With a shard, only the columns of the shard are selected.
+        if geometry is not None:
+            if bbox:
+                raise ValueError('The tiles are selected either by a bbox '
+                                 'or by a geometry')
+            bbox = geometry.bounds
+        if not bbox:
+            raise ValueError('A bbox or a geometry is required')
+        prefix = '/' + prefix.strip('/*') + '/'
+        return S3Keys(
+            self.getBucket(), prefix, srids=getPrefixSrids(prefix),
+            bbox=bbox, imageFormat=imageFormat, lowRes=lowRes,
+            highRes=highRes,
+            listParallelism=listParallelism or self.concurrency,
+            skipMissing=skipMissing, densityThreshold=densityThreshold,
+            versions=allVersions, shard=shard, geometry=geometry)
@@ -0,0 +1,159 @@
+import math
+import time
+from tool_aws.s3.listing import getObjectsPagesFromS3, \
+    getObjectVersionsPagesFromS3, getObjectsPagesSharded
+
+
+# Sustained DELETE rate of S3 in keys per second (each key of a
+# delete_objects request counts) and per prefix partition
+S3_DELETE_RATE = 3500
+# Default number of path levels of the shards listed in parallel
+DEFAULT_PLAN_LIST_DEPTH = 2
+# Default number of path levels of the reported sub-prefixes
+DEFAULT_PLAN_DEPTH = 1
+
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+
+class PrefixUsage:
+    """
+    Number of objects and total size in bytes of a sub-prefix.
+    """
+
+    __slots__ = ('count', 'size')
+
+    def __init__(self, count=0, size=0):
+        self.count = count
+        self.size = size
+
+    def add(self, count, size):
+        self.count += count
+        self.size += size
+
+    def toDict(self):
+        return {'count': self.count, 'size': self.size}
+
+
+"""
+Function that returns the sub-prefix of a key, depth path levels below
+prefix. The keys located above that level are grouped under prefix.
+"""
+
+
+def getSubPrefix(key, prefix, depth):
+    parts = key[len(prefix):].split('/', depth)
+    if len(parts) <= depth:
+        return prefix
+    return prefix + '/'.join(parts[:depth]) + '/'
+
+
+"""
+Function that returns the number of objects and the size per sub-prefix
+of a prefix (depth levels below it), only the keys accepted by keysFilter
+are counted. The listing is split in shards listDepth levels below the
+prefix and listed by parallelism threads. If versions is True, every
+version and delete marker is counted. If shard is defined, only the keys
+of the shard are counted.
+Returns the usage per sub-prefix and the latency of the listing requests.
+"""
+
+
+def getUsage(s3Bucket, prefix, depth=DEFAULT_PLAN_DEPTH,
+             listDepth=DEFAULT_PLAN_LIST_DEPTH, parallelism=1,
+             keysFilter=None, versions=False, shard=None):
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    latencies = []
+
+    def listShard(s3Bucket, shard, pageSize):
+        if versions:
+            pages = getObjectVersionsPagesFromS3(
+                s3Bucket, shard, pageSize=pageSize)
+        else:
+            pages = getObjectsPagesFromS3(s3Bucket, shard, pageSize=pageSize)
+        while True:
+            start = time.time()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            latencies.append(time.time() - start)
+            yield page
+
+    usage = {}
+    for page in getObjectsPagesSharded(
+            s3Bucket, prefix, listDepth, parallelism, listShard=listShard,
+            versions=versions, shard=shard):
+        for o in page:
+            key = o['Key']
+            if keysFilter is not None and not keysFilter(key):
+                continue
+            subPrefix = getSubPrefix(key, prefix, depth)
+            if subPrefix not in usage:
+                usage[subPrefix] = PrefixUsage()
+            usage[subPrefix].add(1, o.get('Size', 0))
+    return usage, latencies
+
+
+"""
+Function that estimates the number of DELETE requests and the wall time
+of the deletion of nbKeys keys by chunks of chunkSize, concurrency requests
+at a time lasting latency seconds each. The estimate can not be faster than
+the DELETE rate of S3 for a single prefix partition.
+"""
+
+
+def estimateDeletion(nbKeys, chunkSize, concurrency, latency,
+                     rate=S3_DELETE_RATE):
+    nbRequests = int(math.ceil(float(nbKeys) / chunkSize))
+    latencyBound = nbRequests * latency / concurrency
+    rateBound = float(nbKeys) / rate
+    return {
+        'requests': nbRequests,
+        'seconds': max(latencyBound, rateBound),
+        'latencyBound': latencyBound,
+        'rateBound': rateBound
+    }
+
+
+"""
+Function that returns the median of a list of values, or None.
+"""
+
+
+def median(values):
+    if not values:
+        return None
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+"""
+Function that returns a size in bytes in a human readable form.
+"""
+
+
+def humanSize(size):
+    for unit in SIZE_UNITS[:-1]:
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit) if unit != 'B' \
+                else '%d %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f %s' % (size, SIZE_UNITS[-1])
+
+
+"""
+Function that returns a duration in seconds in a human readable form.
+"""
+
+
+def humanDuration(seconds):
+    minutes, seconds = divmod(int(math.ceil(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%dh%02dm%02ds' % (hours, minutes, seconds)
+    if minutes:
+        return '%dm%02ds' % (minutes, seconds)
+    return '%ds' % seconds
@@ -0,0 +1,271 @@
+import threading
+import functools
+from queue import Queue
+from tool_aws.s3.pipeline import END, ProducerError, consume, runPipeline
+from tool_aws.s3.utils import iterChunks
+
+
+ENGINES = ('process', 'thread', 'hybrid', 'asyncio')
+DEFAULT_THREADS_PER_PROCESS = 8
+
+# Per process state of the workers of the process and hybrid engines
+_process = {}
+
+
+class Engine:
+    """
+    Base class of the execution engines. An engine is a long lived pool
+    of workers used as a context manager. run yields (payload, result)
+    for every payload as soon as it has been processed.
+    The initializer is called once per worker.
+    The optional controller limits the number of payloads in flight.
+    The optional context is passed to func with every payload (as its
+    context argument), it is sent once to each worker process.
+    """
+
+    def __init__(self, initializer=None, initargs=(), controller=None,
+                 context=None):
+        self._initializer = initializer
+        self._initargs = initargs
+        self.controller = controller
+        self.context = context
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.shutdown()
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def run(self, func, payloads):
+        raise NotImplementedError
+
+    def bind(self, func):
+        # The function called by the workers with each payload
+        if self.context is None:
+            return func
+        return functools.partial(func, context=self.context)
+
+    def maxInFlight(self):
+        # Keep one payload queued per worker at full speed
+        if self.controller is None or \
+                self.controller.limit >= self.concurrency:
+            return 2 * self.concurrency
+        return self.controller.limit
+
+    @property
+    def concurrency(self):
+        raise NotImplementedError
+
+
+class _ExecutorEngine(Engine):
+
+    def __init__(self, nbWorkers, initializer=None, initargs=(),
+                 controller=None, context=None):
+        Engine.__init__(self, initializer, initargs, controller, context)
+        self._nbWorkers = nbWorkers
+        self._executor = None
+
+    def start(self):
+        self._executor = self.createExecutor(
+            max_workers=self._nbWorkers,
+            initializer=self._initializer,
+            initargs=self._initargs)
+
+    def createExecutor(self, **options):
+        raise NotImplementedError
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def run(self, func, payloads):
+        return runPipeline(
+            self._executor, self.bind(func), payloads,
+            maxInFlight=self.maxInFlight)
+
+    @property
+    def concurrency(self):
+        return self._nbWorkers
+
+
+class ThreadEngine(_ExecutorEngine):
+    """
+    Pool of threads sharing a single client. Payloads are not pickled.
+    """
+
+    def createExecutor(self, **options):
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(**options)
+
+
+def _initProcessWorker(context, initializer, initargs):
+    _process['context'] = context
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _runWithContext(func, payload):
+    return func(payload, context=_process['context'])
+
+
+class ProcessEngine(_ExecutorEngine):
+    """
+    Pool of processes, one client per process.
+    """
+
+    def createExecutor(self, **options):
+        from concurrent.futures import ProcessPoolExecutor
+        options['initargs'] = (
+            self.context, options['initializer'], options['initargs'])
+        options['initializer'] = _initProcessWorker
+        return ProcessPoolExecutor(**options)
+
+    def bind(self, func):
+        # The context of the worker process, it is not sent with every
+        # payload
+        if self.context is None:
+            return func
+        return functools.partial(_runWithContext, func)
+
+
+def _initHybridWorker(nbThreads, context, initializer, initargs):
+    from concurrent.futures import ThreadPoolExecutor
+    _initProcessWorker(context, initializer, initargs)
+    _process['executor'] = ThreadPoolExecutor(max_workers=nbThreads)
+
+
+def _runHybridBatch(func, payloads):
+    return list(_process['executor'].map(func, payloads))
+
+
+class HybridEngine(Engine):
+    """
+    Pool of nbProcesses processes running nbThreads threads each.
+    The threads of a process share the client of the process.
+    Payloads are sent to the processes by batches of nbThreads.
+    """
+
+    def __init__(self, nbProcesses, nbThreads, initializer=None, initargs=(),
+                 controller=None, context=None):
+        Engine.__init__(self, initializer, initargs, controller, context)
+        self._nbProcesses = nbProcesses
+        self._nbThreads = nbThreads
+        self._executor = None
+
+    def start(self):
+        from concurrent.futures import ProcessPoolExecutor
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._nbProcesses,
+            initializer=_initHybridWorker,
+            initargs=(self._nbThreads, self.context, self._initializer,
+                      self._initargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def run(self, func, payloads):
+        for batch, results in runPipeline(
+                self._executor,
+                functools.partial(_runHybridBatch, self.bind(func)),
+                iterChunks(payloads, self._nbThreads),
+                maxInFlight=lambda: max(
+                    1, self.maxInFlight() // self._nbThreads)):
+            for payload, result in zip(batch, results):
+                yield payload, result
+
+    @property
+    def concurrency(self):
+        return self._nbProcesses * self._nbThreads
+
+    def bind(self, func):
+        if self.context is None:
+            return func
+        return functools.partial(_runWithContext, func)
+
+
+class AsyncioEngine(Engine):
+    """
+    Event loop running up to concurrency coroutines at a time in a
+    background thread. func must be a coroutine function.
+    finalizer is an optional coroutine function awaited before the loop
+    is closed (e.g. to close the clients).
+    """
+
+    def __init__(self, concurrency, initializer=None, initargs=(),
+                 finalizer=None, controller=None, context=None):
+        Engine.__init__(self, initializer, initargs, controller, context)
+        self._concurrency = concurrency
+        self._finalizer = finalizer
+
+    def start(self):
+        if self._initializer is not None:
+            self._initializer(*self._initargs)
+
+    def run(self, func, payloads):
+        results = Queue()
+        stopped = threading.Event()
+        loop = threading.Thread(
+            target=self._runLoop,
+            args=(self.bind(func), iter(payloads), results, stopped),
+            name='s3rm-asyncio')
+        loop.daemon = True
+        loop.start()
+        try:
+            for result in consume(results, 1):
+                yield result
+        finally:
+            stopped.set()
+            loop.join()
+
+    def _runLoop(self, func, payloads, results, stopped):
+        import asyncio
+        try:
+            asyncio.run(self._main(func, payloads, results, stopped))
+        except Exception as e:
+            results.put(ProducerError(e))
+        finally:
+            results.put(END)
+
+    async def _main(self, func, payloads, results, stopped):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        lock = asyncio.Lock()
+        state = {'inFlight': 0}
+
+        async def worker():
+            while not stopped.is_set():
+                async with lock:
+                    while state['inFlight'] >= self.maxInFlight():
+                        await asyncio.sleep(0.01)
+                    # The payloads are produced by blocking iterators
+                    payload = await loop.run_in_executor(
+                        None, next, payloads, END)
+                    if payload is END:
+                        return
+                    state['inFlight'] += 1
+                try:
+                    result = await func(payload)
+                finally:
+                    state['inFlight'] -= 1
+                results.put((payload, result))
+
+        try:
+            await asyncio.gather(
+                *[worker() for i in range(self._concurrency)])
+        finally:
+            if self._finalizer is not None:
+                await self._finalizer()
+
+    def maxInFlight(self):
+        # Coroutines do not queue payloads
+        return min(Engine.maxInFlight(self), self.concurrency)
+
+    @property
+    def concurrency(self):
+        return self._concurrency
@@ -0,0 +1,406 @@
+import re
+import json
+import bisect
+import hashlib
+from tool_aws.utils import getTransformer, DENSIFY_POINTS
+
+
+CRS_PATTERN = re.compile(r'(?:EPSG|CRS)[:/]+(?:[^:/]*[:/]+)*(\d+)$',
+                         re.IGNORECASE)
+WKT_COORDS_PATTERN = re.compile(
+    r'([-+.\deE]+)\s+([-+.\deE]+)(?:\s+[-+.\deE]+){0,2}')
+
+
+class Geometry:
+    """
+    A polygon or a multipolygon given as a list of polygons, each being
+    a list of rings (the exterior ring followed by the holes) of (x, y)
+    points in a srid. Geometries with the same points are equal so that
+    the tiles selected for them can be cached.
+    """
+
+    def __init__(self, polygons, srid=2056):
+        self.polygons = [
+            [[(float(x), float(y)) for x, y in ring] for ring in polygon]
+            for polygon in polygons]
+        self.srid = srid
+        if not self.polygons or \
+                any(len(ring) < 3 for p in self.polygons for ring in p):
+            raise ValueError('A geometry is made of polygons')
+        self.digest = hashlib.sha1(
+            json.dumps([srid, self.polygons]).encode('utf-8')).hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, Geometry) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return 'Geometry(%s polygons, srid %s)' % (
+            len(self.polygons), self.srid)
+
+    @property
+    def bounds(self):
+        xs = [x for p in self.polygons for ring in p for x, y in ring]
+        ys = [y for p in self.polygons for ring in p for x, y in ring]
+        return [min(xs), min(ys), max(xs), max(ys)]
+
+    @property
+    def edges(self):
+        # (x1, y1, x2, y2, index of the polygon), rings are closed
+        edges = []
+        for p, polygon in enumerate(self.polygons):
+            for ring in polygon:
+                for i in range(len(ring)):
+                    (x1, y1), (x2, y2) = ring[i - 1], ring[i]
+                    if (x1, y1) != (x2, y2):
+                        edges.append((x1, y1, x2, y2, p))
+        return edges
+
+    def reproject(self, srid):
+        if srid == self.srid:
+            return self
+        transformer = getTransformer(self.srid, srid)
+        polygons = []
+        for polygon in self.polygons:
+            rings = []
+            for ring in polygon:
+                # The straight edges are curved once reprojected
+                ring = densifyRing(ring)
+                xs, ys = transformer.transform(
+                    [x for x, y in ring], [y for x, y in ring])
+                rings.append(list(zip(xs, ys)))
+            polygons.append(rings)
+        return Geometry(polygons, srid)
+
+
+"""
+Function that returns a ring with points points added on each of its edges,
+as the edges of a bbox before reprojecting it.
+"""
+
+
+def densifyRing(ring, points=DENSIFY_POINTS):
+    dense = []
+    for i, (x1, y1) in enumerate(ring):
+        x2, y2 = ring[(i + 1) % len(ring)]
+        dense.append((x1, y1))
+        if (x1, y1) == (x2, y2):
+            continue
+        for j in range(1, points + 1):
+            f = float(j) / (points + 1)
+            dense.append((x1 + f * (x2 - x1), y1 + f * (y2 - y1)))
+    return dense
+
+
+"""
+Function that returns the srid of a CRS name such as EPSG:2056 or
+urn:ogc:def:crs:EPSG::2056.
+"""
+
+
+def parseCRS(name):
+    match = CRS_PATTERN.search(name.strip())
+    if match is None:
+        raise ValueError('Unsupported CRS %s' % name)
+    return int(match.group(1))
+
+
+"""
+Function that returns the polygons of a GeoJSON object: a Polygon,
+a MultiPolygon, a GeometryCollection, a Feature or a FeatureCollection of
+them.
+"""
+
+
+def getGeoJSONPolygons(obj):
+    kind = obj.get('type')
+    if kind == 'FeatureCollection':
+        return [p for f in obj.get('features', [])
+                for p in getGeoJSONPolygons(f)]
+    if kind == 'Feature':
+        return getGeoJSONPolygons(obj.get('geometry') or {})
+    if kind == 'GeometryCollection':
+        return [p for g in obj.get('geometries', [])
+                for p in getGeoJSONPolygons(g)]
+    if kind == 'Polygon':
+        return [obj['coordinates']]
+    if kind == 'MultiPolygon':
+        return obj['coordinates']
+    raise ValueError('Unsupported geometry type %s' % kind)
+
+
+"""
+Function that returns the geometry of a GeoJSON object. Coordinates are
+in 2056 unless the object declares another CRS.
+"""
+
+
+def parseGeoJSON(obj):
+    srid = 2056
+    crs = obj.get('crs')
+    if crs:
+        srid = parseCRS(crs.get('properties', {}).get('name', ''))
+    # Only x and y are used
+    polygons = [[[point[:2] for point in ring] for ring in polygon]
+                for polygon in getGeoJSONPolygons(obj)]
+    return Geometry(polygons, srid)
+
+
+"""
+Function that returns the geometry of a WKT POLYGON or MULTIPOLYGON.
+Coordinates are in 2056 unless the text starts with SRID=<srid>; (EWKT).
+"""
+
+
+def parseWKT(text):
+    srid = 2056
+    text = text.strip()
+    if text.upper().startswith('SRID='):
+        sridPart, text = text.split(';', 1)
+        srid = int(sridPart[5:])
+        text = text.strip()
+    match = re.match(r'(MULTIPOLYGON|POLYGON)\s*(?:Z|M|ZM)?\s*(\(.*\))$',
+                     text, re.IGNORECASE | re.DOTALL)
+    if match is None:
+        raise ValueError('Unsupported WKT geometry %s' % text[:30])
+    kind, body = match.groups()
+    body = WKT_COORDS_PATTERN.sub(r'[\1, \2]', body)
+    coordinates = json.loads(body.replace('(', '[').replace(')', ']'))
+    if kind.upper() == 'POLYGON':
+        coordinates = [coordinates]
+    return Geometry(coordinates, srid)
+
+
+"""
+Function that returns the geometry of a GeoJSON or WKT file, reprojected
+in 2056.
+"""
+
+
+def loadGeometry(path):
+    with open(path) as f:
+        content = f.read()
+    if content.lstrip().startswith('{'):
+        geometry = parseGeoJSON(json.loads(content))
+    else:
+        geometry = parseWKT(content)
+    return geometry.reproject(2056)
+
+
+"""
+Function that tells whether a segment intersects (or touches) a box
+[minX, minY, maxX, maxY] (Liang-Barsky clipping).
+"""
+
+
+def segmentIntersectsBox(edge, box):
+    x1, y1, x2, y2 = edge[:4]
+    [minX, minY, maxX, maxY] = box
+    if max(x1, x2) < minX or min(x1, x2) > maxX or \
+            max(y1, y2) < minY or min(y1, y2) > maxY:
+        return False
+    if minX <= x1 <= maxX and minY <= y1 <= maxY:
+        return True
+    dx = x2 - x1
+    dy = y2 - y1
+    t0, t1 = 0., 1.
+    for p, q in ((-dx, x1 - minX), (dx, maxX - x1),
+                 (-dy, y1 - minY), (dy, maxY - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = float(q) / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return False
+    return True
+
+
+"""
+Function that tells whether a point is inside a geometry given its edges,
+or at least all the edges that cross the horizontal line of the point.
+A point is inside when it is inside any of the polygons (even-odd rule
+within a polygon, so that its holes are excluded).
+"""
+
+
+def containsPoint(edges, point):
+    x, y = point
+    inside = set()
+    for x1, y1, x2, y2, p in edges:
+        if (y1 > y) != (y2 > y) and \
+                x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside.symmetric_difference_update([p])
+    return bool(inside)
+
+
+class EdgesIndex:
+    """
+    The edges of a geometry grouped by horizontal bands, so that locating
+    a point only tests the edges of its band.
+    """
+
+    def __init__(self, edges, nbBands=1024):
+        ys = [y for e in edges for y in (e[1], e[3])]
+        self._minY, self._maxY = min(ys), max(ys)
+        self._nbBands = max(1, min(nbBands, len(edges)))
+        self._height = (self._maxY - self._minY) / self._nbBands or 1.
+        self._bands = [[] for i in range(self._nbBands)]
+        for e in edges:
+            for i in range(self.getBand(min(e[1], e[3])),
+                           self.getBand(max(e[1], e[3])) + 1):
+                self._bands[i].append(e)
+
+    def getBand(self, y):
+        return min(int((y - self._minY) / self._height), self._nbBands - 1)
+
+    def contains(self, point):
+        if not self._minY <= point[1] <= self._maxY:
+            return False
+        return containsPoint(self._bands[self.getBand(point[1])], point)
+
+
+class TileSelection:
+    """
+    The tiles of a zoom that intersect a geometry, as sorted and merged
+    ranges of columns by row of the tile grid.
+    """
+
+    def __init__(self, ranges):
+        self._ranges = {}
+        for row, colRanges in ranges.items():
+            merged = []
+            for start, stop in sorted(colRanges):
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], stop)
+                else:
+                    merged.append([start, stop])
+            self._ranges[row] = [tuple(r) for r in merged]
+        self._starts = dict((row, [r[0] for r in colRanges])
+                            for row, colRanges in self._ranges.items())
+
+    def __contains__(self, address):
+        row, col = address
+        starts = self._starts.get(row)
+        if not starts:
+            return False
+        i = bisect.bisect_right(starts, col) - 1
+        return i >= 0 and col < self._ranges[row][i][1]
+
+    def __len__(self):
+        return self.count()
+
+    def rows(self):
+        return sorted(self._ranges)
+
+    def getColumnRanges(self, row, cols=None):
+        # Ranges of columns of a row, clipped to the range cols
+        colRanges = self._ranges.get(row, [])
+        if cols is None:
+            return [range(start, stop) for start, stop in colRanges]
+        clipped = []
+        for start, stop in colRanges:
+            start, stop = max(start, cols.start), min(stop, cols.stop)
+            if start < stop:
+                clipped.append(range(start, stop))
+        return clipped
+
+    def getColumns(self):
+        # Columns with at least one tile, as merged ranges
+        return TileSelection({0: [
+            r for colRanges in self._ranges.values()
+            for r in colRanges]}).getColumnRanges(0)
+
+    def getKeysColumn(self, col, swap=False):
+        # Rows of a column of the tiles keys, a row of the tile grid if
+        # swap (21781)
+        return KeysColumn(self, col, swap)
+
+    def count(self, rows=None, cols=None):
+        return sum(len(r) for row in self._ranges
+                   if rows is None or row in rows
+                   for r in self.getColumnRanges(row, cols))
+
+
+class KeysColumn:
+    """
+    The rows of the tiles keys of a column (a directory of a zoom) that
+    intersect a geometry. In 21781, the columns of the keys are the rows of
+    the tile grid.
+    """
+
+    def __init__(self, selection, col, swap):
+        self._selection = selection
+        self._col = col
+        self._swap = swap
+
+    def __contains__(self, row):
+        if self._swap:
+            return (self._col, row) in self._selection
+        return (row, self._col) in self._selection
+
+    def __len__(self):
+        if self._swap:
+            return sum(len(r) for r in
+                       self._selection.getColumnRanges(self._col))
+        return sum(1 for row in self._selection.rows()
+                   if (row, self._col) in self._selection)
+
+
+"""
+Function that returns the tiles of a zoom of a tile grid that intersect
+a geometry, in the srid of the grid. The blocks of tiles of the extent are
+split in four recursively (a quadtree): blocks that no edge crosses are
+fully inside or outside the geometry and are accepted or rejected as
+a whole by locating their center, only the tiles along the edges are
+tested one by one. Each block only tests the edges that cross its parent
+block, so the cost follows the length of the edges in tiles and not the
+area of the geometry.
+"""
+
+
+def selectTiles(g, zoom, geometry):
+    geometry = geometry.reproject(g.spatialReference)
+    [minRow, minCol, maxRow, maxCol] = g.getExtentAddress(zoom)
+    edges = geometry.edges
+    index = EdgesIndex(edges)
+    ranges = {}
+
+    def getBounds(rows, cols):
+        first = g.tileBounds(zoom, cols.start, rows.start)
+        last = g.tileBounds(zoom, cols.stop - 1, rows.stop - 1)
+        return [min(first[0], last[0]), min(first[1], last[1]),
+                max(first[2], last[2]), max(first[3], last[3])]
+
+    def split(values):
+        if len(values) == 1:
+            return [values]
+        middle = values.start + len(values) // 2
+        return [range(values.start, middle), range(middle, values.stop)]
+
+    def visit(rows, cols, edges):
+        box = getBounds(rows, cols)
+        edges = [e for e in edges if segmentIntersectsBox(e, box)]
+        if not edges:
+            center = ((box[0] + box[2]) / 2., (box[1] + box[3]) / 2.)
+            if index.contains(center):
+                for row in rows:
+                    ranges.setdefault(row, []).append(
+                        (cols.start, cols.stop))
+            return
+        if len(rows) == 1 and len(cols) == 1:
+            ranges.setdefault(rows.start, []).append(
+                (cols.start, cols.stop))
+            return
+        for subRows in split(rows):
+            for subCols in split(cols):
+                visit(subRows, subCols, edges)
+
+    visit(range(minRow, maxRow + 1), range(minCol, maxCol + 1), edges)
+    return TileSelection(ranges)
@@ -0,0 +1,151 @@
+import os
+import csv
+import gzip
+import json
+from urllib.parse import unquote_plus
+from tool_aws.s3.pipeline import runPipeline
+
+
+INVENTORY_FORMATS = ('CSV', 'Parquet', 'ORC')
+
+"""
+Function that returns the content of an S3 Inventory manifest.json.
+"""
+
+
+def loadManifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('fileFormat') not in INVENTORY_FORMATS:
+        raise ValueError('Unsupported inventory format: %s' % (
+            manifest.get('fileFormat'),))
+    return manifest
+
+
+"""
+Function that returns the local paths of the files of an inventory.
+The files are looked up by their key under the directory of the manifest
+or any of its parents (as synced from the inventory destination bucket),
+then by their name next to the manifest.
+"""
+
+
+def getInventoryFiles(manifest, manifestPath):
+    manifestDir = os.path.dirname(os.path.abspath(manifestPath))
+    parents = [manifestDir]
+    while os.path.dirname(parents[-1]) != parents[-1]:
+        parents.append(os.path.dirname(parents[-1]))
+    paths = []
+    for f in manifest['files']:
+        candidates = [os.path.join(p, f['key']) for p in parents] + \
+            [os.path.join(manifestDir, os.path.basename(f['key']))]
+        for path in candidates:
+            if os.path.exists(path):
+                paths.append(path)
+                break
+        else:
+            raise IOError(
+                'Inventory file %s not found next to %s, sync it from '
+                'the inventory destination bucket first' % (
+                    f['key'], manifestPath))
+    return paths
+
+
+"""
+Function that yields the keys of the current objects of a CSV inventory
+file. Keys are URL encoded in CSV inventories.
+"""
+
+
+def readCsvKeys(path, fileSchema):
+    columns = [c.strip() for c in fileSchema.split(',')]
+    keyIndex = columns.index('Key')
+    isLatestIndex = columns.index('IsLatest') \
+        if 'IsLatest' in columns else None
+    isDeleteMarkerIndex = columns.index('IsDeleteMarker') \
+        if 'IsDeleteMarker' in columns else None
+    with gzip.open(path, 'rt', newline='') as f:
+        for row in csv.reader(f):
+            if isLatestIndex is not None and row[isLatestIndex] != 'true':
+                continue
+            if isDeleteMarkerIndex is not None and \
+                    row[isDeleteMarkerIndex] == 'true':
+                continue
+            yield unquote_plus(row[keyIndex])
+
+
+"""
+Function that yields the keys of the current objects of a Parquet or ORC
+inventory file, requires pyarrow.
+"""
+
+
+def readArrowKeys(path, fileFormat):
+    try:
+        if fileFormat == 'Parquet':
+            from pyarrow.parquet import read_schema, read_table
+        else:
+            from pyarrow.orc import ORCFile
+    except ImportError:
+        raise RuntimeError(
+            '%s inventories require pyarrow ' % fileFormat +
+            '(pip install tool_aws[inventory])')
+    if fileFormat == 'Parquet':
+        names = read_schema(path).names
+    else:
+        orcFile = ORCFile(path)
+        names = orcFile.schema.names
+    columns = [c for c in ('key', 'is_latest', 'is_delete_marker')
+               if c in names]
+    if fileFormat == 'Parquet':
+        table = read_table(path, columns=columns).to_pydict()
+    else:
+        table = orcFile.read(columns=columns).to_pydict()
+    isLatest = table.get('is_latest')
+    isDeleteMarker = table.get('is_delete_marker')
+    for i, key in enumerate(table['key']):
+        if isLatest is not None and not isLatest[i]:
+            continue
+        if isDeleteMarker is not None and isDeleteMarker[i]:
+            continue
+        yield key
+
+
+"""
+Function that returns the keys of an inventory file starting with prefix
+and accepted by keysFilter, if any. Runs in the worker processes.
+"""
+
+
+def readInventoryFile(args):
+    path, fileFormat, fileSchema, prefix, keysFilter = args
+    if fileFormat == 'CSV':
+        keys = readCsvKeys(path, fileSchema)
+    else:
+        keys = readArrowKeys(path, fileFormat)
+    return [k for k in keys if k.startswith(prefix) and
+            (keysFilter is None or keysFilter(k))]
+
+
+"""
+Function that yields the keys of an inventory given its manifest.json.
+The inventory files are read by parallelism processes, the keys of at
+most parallelism files are kept in memory at a time.
+"""
+
+
+def getKeysFromInventory(manifestPath, prefix, keysFilter=None,
+                         parallelism=1):
+    from concurrent.futures import ProcessPoolExecutor
+    manifest = loadManifest(manifestPath)
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    payloads = (
+        (path, manifest['fileFormat'], manifest.get('fileSchema', ''),
+         prefix, keysFilter)
+        for path in getInventoryFiles(manifest, manifestPath))
+    with ProcessPoolExecutor(max_workers=parallelism) as executor:
+        for args, keys in runPipeline(
+                executor, readInventoryFile, payloads,
+                maxInFlight=parallelism):
+            for k in keys:
+                yield k
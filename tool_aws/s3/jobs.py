@@ -0,0 +1,211 @@
+import os
+import json
+import threading
+from tool_aws.s3.results import DeleteStats
+
+
+# Options of s3rm that can be set per target of a job manifest, flags
+# are set or unset by a true or false value
+TARGET_OPTIONS = {
+    'prefix': '--prefix',
+    'bbox': '--bbox',
+    'geometry': '--geometry',
+    'imageFormat': '--image-format',
+    'lowRes': '--lowest-resolution',
+    'highRes': '--highest-resolution',
+    'densityThreshold': '--density-threshold',
+    'listDepth': '--list-depth',
+    'chunkSize': '--chunk-size',
+    'keysFrom': '--keys-from',
+    'inventory': '--inventory'
+}
+TARGET_FLAGS = {
+    'skipMissing': '--skip-missing',
+    'allVersions': '--all-versions'
+}
+# Options of the targets that are local paths, relative to the manifest
+TARGET_PATHS = ('geometry', 'keysFrom', 'inventory')
+# Default number of targets whose keys are produced at the same time
+DEFAULT_JOB_PARALLELISM = 4
+
+"""
+Function that returns the content of a job manifest, a JSON or YAML
+file (YAML requires PyYAML). A manifest is either a list of targets or an
+object with the list of targets under targets and optionally the name of
+the bucket under bucketName.
+"""
+
+
+def loadJobManifest(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(
+                    'YAML job manifests require PyYAML '
+                    '(pip install tool_aws[yaml])')
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'targets': manifest}
+    if not isinstance(manifest, dict) or \
+            not isinstance(manifest.get('targets'), list) or \
+            not manifest['targets']:
+        raise ValueError('A job manifest defines a list of targets')
+    for i, target in enumerate(manifest['targets']):
+        if not isinstance(target, dict) or 'prefix' not in target:
+            raise ValueError('Target %s has no prefix' % i)
+        unknown = set(target) - set(TARGET_OPTIONS) - set(TARGET_FLAGS) - \
+            set(['name'])
+        if unknown:
+            raise ValueError('Unsupported fields of target %s: %s' % (
+                i, ', '.join(sorted(unknown))))
+        for field in TARGET_FLAGS:
+            if not isinstance(target.get(field, False), bool):
+                raise ValueError('%s of target %s is true or false' % (
+                    field, i))
+    return manifest
+
+
+"""
+Function that returns the command line arguments of a target of a job
+manifest. Relative paths are the ones of the files next to the manifest,
+in baseDir.
+"""
+
+
+def getTargetArgs(target, baseDir=''):
+    args = []
+    for field, option in sorted(TARGET_OPTIONS.items()):
+        value = target.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(v) for v in value)
+        elif field in TARGET_PATHS and value != '-':
+            value = os.path.join(baseDir, os.path.expanduser(value))
+        args.extend([option, str(value)])
+    for field, flag in sorted(TARGET_FLAGS.items()):
+        if target.get(field):
+            args.append(flag)
+    return args
+
+
+"""
+Function that returns the flags set or unset by a target of a job
+manifest, they override the ones of the command line.
+"""
+
+
+def getTargetFlags(target):
+    return dict((field, target[field]) for field in TARGET_FLAGS
+                if field in target)
+
+
+"""
+Function that returns the name of a target in the progress reports.
+"""
+
+
+def getTargetName(target):
+    if target.get('name'):
+        return target['name']
+    if target.get('bbox'):
+        bbox = target['bbox']
+        if isinstance(bbox, (list, tuple)):
+            bbox = ','.join(str(v) for v in bbox)
+        return '%s (bbox %s)' % (target['prefix'], bbox)
+    if target.get('geometry'):
+        return '%s (geometry %s)' % (target['prefix'], target['geometry'])
+    return target['prefix']
+
+
+class JobProgress:
+    """
+    Per target counters of the deletion of a job manifest. The payloads of
+    a target are tagged when they are produced, the keys sent again after
+    a failure are counted for the target with the longest matching prefix.
+    A target is complete once all its payloads have been produced and
+    processed.
+    """
+
+    def __init__(self, names, prefixes):
+        self.names = names
+        self.stats = [DeleteStats() for n in names]
+        self._prefixes = sorted(
+            ((p[1:] if p.startswith('/') else p, i)
+             for i, p in enumerate(prefixes)),
+            key=lambda p: -len(p[0]))
+        self._owners = {}
+        self._pending = [0] * len(names)
+        self._produced = [False] * len(names)
+        self._completed = set()
+        # Payloads are tagged by the producer threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def tag(self, index, payloads):
+        for payload in payloads:
+            with self._lock:
+                self._owners[id(payload)] = index
+                self._pending[index] += 1
+            yield payload
+        self._produced[index] = True
+
+    def owner(self, key):
+        for prefix, i in self._prefixes:
+            if key.startswith(prefix):
+                return i
+        return None
+
+    def record(self, payload, errors, failed):
+        with self._lock:
+            index = self._owners.pop(id(payload), None)
+            if index is not None:
+                self._pending[index] -= 1
+        if index is not None:
+            stats = self.stats[index]
+            stats.requests += 1
+            stats.deleted += len(payload) - len(errors)
+        else:
+            errorKeys = set(e['Key'] for e in errors)
+            for key in payload:
+                i = self.owner(key)
+                if i is not None and key not in errorKeys:
+                    self.stats[i].deleted += 1
+        failedKeys = set(e['Key'] for e in failed)
+        for error in errors:
+            i = index if index is not None else self.owner(error['Key'])
+            if i is None:
+                continue
+            if error['Key'] in failedKeys:
+                self.stats[i].failed += 1
+            else:
+                self.stats[i].retried += 1
+
+    def completed(self):
+        # Returns the targets completed since the last call
+        with self._lock:
+            done = [i for i in range(len(self)) if i not in self._completed
+                    and self._produced[i] and not self._pending[i]]
+        self._completed.update(done)
+        return done
+
+    @property
+    def nbCompleted(self):
+        return len(self._completed)
+
+    def active(self):
+        # Targets being deleted
+        return [i for i in range(len(self)) if i not in self._completed
+                and (self._pending[i] or self.stats[i].deleted)]
+
+    def describe(self):
+        return '%s/%s targets done%s' % (
+            self.nbCompleted, len(self), ''.join(
+                ', %s: %s' % (self.names[i], self.stats[i].deleted)
+                for i in self.active()))
@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two writes of the journal
+DEFAULT_JOURNAL_INTERVAL = 5
+
+"""
+Function that returns the default path of the journal of a job,
+in the current directory.
+"""
+
+
+def getJournalPath(job):
+    digest = hashlib.sha1(
+        json.dumps(job, sort_keys=True).encode('utf-8')).hexdigest()
+    return '.s3rm-%s.journal' % digest[:12]
+
+
+"""
+Function that returns the content of a journal, or None if there is none.
+"""
+
+
+def loadJournal(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class Journal:
+    """
+    Crash safe record of the progress of a deletion.
+    Payloads are numbered in the order they are produced and cursorOf
+    returns the position of a payload in the keys stream (e.g. its last key).
+    The journal cursor is the position of the last payload such that all
+    the payloads up to it have been processed, and none of their keys is
+    waiting to be retried. It is written by a background thread at most
+    every interval seconds, so that the deletion is never slowed down.
+    """
+
+    def __init__(self, path, job, cursorOf,
+                 interval=DEFAULT_JOURNAL_INTERVAL):
+        self._path = path
+        self._job = job
+        self._cursorOf = cursorOf
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._seqs = {}
+        self._pending = deque()
+        self._done = set()
+        self._blocked = set()
+        self._nextSeq = 0
+        self._cursor = None
+        self._written = None
+        self._stopped = threading.Event()
+        self._writer = None
+
+    def __enter__(self):
+        self._writer = threading.Thread(
+            target=self._run, name='s3rm-journal')
+        self._writer.daemon = True
+        self._writer.start()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self._stopped.set()
+        self._writer.join()
+        self.write()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.write()
+            except (IOError, OSError) as e:
+                logger.error('Could not write the journal: %s' % e)
+
+    def track(self, payloads):
+        for payload in payloads:
+            cursor = self._cursorOf(payload)
+            with self._lock:
+                self._seqs[id(payload)] = self._nextSeq
+                self._pending.append((self._nextSeq, cursor))
+                self._nextSeq += 1
+            yield payload
+
+    def done(self, payload, nbRetried, retriesDrained):
+        with self._lock:
+            seq = self._seqs.pop(id(payload), None)
+            if seq is not None:
+                self._done.add(seq)
+                if nbRetried:
+                    self._blocked.add(seq)
+            if retriesDrained:
+                self._blocked.clear()
+            while self._pending and self._pending[0][0] in self._done and \
+                    self._pending[0][0] not in self._blocked:
+                seq, self._cursor = self._pending.popleft()
+                self._done.discard(seq)
+
+    def write(self):
+        with self._lock:
+            cursor = self._cursor
+        if cursor is None or cursor == self._written:
+            return
+        tmpPath = self._path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'job': self._job, 'cursor': cursor}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self._path)
+        self._written = cursor
+
+    def remove(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    @property
+    def cursor(self):
+        return self._cursor
@@ -0,0 +1,77 @@
+import os
+
+
+class KeysChunk:
+    """
+    Compact chunk of keys to be deleted with a single request.
+    The common prefix of the keys is stored once, followed by the suffixes
+    of the keys (and their version ids, if any). This is what is pickled to
+    the workers, the delete_objects payload is only built at send time.
+    """
+
+    __slots__ = ('prefix', 'suffixes', 'versionIds')
+
+    def __init__(self, prefix, suffixes, versionIds=None):
+        self.prefix = prefix
+        self.suffixes = suffixes
+        self.versionIds = versionIds
+
+    @classmethod
+    def fromKeys(cls, keys):
+        prefix = os.path.commonprefix(keys) if keys else ''
+        n = len(prefix)
+        return cls(prefix, [k[n:] for k in keys])
+
+    @classmethod
+    def fromObjects(cls, objects):
+        # Objects as in the delete_objects payloads and errors
+        chunk = cls.fromKeys([o['Key'] for o in objects])
+        versionIds = [o.get('VersionId') for o in objects]
+        if any(versionIds):
+            chunk.versionIds = versionIds
+        return chunk
+
+    @classmethod
+    def fromVersions(cls, versions):
+        # (key, versionId) pairs
+        chunk = cls.fromKeys([k for k, v in versions])
+        chunk.versionIds = [v for k, v in versions]
+        return chunk
+
+    @classmethod
+    def fromItems(cls, items):
+        # Items of a keys stream, keys or (key, versionId) pairs
+        if items and isinstance(items[0], tuple):
+            return cls.fromVersions(items)
+        return cls.fromKeys(items)
+
+    def __len__(self):
+        return len(self.suffixes)
+
+    def __iter__(self):
+        prefix = self.prefix
+        for suffix in self.suffixes:
+            yield prefix + suffix
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return KeysChunk(
+                self.prefix, self.suffixes[i],
+                self.versionIds[i] if self.versionIds else None)
+        return self.prefix + self.suffixes[i]
+
+    def __eq__(self, other):
+        return isinstance(other, KeysChunk) and \
+            self.objects() == other.objects()
+
+    def __repr__(self):
+        return 'KeysChunk(%r, %s keys)' % (self.prefix, len(self))
+
+    def objects(self):
+        if not self.versionIds:
+            return [{'Key': k} for k in self]
+        return [{'Key': k, 'VersionId': v} if v else {'Key': k}
+                for k, v in zip(self, self.versionIds)]
+
+    def payload(self):
+        return {'Objects': self.objects(), 'Quiet': True}
@@ -0,0 +1,71 @@
+import io
+import sys
+import gzip
+
+
+# Size of the reads of the keys files
+BUFFER_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+"""
+Function that returns a buffered binary stream decompressing f if it is
+gzip or zstd compressed, f itself otherwise.
+"""
+
+
+def decompressedStream(f):
+    magic = f.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        return io.BufferedReader(gzip.GzipFile(fileobj=f), BUFFER_SIZE)
+    if magic == ZSTD_MAGIC:
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                'zstd compressed keys files require zstandard '
+                '(pip install tool_aws[zstd])')
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(f), BUFFER_SIZE)
+    return f
+
+
+"""
+Function that yields the keys of a newline delimited binary stream,
+starting after the key startAfter if defined. Empty lines are ignored.
+A ValueError is raised if startAfter is not found, e.g. the keys file of
+a resumed deletion changed.
+"""
+
+
+def readKeysStream(f, startAfter=None):
+    for line in decompressedStream(f):
+        key = line.rstrip(b'\r\n').decode('utf-8')
+        if not key:
+            continue
+        if startAfter is not None:
+            if key == startAfter:
+                startAfter = None
+            continue
+        yield key
+    if startAfter is not None:
+        raise ValueError('The key %s to resume after is not in the keys '
+                         'file, no key was read' % startAfter)
+
+
+"""
+Function that yields the keys of a keys file, or of stdin if path is -.
+The file is streamed, it is never loaded in memory.
+"""
+
+
+def readKeysFile(path, startAfter=None):
+    if path == '-':
+        stdin = io.BufferedReader(sys.stdin.buffer, BUFFER_SIZE)
+        for key in readKeysStream(stdin, startAfter):
+            yield key
+        return
+    with io.open(path, 'rb', buffering=BUFFER_SIZE) as f:
+        for key in readKeysStream(f, startAfter):
+            yield key
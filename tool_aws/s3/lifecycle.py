@@ -0,0 +1,204 @@
+import hashlib
+
+
+# Identifiers of the rules added by s3rm start with this prefix
+RULE_ID_PREFIX = 's3rm-'
+# Maximal number of rules of a lifecycle configuration
+MAX_LIFECYCLE_RULES = 1000
+# Objects are expired the day after the rule is added (the minimum)
+EXPIRATION_DAYS = 1
+# Settings of a lifecycle configuration besides its rules, they are reset
+# to their default when a configuration is written without them
+CONFIGURATION_SETTINGS = ('TransitionDefaultMinimumObjectSize',)
+
+"""
+Function that returns the identifier of the rules expiring a prefix.
+"""
+
+
+def getRuleId(prefix):
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    return RULE_ID_PREFIX + hashlib.sha1(
+        prefix.encode('utf-8')).hexdigest()[:12]
+
+
+"""
+Function that returns the lifecycle configuration of a bucket: its rules
+and the settings of the whole configuration (an empty configuration if
+there is none).
+"""
+
+
+def getLifecycleConfiguration(client, bucketName):
+    from botocore.exceptions import ClientError
+    try:
+        response = client.get_bucket_lifecycle_configuration(
+            Bucket=bucketName)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == \
+                'NoSuchLifecycleConfiguration':
+            return {'Rules': []}
+        raise
+    configuration = {'Rules': response.get('Rules', [])}
+    for setting in CONFIGURATION_SETTINGS:
+        if setting in response:
+            configuration[setting] = response[setting]
+    return configuration
+
+
+"""
+Function that returns the rules of the lifecycle configuration of a bucket
+(an empty list if there is none).
+"""
+
+
+def getLifecycleRules(client, bucketName):
+    return getLifecycleConfiguration(client, bucketName)['Rules']
+
+
+"""
+Function that tells whether versioning is (or has been) enabled on a bucket,
+in which case expired objects are kept as non current versions.
+"""
+
+
+def isVersioned(client, bucketName):
+    status = client.get_bucket_versioning(Bucket=bucketName).get('Status')
+    return status in ('Enabled', 'Suspended')
+
+
+"""
+Function that returns the rules expiring every object of a prefix. A
+legacy rule uses a top level Prefix instead of a Filter, the two forms
+can not be mixed in a lifecycle configuration. On a versioned bucket, the
+non current versions are expired too, and the delete markers left once
+they are all gone by a second rule.
+"""
+
+
+def createExpirationRules(prefix, versioned=False, legacy=False):
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    ruleId = getRuleId(prefix)
+    scope = {'Prefix': prefix} if legacy else {'Filter': {'Prefix': prefix}}
+    rule = dict(scope, **{
+        'ID': ruleId,
+        'Status': 'Enabled',
+        'Expiration': {'Days': EXPIRATION_DAYS},
+        'AbortIncompleteMultipartUpload': {
+            'DaysAfterInitiation': EXPIRATION_DAYS}
+    })
+    if not versioned:
+        return [rule]
+    rule['NoncurrentVersionExpiration'] = {'NoncurrentDays': EXPIRATION_DAYS}
+    markersRule = dict(scope, **{
+        'ID': ruleId + '-markers',
+        'Status': 'Enabled',
+        'Expiration': {'ExpiredObjectDeleteMarker': True}
+    })
+    return [rule, markersRule]
+
+
+"""
+Function that tells whether a rule belongs to the rules of a prefix.
+"""
+
+
+def isPrefixRule(rule, prefix):
+    ruleId = getRuleId(prefix)
+    return rule.get('ID') in (ruleId, ruleId + '-markers')
+
+
+"""
+Function that returns the rules of a lifecycle configuration with the
+rules of a prefix added, or replaced if they already exist. The other
+rules are kept as they are.
+"""
+
+
+def mergeRules(rules, prefixRules, prefix):
+    merged = [r for r in rules if not isPrefixRule(r, prefix)]
+    merged.extend(prefixRules)
+    if len(merged) > MAX_LIFECYCLE_RULES:
+        raise ValueError('A lifecycle configuration has at most %s rules' %
+                         MAX_LIFECYCLE_RULES)
+    return merged
+
+
+"""
+Function that writes the rules of the lifecycle configuration of a bucket,
+the configuration is removed when there is no rule left. The settings of
+the configuration read before (see getLifecycleConfiguration) are kept.
+"""
+
+
+def putLifecycleRules(client, bucketName, rules, configuration=None):
+    if rules:
+        settings = dict((k, v) for k, v in (configuration or {}).items()
+                        if k in CONFIGURATION_SETTINGS)
+        client.put_bucket_lifecycle_configuration(
+            Bucket=bucketName, LifecycleConfiguration={'Rules': rules},
+            **settings)
+    else:
+        client.delete_bucket_lifecycle(Bucket=bucketName)
+
+
+"""
+Function that adds the expiration rules of a prefix to the lifecycle
+configuration of a bucket and returns them. The configuration is read
+again afterwards: if another rule was changed concurrently, the
+configuration is merged again.
+"""
+
+
+def addExpirationRules(client, bucketName, prefix, maxAttempts=3):
+    versioned = isVersioned(client, bucketName)
+    for attempt in range(maxAttempts):
+        configuration = getLifecycleConfiguration(client, bucketName)
+        rules = configuration['Rules']
+        legacy = any('Prefix' in r and 'Filter' not in r for r in rules)
+        prefixRules = createExpirationRules(prefix, versioned, legacy)
+        putLifecycleRules(client, bucketName,
+                          mergeRules(rules, prefixRules, prefix),
+                          configuration)
+        current = getLifecycleRules(client, bucketName)
+        others = [r for r in rules if not isPrefixRule(r, prefix)]
+        if all(r in current for r in others) and \
+                all(any(isPrefixRule(c, prefix) and c['ID'] == r['ID']
+                        for c in current) for r in prefixRules):
+            return prefixRules
+    raise RuntimeError('The lifecycle configuration of %s keeps changing, '
+                       'the expiration rules could not be added' % bucketName)
+
+
+"""
+Function that removes the expiration rules of a prefix from the lifecycle
+configuration of a bucket. Returns the removed rules.
+"""
+
+
+def removeExpirationRules(client, bucketName, prefix):
+    configuration = getLifecycleConfiguration(client, bucketName)
+    rules = configuration['Rules']
+    prefixRules = [r for r in rules if isPrefixRule(r, prefix)]
+    if prefixRules:
+        putLifecycleRules(client, bucketName, [
+            r for r in rules if not isPrefixRule(r, prefix)], configuration)
+    return prefixRules
+
+
+"""
+Function that tells whether every object (and version, on a versioned
+bucket) of a prefix is gone, with a listing of a single key.
+"""
+
+
+def isPrefixEmpty(client, bucketName, prefix, versioned=False):
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    if versioned:
+        response = client.list_object_versions(
+            Bucket=bucketName, Prefix=prefix, MaxKeys=1)
+        return not response.get('Versions') and \
+            not response.get('DeleteMarkers')
+    response = client.list_objects_v2(
+        Bucket=bucketName, Prefix=prefix, MaxKeys=1)
+    return not response.get('Contents')
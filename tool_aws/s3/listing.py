@@ -0,0 +1,184 @@
+from types import SimpleNamespace
+from tool_aws.s3.pipeline import prefetchMany
+
+
+class ClientBucket:
+    """
+    Bucket object of the listing functions built from an S3 client, the
+    listing only uses the name of the bucket and meta.client, as found on
+    the Bucket resources of boto3.
+    """
+
+    def __init__(self, client, name):
+        self.name = name
+        self.meta = SimpleNamespace(client=client)
+
+
+"""
+Function that yields pages of objects (Key, Size...) given a bucket object
+and prefix. Pages are listed using continuation tokens, starting after
+startAfter.
+"""
+
+
+def getObjectsPagesFromS3(s3Bucket, prefix, startAfter=None, pageSize=1000):
+    if prefix.startswith('/'):
+        prefix = prefix[1:]
+    params = {
+        'Bucket': s3Bucket.name,
+        'Prefix': prefix,
+        'PaginationConfig': {'PageSize': pageSize}
+    }
+    if startAfter:
+        params['StartAfter'] = startAfter
+    paginator = s3Bucket.meta.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        yield page.get('Contents', [])
+
+
+"""
+Function that yields pages of keys given a bucket object and prefix.
+Pages are listed using continuation tokens, starting after startAfter.
+"""
+
+
+def getKeysPagesFromS3(s3Bucket, prefix, startAfter=None, pageSize=1000):
+    for page in getObjectsPagesFromS3(s3Bucket, prefix, startAfter, pageSize):
+        yield [o['Key'] for o in page]
+
+
+"""
+Function that yields pages of object versions and delete markers (Key,
+VersionId...) given a bucket object and prefix.
+"""
+
+
+def getObjectVersionsPagesFromS3(s3Bucket, prefix, pageSize=1000):
+    if prefix.startswith('/'):
+        prefix = prefix[1:]
+    paginator = s3Bucket.meta.client.get_paginator('list_object_versions')
+    for page in paginator.paginate(
+            Bucket=s3Bucket.name, Prefix=prefix,
+            PaginationConfig={'PageSize': pageSize}):
+        yield page.get('Versions', []) + page.get('DeleteMarkers', [])
+
+
+"""
+Function that yields pages of (key, versionId) pairs of the object versions
+and delete markers given a bucket object and prefix.
+"""
+
+
+def getVersionsPagesFromS3(s3Bucket, prefix, pageSize=1000):
+    for page in getObjectVersionsPagesFromS3(s3Bucket, prefix, pageSize):
+        yield [(o['Key'], o['VersionId']) for o in page]
+
+
+"""
+Function that returns the sub-prefixes and the objects found directly
+under a prefix, i.e. one level of the tile path hierarchy.
+If versions is True, the objects are all the versions and delete markers,
+and the sub-prefixes the ones of any of them.
+"""
+
+
+def listLevel(s3Bucket, prefix, versions=False):
+    subPrefixes = []
+    objects = []
+    paginator = s3Bucket.meta.client.get_paginator(
+        'list_object_versions' if versions else 'list_objects_v2')
+    for page in paginator.paginate(
+            Bucket=s3Bucket.name, Prefix=prefix, Delimiter='/'):
+        subPrefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+        if versions:
+            objects.extend(page.get('Versions', []))
+            objects.extend(page.get('DeleteMarkers', []))
+        else:
+            objects.extend(page.get('Contents', []))
+    return subPrefixes, objects
+
+
+"""
+Function that discovers the sub-prefixes located depth levels below
+a prefix (e.g. depth 2 below a srid prefix gives zoom/col shards).
+Returns the shards and the objects found above the shards level.
+"""
+
+
+def getShards(s3Bucket, prefix, depth, parallelism, versions=False):
+    from concurrent.futures import ThreadPoolExecutor
+    if prefix.startswith('/'):
+        prefix = prefix[1:]
+    shards = [prefix]
+    looseObjects = []
+    if depth <= 0:
+        return shards, looseObjects
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        for level in range(depth):
+            subShards = []
+            for subPrefixes, objects in executor.map(
+                    lambda p: listLevel(s3Bucket, p, versions), shards):
+                subShards.extend(subPrefixes)
+                looseObjects.extend(objects)
+            shards = subShards
+            if not shards:
+                break
+    return shards, looseObjects
+
+
+"""
+Function that yields pages of objects given a bucket object and prefix.
+The prefix is split in shards depth levels below the prefix and the
+shards are listed concurrently by parallelism threads, listShard
+returns the pages of a shard.
+If versions is True, the pages are the ones of the object versions.
+Pages are yielded as soon as they are listed, shards are not ordered.
+If shard is defined, only the shards (and the objects above them) whose
+hash falls in it are listed.
+"""
+
+
+def getObjectsPagesSharded(s3Bucket, prefix, depth, parallelism,
+                           pageSize=1000, listShard=None, versions=False,
+                           shard=None):
+    shards, looseObjects = getShards(
+        s3Bucket, prefix, depth, parallelism, versions)
+    if shard is not None:
+        shards = [p for p in shards if shard.ownsPrefix(p)]
+        looseObjects = [o for o in looseObjects
+                        if shard.ownsKey(o['Key'], prefix, depth)]
+    for i in range(0, len(looseObjects), pageSize):
+        yield looseObjects[i:i + pageSize]
+    listShard = listShard or (getObjectVersionsPagesFromS3 if versions
+                              else getObjectsPagesFromS3)
+    listers = (listShard(s3Bucket, p, pageSize=pageSize) for p in shards)
+    for page in prefetchMany(listers, parallelism, 2 * parallelism):
+        if page:
+            yield page
+
+
+"""
+Function that yields pages of keys given a bucket object and prefix,
+listed in shards as by getObjectsPagesSharded.
+"""
+
+
+def getKeysPagesSharded(s3Bucket, prefix, depth, parallelism, pageSize=1000,
+                        shard=None):
+    for page in getObjectsPagesSharded(
+            s3Bucket, prefix, depth, parallelism, pageSize, shard=shard):
+        yield [o['Key'] for o in page]
+
+
+"""
+Function that yields pages of (key, versionId) pairs given a bucket object
+and prefix, listed in shards as by getObjectsPagesSharded.
+"""
+
+
+def getVersionsPagesSharded(s3Bucket, prefix, depth, parallelism,
+                            pageSize=1000, shard=None):
+    for page in getObjectsPagesSharded(
+            s3Bucket, prefix, depth, parallelism, pageSize, versions=True,
+            shard=shard):
+        yield [(o['Key'], o['VersionId']) for o in page]
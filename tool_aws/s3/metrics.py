@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import bisect
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds of the latency histograms buckets
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Seconds between two writes of the Prometheus textfile
+DEFAULT_METRICS_INTERVAL = 15
+# Prefix of the Prometheus metrics names
+PROMETHEUS_NAMESPACE = 's3rm'
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, cheap to update and to merge.
+    counts[i] is the number of values in (buckets[i - 1], buckets[i]],
+    the last count is the one of the values above the last bucket.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        # Upper bound of the bucket of the q quantile
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulated = 0
+        for bound, c in zip(self.buckets + (float('inf'),), self.counts):
+            cumulated += c
+            if cumulated >= rank:
+                return bound
+        return float('inf')
+
+    def cumulativeCounts(self):
+        cumulated = 0
+        for bound, c in zip(self.buckets + (float('inf'),), self.counts):
+            cumulated += c
+            yield bound, cumulated
+
+    def toDict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(('+Inf' if b == float('inf') else str(b), c)
+                            for b, c in self.cumulativeCounts())
+        }
+
+
+class RequestTrace:
+    """
+    What a worker measures while sending one chunk of keys: the latency of
+    every attempt, the codes of the failed attempts, the number of retries
+    and throttling signals. It is returned to the parent with the result,
+    where the traces of all the workers are aggregated by Metrics.
+    """
+
+    def __init__(self):
+        self.retries = 0
+        self.throttles = 0
+        self.rateWait = 0.0
+        self.latencies = []
+        self.errors = []
+        self._start = time.time()
+
+    def attempt(self, start, error=None):
+        self.latencies.append(time.time() - start)
+        if error is not None:
+            self.errors.append(errorCode(error))
+
+    def result(self, errors):
+        return {
+            'Errors': errors,
+            'Retries': self.retries,
+            'Throttles': self.throttles,
+            'RateWait': self.rateWait,
+            'Latencies': self.latencies,
+            'RequestErrors': self.errors,
+            'Elapsed': time.time() - self._start
+        }
+
+
+"""
+Function that returns the code of an exception raised by a request.
+"""
+
+
+def errorCode(error):
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        if code:
+            return code
+    return type(error).__name__
+
+
+class Metrics:
+    """
+    Hot path metrics of a deletion, aggregated in the parent process.
+    Phases are cumulated seconds:
+    - keys: listing, generation or reading of the keys (first batch included)
+    - deletion: wall time of the deletion
+    - requests: S3 latency of the DELETE requests, summed over the workers
+    - worker: time the workers spent outside of the requests (backoff
+      before retrying a request, building of the payload)
+    - rateLimit: time the workers waited for the shared rate limit
+    - queue: time a chunk waited for a worker, including serialization
+    - retryWait: time the parent waited before retrying failed keys
+    Comparing the keys phase with the deletion wall time, and the requests
+    phase with the queue phase tells whether a deletion is bound by the
+    keys production, by the IPC or by S3.
+    """
+
+    def __init__(self, labels=None, textfile=None,
+                 interval=DEFAULT_METRICS_INTERVAL):
+        self.labels = labels or {}
+        self.textfile = textfile
+        self.interval = interval
+        self.phases = defaultdict(float)
+        self.counters = Counter()
+        self.errors = Counter()
+        self.keyErrors = Counter()
+        self.latency = Histogram()
+        self.roundTrip = Histogram()
+        self._submitted = {}
+        self._start = time.time()
+        self._lastWrite = self._start
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[phase] += time.time() - start
+
+    def timeIterator(self, phase, iterable, counter=None):
+        # Time spent in next(), the items are counted by their length
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.phases[phase] += time.time() - start
+                return
+            self.phases[phase] += time.time() - start
+            if counter is not None:
+                self.counters[counter] += len(item)
+            yield item
+
+    def track(self, payloads):
+        # The payloads are pulled when they are submitted to the workers
+        for payload in payloads:
+            self._submitted[id(payload)] = time.time()
+            yield payload
+
+    def record(self, payload, result):
+        submitted = self._submitted.pop(id(payload), None)
+        latencies = result.get('Latencies', [])
+        for latency in latencies:
+            self.latency.observe(latency)
+        self.phases['requests'] += sum(latencies)
+        rateWait = result.get('RateWait', 0)
+        if rateWait:
+            self.phases['rateLimit'] += rateWait
+        elapsed = result.get('Elapsed')
+        if elapsed is not None:
+            self.phases['worker'] += max(
+                0, elapsed - sum(latencies) - rateWait)
+        if submitted is not None:
+            roundTrip = time.time() - submitted
+            self.roundTrip.observe(roundTrip)
+            if elapsed is not None:
+                self.phases['queue'] += max(0, roundTrip - elapsed)
+        self.counters['throttles'] += result['Throttles']
+        self.errors.update(result.get('RequestErrors', []))
+        self.keyErrors.update(e.get('Code') or 'Unknown'
+                              for e in result['Errors'])
+
+    def summary(self, stats=None):
+        elapsed = time.time() - self._start
+        deletion = self.phases.get('deletion', 0)
+        keys = self.phases.get('keys', 0)
+        summary = {
+            'labels': self.labels,
+            'elapsed': round(elapsed, 3),
+            'phases': dict((k, round(v, 3)) for k, v in self.phases.items()),
+            'counters': dict(self.counters),
+            'requestErrors': dict(self.errors),
+            'keyErrors': dict(self.keyErrors),
+            'requestLatency': self.latency.toDict(),
+            'roundTrip': self.roundTrip.toDict(),
+            'keysProducedPerSecond': round(
+                self.counters['keys'] / keys, 1) if keys else None
+        }
+        if stats is not None:
+            summary.update({
+                'deleted': stats.deleted,
+                'failed': stats.failed,
+                'retried': stats.retried,
+                'requests': stats.requests,
+                'keysPerSecond': round(
+                    stats.deleted / deletion, 1) if deletion else None
+            })
+        return summary
+
+    def prometheus(self, stats=None):
+        labels = ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                          for k, v in sorted(self.labels.items()))
+        ns = PROMETHEUS_NAMESPACE
+        lines = []
+
+        def metric(name, kind, helpText, samples):
+            lines.append('# HELP %s_%s %s' % (ns, name, helpText))
+            lines.append('# TYPE %s_%s %s' % (ns, name, kind))
+            for suffix, extra, value in samples:
+                sampleLabels = ','.join(
+                    part for part in (labels, extra) if part)
+                lines.append('%s_%s%s{%s} %s' % (
+                    ns, name, suffix, sampleLabels, value))
+
+        def histogram(name, helpText, h):
+            metric(name, 'histogram', helpText, [
+                ('_bucket', 'le="%s"' % (
+                    '+Inf' if b == float('inf') else b), c)
+                for b, c in h.cumulativeCounts()] + [
+                ('_sum', '', h.sum), ('_count', '', h.count)])
+
+        if stats is not None:
+            for name in ('deleted', 'failed', 'retried', 'requests'):
+                metric('%s_total' % name, 'counter',
+                       'Number of %s so far' % (
+                           'requests' if name == 'requests'
+                           else '%s keys' % name),
+                       [('', '', getattr(stats, name))])
+        metric('keys_produced_total', 'counter',
+               'Number of keys listed, generated or read',
+               [('', '', self.counters['keys'])])
+        metric('throttles_total', 'counter',
+               'Number of throttling signals received',
+               [('', '', self.counters['throttles'])])
+        metric('errors_total', 'counter',
+               'Number of failed requests and keys by code',
+               [('', 'level="request",code="%s"' % code, n)
+                for code, n in sorted(self.errors.items())] +
+               [('', 'level="key",code="%s"' % code, n)
+                for code, n in sorted(self.keyErrors.items())])
+        metric('phase_seconds_total', 'counter',
+               'Cumulated seconds spent per phase',
+               [('', 'phase="%s"' % phase, round(s, 6))
+                for phase, s in sorted(self.phases.items())])
+        histogram('request_latency_seconds',
+                  'Latency of the DELETE requests', self.latency)
+        histogram('round_trip_seconds',
+                  'Time between the submission of a chunk and its result',
+                  self.roundTrip)
+        metric('last_update_timestamp_seconds', 'gauge',
+               'Time of the last update of the metrics',
+               [('', '', round(time.time(), 3))])
+        return '\n'.join(lines) + '\n'
+
+    def tick(self, stats=None):
+        # Called after each result, the textfile is written at most
+        # every interval seconds
+        if self.textfile and time.time() - self._lastWrite >= self.interval:
+            self.writePrometheus(self.textfile, stats)
+
+    def writePrometheus(self, path, stats=None):
+        writeAtomically(path, self.prometheus(stats))
+        self._lastWrite = time.time()
+
+    def writeJson(self, path, stats=None):
+        writeAtomically(path, json.dumps(self.summary(stats), indent=2))
+
+
+"""
+Function that writes a file atomically, so that it is never read partially
+(e.g. by the textfile collector of the node exporter).
+"""
+
+
+def writeAtomically(path, content):
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write(content)
+    os.replace(tmpPath, path)
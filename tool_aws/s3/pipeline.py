@@ -0,0 +1,135 @@
+import threading
+from queue import Queue, Full, Empty
+
+
+END = object()
+
+
+class ProducerError:
+
+    def __init__(self, error):
+        self.error = error
+
+
+"""
+Function that yields the items put in a queue by nbProducers background
+producers. Each producer puts END when it is done, errors raised in
+the producers are put as ProducerError and raised in the consumer.
+"""
+
+
+def consume(queue, nbProducers):
+    while nbProducers > 0:
+        try:
+            item = queue.get(timeout=0.1)
+        except Empty:
+            continue
+        if item is END:
+            nbProducers -= 1
+            continue
+        if isinstance(item, ProducerError):
+            raise item.error
+        yield item
+
+
+"""
+Function that yields the items of several iterables, produced ahead of time
+by parallelism background threads. Each thread consumes one iterable
+at a time, items are yielded in the order they are produced.
+At most maxSize items are kept in memory.
+"""
+
+
+def prefetchMany(iterables, parallelism, maxSize):
+    queue = Queue(maxsize=maxSize)
+    stopped = threading.Event()
+    iterables = iter(iterables)
+    lock = threading.Lock()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def nextIterable():
+        with lock:
+            return next(iterables, END)
+
+    def produce():
+        try:
+            while not stopped.is_set():
+                iterable = nextIterable()
+                if iterable is END:
+                    break
+                for item in iterable:
+                    put(item)
+                    if stopped.is_set():
+                        return
+        except Exception as e:
+            put(ProducerError(e))
+        finally:
+            put(END)
+
+    producers = []
+    for i in range(parallelism):
+        producer = threading.Thread(
+            target=produce, name='s3rm-producer-%s' % i)
+        producer.daemon = True
+        producer.start()
+        producers.append(producer)
+    try:
+        for item in consume(queue, len(producers)):
+            yield item
+    finally:
+        stopped.set()
+        for producer in producers:
+            producer.join()
+
+
+"""
+Function that yields the items of an iterable, produced ahead of time
+in a background thread. At most maxSize items are kept in memory.
+"""
+
+
+def prefetch(iterable, maxSize):
+    return prefetchMany([iterable], 1, maxSize)
+
+
+"""
+Function that submits payloads to an executor and yields (payload, result)
+as soon as they complete. No more than maxInFlight payloads are submitted
+at a time, so that the workers always have work queued without
+consuming the payloads iterable faster than needed.
+maxInFlight is either a number or a function returning the current limit.
+"""
+
+
+def runPipeline(executor, func, payloads, maxInFlight):
+    from concurrent.futures import wait, FIRST_COMPLETED
+    payloads = iter(payloads)
+    inFlight = {}
+    exhausted = False
+    getMaxInFlight = maxInFlight if callable(maxInFlight) \
+        else lambda: maxInFlight
+    try:
+        while True:
+            while not exhausted and len(inFlight) < getMaxInFlight():
+                try:
+                    payload = next(payloads)
+                except StopIteration:
+                    exhausted = True
+                    break
+                inFlight[executor.submit(func, payload)] = payload
+            if not inFlight:
+                break
+            done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+            for future in done:
+                payload = inFlight.pop(future)
+                yield payload, future.result()
+    finally:
+        for future in inFlight:
+            future.cancel()
@@ -0,0 +1,60 @@
+import time
+import logging
+from tool_aws.s3.du import humanDuration
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two progress lines
+DEFAULT_PROGRESS_INTERVAL = 5
+
+
+class ProgressReporter:
+    """
+    The progress of a deletion as a single line, rendered by the parent
+    process from the counters aggregated from the results of the workers,
+    at most once every interval seconds: the keys deleted (out of total, if
+    known), the current rate, the failed and retried keys and the remaining
+    time at the average rate of the deletion. Each of details is a function
+    of the stats returning a string appended to the line.
+    """
+
+    def __init__(self, total=None, interval=DEFAULT_PROGRESS_INTERVAL,
+                 details=None):
+        self.total = total
+        self.interval = interval
+        self.details = list(details or [])
+        self._start = time.time()
+        # Time and number of deleted keys of the last line
+        self._last = (self._start, 0)
+
+    def update(self, stats, force=False):
+        # Returns whether a line was logged
+        now = time.time()
+        if not force and now - self._last[0] < self.interval:
+            return False
+        logger.info('Progress: %s' % self.render(stats, now))
+        self._last = (now, stats.deleted)
+        return True
+
+    def render(self, stats, now=None):
+        now = now or time.time()
+        lastTime, lastDeleted = self._last
+        rate = (stats.deleted - lastDeleted) / max(now - lastTime, 1e-6)
+        # A total can be an upper bound (e.g. the existing tiles only)
+        known = self.total and stats.deleted <= self.total
+        line = 'deleted %s%s keys%s, %.1f keys/s, %s failed, %s retried' % (
+            stats.deleted, '/%s' % self.total if known else '',
+            ' (%.1f%%)' % (100. * stats.deleted / self.total)
+            if known else '', rate, stats.failed,
+            stats.retried + stats.requestRetries)
+        if known:
+            line += ', ETA %s' % self.eta(stats, now)
+        return ''.join([line] + [', ' + d(stats) for d in self.details])
+
+    def eta(self, stats, now=None):
+        elapsed = (now or time.time()) - self._start
+        if not stats.deleted:
+            return 'unknown'
+        remaining = self.total - stats.deleted
+        return humanDuration(remaining * elapsed / stats.deleted)
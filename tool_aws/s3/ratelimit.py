@@ -0,0 +1,102 @@
+import time
+
+
+# Indexes of the shared state of a rate limiter
+REQUEST_TOKENS = 0
+KEY_TOKENS = 1
+LAST_REFILL = 2
+REQUESTS = 3
+KEYS = 4
+DELAYED = 5
+WAITED = 6
+STATE_SIZE = 7
+
+
+class RateLimiter:
+    """
+    Token buckets of DELETE requests and of keys per second shared by every
+    worker of a deletion. The state lives in shared memory behind a process
+    lock, so that the threads and processes of every engine draw from the
+    same budget (it is sent to the processes by their initializer).
+    A request reserves one request token and one key token per key before
+    each attempt, retries included. The buckets hold at most one second of
+    tokens and can go below zero: a request that takes more tokens than
+    available (e.g. a chunk larger than the keys per second) waits until
+    the buckets are refilled, so the rate holds whatever the chunk size.
+    """
+
+    def __init__(self, requestsPerSecond=None, keysPerSecond=None):
+        import multiprocessing
+        self.requestsPerSecond = requestsPerSecond
+        self.keysPerSecond = keysPerSecond
+        self._lock = multiprocessing.Lock()
+        self._state = multiprocessing.Array('d', STATE_SIZE, lock=False)
+        self._state[REQUEST_TOKENS] = requestsPerSecond or 0
+        self._state[KEY_TOKENS] = keysPerSecond or 0
+        self._state[LAST_REFILL] = time.time()
+        # Counters of the last report, in the parent
+        self._reported = (time.time(), 0, 0)
+
+    def reserve(self, nbKeys):
+        # Returns the seconds to wait before sending the request
+        with self._lock:
+            state = self._state
+            now = time.time()
+            elapsed = max(0, now - state[LAST_REFILL])
+            state[LAST_REFILL] = now
+            delay = 0
+            for index, rate, cost in (
+                    (REQUEST_TOKENS, self.requestsPerSecond, 1),
+                    (KEY_TOKENS, self.keysPerSecond, nbKeys)):
+                if not rate:
+                    continue
+                tokens = min(rate, state[index] + elapsed * rate) - cost
+                state[index] = tokens
+                if tokens < 0:
+                    delay = max(delay, -tokens / rate)
+            state[REQUESTS] += 1
+            state[KEYS] += nbKeys
+            if delay:
+                state[DELAYED] += 1
+                state[WAITED] += delay
+        return delay
+
+    def acquire(self, nbKeys):
+        delay = self.reserve(nbKeys)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': int(self._state[REQUESTS]),
+                'keys': int(self._state[KEYS]),
+                'delayed': int(self._state[DELAYED]),
+                'waited': round(self._state[WAITED], 3)
+            }
+
+    def report(self, requests, keys):
+        # Rates of the requests and keys sent (as counted by the parent)
+        # since the previous report, the reservations of the workers can
+        # be ahead of them
+        stats = self.stats()
+        now = time.time()
+        start, lastRequests, lastKeys = self._reported
+        self._reported = (now, requests, keys)
+        elapsed = max(now - start, 1e-6)
+        rates = []
+        for name, count, limit in (
+                ('requests', requests - lastRequests, self.requestsPerSecond),
+                ('keys', keys - lastKeys, self.keysPerSecond)):
+            rate = '%.1f' % (count / elapsed)
+            if limit:
+                rate += '/%g' % limit
+            rates.append('%s %s/s' % (rate, name))
+        return '%s, %s requests delayed (%.1fs waited in total)' % (
+            ', '.join(rates), stats['delayed'], stats['waited'])
+
+    def __str__(self):
+        return ', '.join('%g %s/s' % (limit, name) for name, limit in (
+            ('requests', self.requestsPerSecond),
+            ('keys', self.keysPerSecond)) if limit)
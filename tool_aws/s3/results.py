@@ -0,0 +1,119 @@
+from collections import deque
+from tool_aws.s3.keys import KeysChunk
+from tool_aws.s3.retry import isThrottleCode, SERVER_ERROR_CODES
+
+
+# Code of the keys of a request that failed after all its retries
+REQUEST_FAILED_CODE = 'RequestFailed'
+
+RETRYABLE_CODES = SERVER_ERROR_CODES + (REQUEST_FAILED_CODE,)
+
+"""
+Function that tells whether a per-key error code can be retried.
+"""
+
+
+def isRetryableCode(code):
+    return code in RETRYABLE_CODES or isThrottleCode(code)
+
+
+"""
+Function that returns the object identifier of a per-key error.
+"""
+
+
+def errorObject(error):
+    obj = {'Key': error['Key']}
+    if error.get('VersionId'):
+        obj['VersionId'] = error['VersionId']
+    return obj
+
+
+class DeleteStats:
+    """
+    Counters of a deletion run, aggregated in the parent process.
+    """
+
+    def __init__(self):
+        self.deleted = 0
+        self.failed = 0
+        self.retried = 0
+        self.requests = 0
+        # Retries of the requests by the workers
+        self.requestRetries = 0
+        self.failedKeys = []
+
+    def __str__(self):
+        return 'deleted: %s, failed: %s, retried: %s, requests: %s' % (
+            self.deleted, self.failed, self.retried, self.requests)
+
+    def toDict(self):
+        return {
+            'deleted': self.deleted,
+            'failed': self.failed,
+            'retried': self.retried,
+            'requests': self.requests,
+            'requestRetries': self.requestRetries,
+            'failedKeys': list(self.failedKeys)
+        }
+
+
+class RetryQueue:
+    """
+    This class collects the keys that failed inside delete_objects responses
+    and sends them back as new chunks. A key is retried at most maxRetries
+    times, keys failing with a non retryable code are not retried.
+    """
+
+    def __init__(self, chunkSize, maxRetries):
+        self._chunkSize = chunkSize
+        self._maxRetries = maxRetries
+        self._attempts = {}
+        self._pending = []
+        # Shared with the thread producing the payloads
+        self._ready = deque()
+        # Chunks sent again whose result has not been processed yet
+        self._inFlight = set()
+
+    def __len__(self):
+        return len(self._pending) + \
+            sum(len(p) for p in list(self._ready))
+
+    def put(self, errors):
+        # Returns the errors that will not be retried
+        failed = []
+        for error in errors:
+            key = (error['Key'], error.get('VersionId'))
+            attempts = self._attempts.get(key, 0) + 1
+            if not isRetryableCode(error.get('Code')) or \
+                    attempts > self._maxRetries:
+                failed.append(error)
+                continue
+            self._attempts[key] = attempts
+            self._pending.append(errorObject(error))
+            if len(self._pending) >= self._chunkSize:
+                self.flush()
+        return failed
+
+    def flush(self):
+        if self._pending:
+            payload = KeysChunk.fromObjects(self._pending)
+            self._inFlight.add(id(payload))
+            self._ready.append(payload)
+            self._pending = []
+
+    def done(self, payload):
+        # Called with every processed payload
+        self._inFlight.discard(id(payload))
+
+    @property
+    def drained(self):
+        # No failed key is waiting or being retried
+        return not self._pending and not self._inFlight
+
+    def iterReady(self):
+        while True:
+            try:
+                yield self._ready.popleft()
+            except IndexError:
+                return
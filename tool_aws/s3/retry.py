@@ -0,0 +1,133 @@
+import time
+import random
+from functools import lru_cache
+
+
+DEFAULT_MAX_RETRIES = 8
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 60
+
+THROTTLE_CODES = (
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'ServiceUnavailable', '503')
+
+# Error codes of transient server errors
+SERVER_ERROR_CODES = (
+    'InternalError', 'ServiceUnavailable', 'RequestTimeout',
+    'OperationAborted')
+
+"""
+Function that returns the exceptions of a request that are retried.
+botocore is only imported once a request is sent.
+"""
+
+
+@lru_cache(maxsize=None)
+def getRetryableErrors():
+    from http.client import IncompleteRead
+    from botocore.exceptions import ClientError, HTTPClientError, \
+        ConnectionError as BotoConnectionError
+    from botocore.parsers import ResponseParserError
+    return (IncompleteRead, ClientError, ResponseParserError, HTTPClientError,
+            BotoConnectionError)
+
+
+"""
+Function that tells whether an exception of a request is transient: a
+throttling signal, a server error or a transport error. Other client
+errors (e.g. AccessDenied, NoSuchBucket) are not retried.
+"""
+
+
+def isRetryableError(error):
+    from botocore.exceptions import ClientError
+    if not isinstance(error, ClientError):
+        return True
+    code = error.response.get('Error', {}).get('Code')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return isThrottleCode(code) or code in SERVER_ERROR_CODES or \
+        (status or 0) >= 500
+
+
+"""
+Function that tells whether an error code is a throttling signal.
+"""
+
+
+def isThrottleCode(code):
+    return code in THROTTLE_CODES
+
+
+"""
+Function that tells whether an exception is a throttling signal.
+"""
+
+
+def isThrottle(error):
+    from botocore.exceptions import ClientError
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get('Error', {}).get('Code')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return isThrottleCode(code) or status == 503
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter and a bounded number of retries.
+    Delays are drawn between 0 and min(maxDelay, baseDelay * 2 ** attempt)
+    so that the workers do not retry in lockstep.
+    """
+
+    def __init__(self, maxRetries=DEFAULT_MAX_RETRIES,
+                 baseDelay=DEFAULT_RETRY_BASE_DELAY,
+                 maxDelay=DEFAULT_RETRY_MAX_DELAY):
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+
+    def delay(self, attempt):
+        return random.uniform(
+            0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+
+
+class ConcurrencyController:
+    """
+    Additive increase, multiplicative decrease of the number of requests
+    in flight, driven by the throttling signals of all the workers.
+    The limit grows by about one request per round trip without throttling
+    and is multiplied by decreaseFactor at most once per cooldown seconds.
+    """
+
+    def __init__(self, maxLimit, minLimit=1, decreaseFactor=0.5,
+                 cooldown=1.0):
+        self._maxLimit = maxLimit
+        self._minLimit = minLimit
+        self._decreaseFactor = decreaseFactor
+        self._cooldown = cooldown
+        self._limit = float(maxLimit)
+        self._lastDecrease = 0
+        self._nbDecreases = 0
+
+    def record(self, throttles):
+        if throttles:
+            now = time.time()
+            if now - self._lastDecrease >= self._cooldown:
+                self._limit = max(
+                    self._minLimit, self._limit * self._decreaseFactor)
+                self._lastDecrease = now
+                self._nbDecreases += 1
+        else:
+            self._limit = min(self._maxLimit, self._limit + 1. / self._limit)
+
+    @property
+    def limit(self):
+        return max(self._minLimit, int(self._limit))
+
+    @property
+    def maxLimit(self):
+        return self._maxLimit
+
+    @property
+    def nbDecreases(self):
+        return self._nbDecreases
@@ -3,21 +3,38 @@
 import time
 import os
 import sys
-import boto3
+import copy
+import json
 from builtins import input
 import logging
-import multiprocessing
 import argparse as ap
 from textwrap import dedent
-from concurrent.futures import ProcessPoolExecutor
-from botocore.exceptions import ClientError
-from tool_aws.s3.utils import S3Keys, getMaxChunkSize
-from botocore.parsers import ResponseParserError
-
-try:
-    from httplib import IncompleteRead
-except ImportError:
-    from http.client import IncompleteRead
+from tool_aws.s3.utils import S3Keys, getMaxChunkSize, countTiles
+from tool_aws.s3.tiles import DEFAULT_DENSITY_THRESHOLD, getTileCursor, \
+    TilesFilter, getPrefixSrids
+from tool_aws.s3.lifecycle import addExpirationRules, \
+    removeExpirationRules, getLifecycleRules, isPrefixRule, isPrefixEmpty, \
+    isVersioned, getRuleId, RULE_ID_PREFIX
+from tool_aws.s3.du import getUsage, estimateDeletion, median, humanSize, \
+    humanDuration, PrefixUsage, DEFAULT_PLAN_DEPTH, DEFAULT_PLAN_LIST_DEPTH
+from tool_aws.s3.shards import Shard
+from tool_aws.s3.geometry import loadGeometry
+from tool_aws.s3.journal import Journal, getJournalPath, loadJournal
+from tool_aws.s3.inventory import loadManifest
+from tool_aws.s3.jobs import loadJobManifest, getTargetArgs, \
+    getTargetFlags, getTargetName, JobProgress, DEFAULT_JOB_PARALLELISM
+from tool_aws.s3.pipeline import prefetchMany
+from tool_aws.s3.results import DeleteStats
+from tool_aws.s3.metrics import Metrics, DEFAULT_METRICS_INTERVAL
+from tool_aws.s3.progress import DEFAULT_PROGRESS_INTERVAL
+from tool_aws.s3.engines import ENGINES, DEFAULT_THREADS_PER_PROCESS
+from tool_aws.s3.retry import DEFAULT_MAX_RETRIES, \
+    DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY
+from tool_aws.s3.client import getClientConfig, \
+    DEFAULT_MAX_POOL_CONNECTIONS, DEFAULT_CONNECT_TIMEOUT, \
+    DEFAULT_READ_TIMEOUT
+from tool_aws.s3.deleter import Deleter, iterPayloads, PREFETCH_CHUNKS, \
+    DEFAULT_CHUNK_SIZE
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('boto3').setLevel(logging.CRITICAL)
@@ -48,7 +65,77 @@ def threadType(val):
             usage()
             logger.error('The number of threads must be an integer.')
             sys.exit(1)
-    return multiprocessing.cpu_count()
+    return os.cpu_count()
+
+
+def connectionsType(val):
+    if not val.isdigit() or int(val) < 1:
+        logger.error('The number of pooled connections must be a positive '
+                     'integer.')
+        usage()
+        sys.exit(1)
+    return int(val)
+
+
+def timeoutType(val):
+    try:
+        val = float(val)
+    except ValueError:
+        val = -1
+    if val <= 0:
+        logger.error('Timeouts must be a positive number of seconds.')
+        usage()
+        sys.exit(1)
+    return val
+
+
+def listDepthType(val):
+    if not val.isdigit():
+        logger.error('The listing depth must be a positive integer or 0.')
+        usage()
+        sys.exit(1)
+    return int(val)
+
+
+def retriesType(val):
+    if not val.isdigit():
+        logger.error('The number of retries must be a positive integer.')
+        usage()
+        sys.exit(1)
+    return int(val)
+
+
+def rateType(val):
+    try:
+        val = float(val)
+    except ValueError:
+        val = -1
+    if val <= 0:
+        logger.error('Rate limits must be a positive number per second.')
+        usage()
+        sys.exit(1)
+    return val
+
+
+def shardType(val):
+    try:
+        return Shard.fromString(val)
+    except ValueError:
+        logger.error('The shard must be I/N, with 1 <= I <= N.')
+        usage()
+        sys.exit(1)
+
+
+def densityType(val):
+    try:
+        val = float(val)
+    except ValueError:
+        val = -1
+    if val < 0 or val > 1:
+        logger.error('The density threshold must be between 0 and 1.')
+        usage()
+        sys.exit(1)
+    return val
 
 
 def bboxType(val):
@@ -73,6 +160,15 @@ def bboxType(val):
         return bx
 
 
+def geometryType(val):
+    try:
+        return loadGeometry(val)
+    except (IOError, ValueError, KeyError, TypeError) as e:
+        logger.error('Bad geometry definition in %s: %s' % (val, e))
+        usage()
+        sys.exit(1)
+
+
 def imageFormatType(val):
     if val not in ('png', 'jpeg', 'pngjpeg'):
         logger.error('Unsupported image format %s' % val)
@@ -137,8 +233,9 @@ def createParser():
         dest='prefix',
         action='store',
         type=prefixType,
-        help='Prefix (string) relative to the bucket base path.',
-        required=True)
+        default=None,
+        help='Prefix (string) relative to the bucket base path. \
+            Not used with --job-manifest, where each target has its prefix.')
 
     optionGroup = parser.add_argument_group('Program options')
     optionGroup.add_argument(
@@ -157,13 +254,25 @@ def createParser():
         default=None,
         help='a bounding box in lv95. Only works in combination with  \
             option --image-format')
+    optionGroup.add_argument(
+        '--geometry',
+        dest='geometry',
+        action='store',
+        type=geometryType,
+        default=None,
+        help='A GeoJSON or WKT file of a polygon or multipolygon in lv95 \
+            (or in the CRS it declares). Only the tiles that intersect \
+            it are deleted, it is used instead of --bbox and requires \
+            option --image-format')
     optionGroup.add_argument(
         '-n', '--threads-number',
         dest='nbThreads',
         action='store',
         type=threadType,
-        default=multiprocessing.cpu_count(),
-        help='Number of threads (subprocess), default: machine number of CPUs')
+        default=os.cpu_count(),
+        help='Number of threads (subprocess), default: machine number of \
+            CPUs. Number of processes with --engine process and hybrid, \
+            number of threads with --engine thread')
     optionGroup.add_argument(
         '-s', '--chunk-size',
         dest='chunkSize',
@@ -193,6 +302,31 @@ def createParser():
         type=resolutionType,
         default=0,
         help='The highest resolution in meters')
+    optionGroup.add_argument(
+        '--skip-missing',
+        dest='skipMissing',
+        action='store_true',
+        default=False,
+        help='Only delete the tiles that exist. The columns of the sparse \
+            zooms are listed instead of sending a DELETE for every tile \
+            of the bbox. Only works in combination with option --bbox')
+    optionGroup.add_argument(
+        '--all-versions',
+        dest='allVersions',
+        action='store_true',
+        default=False,
+        help='Delete every version of the keys and the delete markers, \
+            for versioned buckets. The versions are listed, by prefix or \
+            column by column of the tiles of the bbox')
+    optionGroup.add_argument(
+        '--density-threshold',
+        dest='densityThreshold',
+        action='store',
+        type=densityType,
+        default=DEFAULT_DENSITY_THRESHOLD,
+        help='Estimated ratio of existing tiles above which the keys of a \
+            zoom are generated instead of listed with --skip-missing, \
+            default: %s' % DEFAULT_DENSITY_THRESHOLD)
     optionGroup.add_argument(
         '-f', '--force',
         dest='force',
@@ -200,39 +334,324 @@ def createParser():
         default=False,
         help='force the removal, i.e. no prompt for confirmation.')
 
+    optionGroup.add_argument(
+        '--engine',
+        dest='engine',
+        action='store',
+        choices=ENGINES,
+        default='process',
+        help='Execution engine of the deletion: a pool of processes, \
+            a pool of threads, a pool of processes running \
+            --threads-per-process threads each or an event loop running \
+            --concurrency requests at a time, default: process')
+    optionGroup.add_argument(
+        '--threads-per-process',
+        dest='threadsPerProcess',
+        action='store',
+        type=threadType,
+        default=DEFAULT_THREADS_PER_PROCESS,
+        help='Number of threads per process with --engine hybrid, \
+            default: %s' % DEFAULT_THREADS_PER_PROCESS)
+    optionGroup.add_argument(
+        '--concurrency',
+        dest='concurrency',
+        action='store',
+        type=threadType,
+        default=100,
+        help='Number of concurrent requests with --engine asyncio, \
+            default: 100')
+    optionGroup.add_argument(
+        '--list-depth',
+        dest='listDepth',
+        action='store',
+        type=listDepthType,
+        default=0,
+        help='Number of path levels below the prefix used to split the \
+            listing in shards listed in parallel (e.g. 2 below a srid \
+            gives zoom/col shards). Only used without --bbox, \
+            default: 0 (sequential listing)')
+    optionGroup.add_argument(
+        '--list-parallelism',
+        dest='listParallelism',
+        action='store',
+        type=threadType,
+        default=None,
+        help='Number of threads listing shards concurrently, \
+            default: number of threads (-n)')
+    optionGroup.add_argument(
+        '--shard',
+        dest='shard',
+        action='store',
+        type=shardType,
+        default=None,
+        help='Only delete the shard I of N deterministic parts of the \
+            keys (I/N), so that N hosts share a deletion without any \
+            coordination. The tiles of a bbox are split by ranges of \
+            columns of each zoom, the keys of a prefix by the hash of \
+            their sub-prefix --list-depth levels below the prefix (each \
+            shard only lists its own sub-prefixes)')
+    optionGroup.add_argument(
+        '--inventory',
+        dest='inventory',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of the manifest.json of a local copy of an S3 Inventory \
+            of the bucket (CSV, Parquet or ORC). The keys are read from the \
+            inventory instead of being listed, then filtered by prefix \
+            and bbox')
+    optionGroup.add_argument(
+        '--keys-from',
+        dest='keysFrom',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of a file of newline delimited keys to delete, \
+            - for stdin, optionally gzip or zstd compressed. Only the keys \
+            within the prefix (and bbox) are deleted')
+    optionGroup.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        default=False,
+        help='Continue an interrupted deletion where it stopped, \
+            using its journal')
+    optionGroup.add_argument(
+        '--journal',
+        dest='journal',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of the progress journal of the deletion, \
+            default: .s3rm-<job hash>.journal in the current directory')
+
+    jobGroup = parser.add_argument_group('Job manifest options')
+    jobGroup.add_argument(
+        '--job-manifest',
+        dest='jobManifest',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of a JSON or YAML job manifest listing many targets of \
+            the bucket to delete in one run, over a single pool of \
+            workers. A target has a prefix and optionally a bbox, \
+            imageFormat, lowRes, highRes, skipMissing, allVersions, \
+            densityThreshold, listDepth, chunkSize, keysFrom, inventory \
+            and name, the other options of the command line apply to \
+            every target')
+    jobGroup.add_argument(
+        '--job-parallelism',
+        dest='jobParallelism',
+        action='store',
+        type=threadType,
+        default=DEFAULT_JOB_PARALLELISM,
+        help='Number of targets of the job manifest whose keys are listed \
+            or generated at the same time, their chunks are interleaved \
+            in the pool of workers, default: %s' % DEFAULT_JOB_PARALLELISM)
+
+    planGroup = parser.add_argument_group('Plan options')
+    planGroup.add_argument(
+        '--plan',
+        dest='plan',
+        action='store_true',
+        default=False,
+        help='Do not delete anything, list the prefix in parallel shards \
+            (--list-depth, default: %s) and report the number of objects \
+            and their size per sub-prefix, and an estimate of the number \
+            of DELETE requests and of the duration of the deletion at the \
+            current concurrency. Same as the s3du command' % (
+            DEFAULT_PLAN_LIST_DEPTH))
+    planGroup.add_argument(
+        '--plan-depth',
+        dest='planDepth',
+        action='store',
+        type=listDepthType,
+        default=DEFAULT_PLAN_DEPTH,
+        help='Number of path levels below the prefix of the reported \
+            sub-prefixes (e.g. 1 below a srid gives zooms), \
+            default: %s' % DEFAULT_PLAN_DEPTH)
+    planGroup.add_argument(
+        '--plan-json',
+        dest='planJson',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of a JSON report of the plan. When deleting, the \
+            number of objects of the report of a plan of the same deletion \
+            is used to estimate the remaining time')
+
+    lifecycleGroup = parser.add_argument_group('Lifecycle options')
+    lifecycleGroup.add_argument(
+        '--via-lifecycle',
+        dest='viaLifecycle',
+        action='store_true',
+        default=False,
+        help='Do not send DELETE requests, add a rule expiring the whole \
+            prefix to the lifecycle configuration of the bucket (the other \
+            rules are kept). S3 deletes the objects asynchronously, at no \
+            request cost, from the day after. The prefix must end with /')
+    lifecycleGroup.add_argument(
+        '--lifecycle-finish',
+        dest='lifecycleFinish',
+        action='store_true',
+        default=False,
+        help='Check whether the prefix expired with --via-lifecycle is \
+            empty and, if so, remove its expiration rule')
+
+    metricsGroup = parser.add_argument_group('Metrics options')
+    metricsGroup.add_argument(
+        '--metrics-json',
+        dest='metricsJson',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of a JSON summary of the metrics of the deletion (phases \
+            timings, keys/s, latency histograms, throttles and errors), \
+            written at the end of the deletion')
+    metricsGroup.add_argument(
+        '--metrics-textfile',
+        dest='metricsTextfile',
+        action='store',
+        type=str,
+        default=None,
+        help='Path of a Prometheus textfile (e.g. in the directory of the \
+            textfile collector of the node exporter) updated during the \
+            deletion')
+    metricsGroup.add_argument(
+        '--metrics-interval',
+        dest='metricsInterval',
+        action='store',
+        type=timeoutType,
+        default=DEFAULT_METRICS_INTERVAL,
+        help='Seconds between two updates of the Prometheus textfile, \
+            default: %s' % DEFAULT_METRICS_INTERVAL)
+    metricsGroup.add_argument(
+        '--progress-interval',
+        dest='progressInterval',
+        action='store',
+        type=timeoutType,
+        default=DEFAULT_PROGRESS_INTERVAL,
+        help='Seconds between two progress lines (keys deleted, keys/s, \
+            failed and retried keys and remaining time), default: %s' % (
+            DEFAULT_PROGRESS_INTERVAL))
+    metricsGroup.add_argument(
+        '--debug',
+        dest='debug',
+        action='store_true',
+        default=False,
+        help='Log every DELETE request of the workers and its response')
+
+    connectionGroup = parser.add_argument_group('Connection options')
+    connectionGroup.add_argument(
+        '--max-retries',
+        dest='maxRetries',
+        action='store',
+        type=retriesType,
+        default=DEFAULT_MAX_RETRIES,
+        help='Maximal number of retries of a DELETE request, '
+             'default: %s' % DEFAULT_MAX_RETRIES)
+    connectionGroup.add_argument(
+        '--retry-base-delay',
+        dest='retryBaseDelay',
+        action='store',
+        type=timeoutType,
+        default=DEFAULT_RETRY_BASE_DELAY,
+        help='Base delay in seconds of the exponential backoff (with jitter) '
+             'between retries, default: %s' % DEFAULT_RETRY_BASE_DELAY)
+    connectionGroup.add_argument(
+        '--retry-max-delay',
+        dest='retryMaxDelay',
+        action='store',
+        type=timeoutType,
+        default=DEFAULT_RETRY_MAX_DELAY,
+        help='Maximal delay in seconds between retries, '
+             'default: %s' % DEFAULT_RETRY_MAX_DELAY)
+    connectionGroup.add_argument(
+        '--max-requests-per-second',
+        dest='maxRequestsPerSecond',
+        action='store',
+        type=rateType,
+        default=None,
+        help='Maximal number of DELETE requests per second (retries \
+            included), shared by all the workers, default: no limit')
+    connectionGroup.add_argument(
+        '--max-keys-per-second',
+        dest='maxKeysPerSecond',
+        action='store',
+        type=rateType,
+        default=None,
+        help='Maximal number of keys sent per second in the DELETE \
+            requests (retries included), shared by all the workers, \
+            default: no limit')
+    connectionGroup.add_argument(
+        '--endpoint-url',
+        dest='endpointUrl',
+        action='store',
+        type=str,
+        default=None,
+        help='S3 endpoint url, default: AWS endpoint of the profile')
+    connectionGroup.add_argument(
+        '--max-pool-connections',
+        dest='maxPoolConnections',
+        action='store',
+        type=connectionsType,
+        default=DEFAULT_MAX_POOL_CONNECTIONS,
+        help='Maximal number of pooled HTTP connections per worker, '
+             'default: %s' % DEFAULT_MAX_POOL_CONNECTIONS)
+    connectionGroup.add_argument(
+        '--connect-timeout',
+        dest='connectTimeout',
+        action='store',
+        type=timeoutType,
+        default=DEFAULT_CONNECT_TIMEOUT,
+        help='Connection timeout in seconds, '
+             'default: %s' % DEFAULT_CONNECT_TIMEOUT)
+    connectionGroup.add_argument(
+        '--read-timeout',
+        dest='readTimeout',
+        action='store',
+        type=timeoutType,
+        default=DEFAULT_READ_TIMEOUT,
+        help='Read timeout in seconds, default: %s' % DEFAULT_READ_TIMEOUT)
+
     return parser
 
 
 def guessSrids(opts):
-    srids = []
     if not opts.bbox:
-        return srids
-    supportedSrids = [21781, 2056, 4326, 3857]
-    pathSplit = [p for p in opts.prefix.split('/') if p]
-    if len(pathSplit) > 5:
-        usage()
-        logger.error(
-            'Path should stop at the srid level definition')
-        sys.exit(1)
-    elif len(pathSplit) < 4:
+        return []
+    try:
+        return getPrefixSrids(opts.prefix)
+    except ValueError as e:
         usage()
-        logger.error(
-            'Incorrect path definition, missing timestamp and/or layerid')
+        logger.error(e)
         sys.exit(1)
-    elif len(pathSplit) == 5:
-        srid = int(pathSplit[4])
-        if srid not in supportedSrids:
-            usage()
-            logger.error('SRID %s is not supported' % srid)
-            sys.exit(1)
-        srids = [srid]
-    else:
-        srids = supportedSrids
-    return srids
 
 
 def parseArguments(parser, argv):
     opts = parser.parse_args(argv[1:])
+    if opts.listParallelism is None:
+        opts.listParallelism = opts.nbThreads
+    if opts.jobManifest:
+        return checkJobManifest(parser, opts), []
+    if opts.prefix is None:
+        usage()
+        logger.error('A prefix is required (--prefix option), unless the ' +
+                     'targets are defined in a job manifest ' +
+                     '(--job-manifest option)')
+        sys.exit(1)
+    return checkOptions(opts)
+
+
+def checkOptions(opts):
+    if opts.geometry:
+        if opts.bbox:
+            usage()
+            logger.error('The tiles are selected either by a bbox or by ' +
+                         'a geometry')
+            sys.exit(1)
+        # The bbox of the tiles is the envelope of the geometry
+        opts.bbox = opts.geometry.bounds
     # bbox is required when a highest or lowest resolution is defined
     if opts.lowRes != float('inf') or opts.highRes != 0:
         if not opts.bbox:
@@ -250,6 +669,72 @@ def parseArguments(parser, argv):
                 'setting (--bbox option)'
             )
             sys.exit(1)
+    if opts.inventory:
+        try:
+            manifest = loadManifest(opts.inventory)
+        except (IOError, ValueError) as e:
+            usage()
+            logger.error('Invalid inventory manifest: %s' % e)
+            sys.exit(1)
+        if manifest.get('sourceBucket') != opts.bucketName:
+            usage()
+            logger.error('The inventory is the one of bucket %s' % (
+                manifest.get('sourceBucket')))
+            sys.exit(1)
+    if opts.keysFrom:
+        if opts.inventory:
+            usage()
+            logger.error('Keys are read either from a file or an inventory')
+            sys.exit(1)
+        if opts.keysFrom == '-' and not opts.force:
+            usage()
+            logger.error('Keys read from stdin require --force')
+            sys.exit(1)
+        if opts.keysFrom != '-' and not os.path.isfile(opts.keysFrom):
+            usage()
+            logger.error('Keys file %s not found' % opts.keysFrom)
+            sys.exit(1)
+    if opts.viaLifecycle or opts.lifecycleFinish:
+        if opts.viaLifecycle and opts.lifecycleFinish:
+            usage()
+            logger.error('A lifecycle rule is either added or removed')
+            sys.exit(1)
+        if opts.bbox or opts.keysFrom or opts.inventory or opts.plan or \
+                opts.shard:
+            usage()
+            logger.error('Lifecycle rules expire a whole prefix, they can '
+                         'not be combined with --bbox, --keys-from, '
+                         '--inventory, --plan or --shard')
+            sys.exit(1)
+        # A prefix not ending with / would also expire its siblings
+        # (e.g. /1.0.0/ch.layer matches /1.0.0/ch.layer2)
+        if opts.prefix == '/' or not opts.prefix.endswith('/'):
+            usage()
+            logger.error('The expired prefix must end with / and can not '
+                         'be the whole bucket')
+            sys.exit(1)
+    if opts.plan and (opts.keysFrom or opts.inventory):
+        usage()
+        logger.error('The plan lists the bucket, it does not read the keys '
+                     'from a file or an inventory')
+        sys.exit(1)
+    if opts.allVersions and (opts.keysFrom or opts.inventory or
+                             opts.skipMissing):
+        usage()
+        logger.error('The versions are listed, they can not be read from a '
+                     'file or an inventory (or skipped)')
+        sys.exit(1)
+    if opts.shard and not opts.bbox and opts.listDepth < 1:
+        usage()
+        logger.error('The keys of a prefix are split by sub-prefix, ' +
+                     '--shard requires --list-depth 1 or more')
+        sys.exit(1)
+    if opts.skipMissing and not opts.bbox:
+        usage()
+        logger.error(
+            'Missing tiles can only be skipped when a bbox is defined ' +
+            '(--bbox option)')
+        sys.exit(1)
     if opts.bbox:
         # Image format is required when a bbox is defined
         if not opts.imageFormat:
@@ -260,6 +745,56 @@ def parseArguments(parser, argv):
     return opts, guessSrids(opts)
 
 
+def checkJobManifest(parser, opts):
+    if opts.prefix:
+        usage()
+        logger.error('The prefixes are defined by the targets of the job ' +
+                     'manifest')
+        sys.exit(1)
+    if opts.plan or opts.viaLifecycle or opts.lifecycleFinish or \
+            opts.resume or opts.journal:
+        usage()
+        logger.error('Job manifests can not be planned, expired with ' +
+                     'lifecycle rules or resumed')
+        sys.exit(1)
+    try:
+        manifest = loadJobManifest(opts.jobManifest)
+    except (IOError, ValueError, RuntimeError) as e:
+        usage()
+        logger.error('Invalid job manifest: %s' % e)
+        sys.exit(1)
+    if manifest.get('bucketName', opts.bucketName) != opts.bucketName:
+        usage()
+        logger.error('The job manifest is the one of bucket %s' % (
+            manifest['bucketName']))
+        sys.exit(1)
+    opts.jobTargets = getJobTargets(parser, opts, manifest)
+    return opts
+
+
+def getJobTargets(parser, opts, manifest):
+    # Each target is parsed and checked as a command line of its own,
+    # the options of the command line are the defaults of the targets
+    # and the paths of the targets are relative to the manifest
+    baseDir = os.path.dirname(os.path.abspath(opts.jobManifest))
+    targets = []
+    for target in manifest['targets']:
+        name = getTargetName(target)
+        namespace = copy.copy(opts)
+        vars(namespace).update(getTargetFlags(target))
+        try:
+            targetOpts = parser.parse_args(
+                ['--bucket-name', opts.bucketName] +
+                getTargetArgs(target, baseDir), namespace=namespace)
+            targetOpts.jobManifest = None
+            targetOpts, srids = checkOptions(targetOpts)
+        except SystemExit:
+            logger.error('Invalid target %s of the job manifest' % name)
+            raise
+        targets.append((name, targetOpts, srids))
+    return targets
+
+
 def startJob(keys, force):
     if len(keys) == 0:
         logger.info('Actually, there\'s nothing to do... aborting')
@@ -275,7 +810,10 @@ def startJob(keys, force):
                     'These represents the first batch.' % keys.chunkSize)
     logger.info('Warning: the script will now start deleting:')
     logger.info(keys)
+    return confirm(force)
+
 
+def confirm(force):
     if force:
         return True
 
@@ -296,103 +834,498 @@ def startJob(keys, force):
     return True
 
 
-def deleteKeys(keys):
-    # When using SSL and multithreading one need to create one connection
-    # per process. See also: http://stackoverflow.com/questions/
-    # 3724900/python-ssl-problem-with-multiprocessing
-    session = boto3.session.Session(profile_name=profileName)
-    s3 = session.resource('s3')
-    S3Bucket = s3.Bucket(bucketName)
-    logger.info('Worker pid %s and parent pid %s' % (
-        multiprocessing.current_process().pid, os.getppid()))
-    logger.info('Deleting %s keys at a time' % len(keys['Objects']))
+def getJob(opts, srids):
+    # What identifies a deletion in its journal
+    job = {
+        'bucketName': opts.bucketName,
+        'prefix': opts.prefix
+    }
+    if opts.keysFrom:
+        # A changed keys file is another job, its keys are not the ones
+        # of the cursor
+        stat = os.stat(opts.keysFrom)
+        job.update({
+            'keysFrom': os.path.abspath(opts.keysFrom),
+            'keysFromSize': stat.st_size,
+            'keysFromMtime': stat.st_mtime_ns
+        })
+    if opts.shard:
+        job['shard'] = str(opts.shard)
+    if opts.geometry:
+        job['geometry'] = opts.geometry.digest
+    if opts.bbox:
+        job.update({
+            'bbox': opts.bbox,
+            'srids': srids,
+            'imageFormat': opts.imageFormat,
+            'lowRes': opts.lowRes,
+            'highRes': opts.highRes
+        })
+    # Same types as once read back from the journal
+    return json.loads(json.dumps(job))
+
+
+def lastKey(payload):
+    return payload[-1]
+
+
+def lastTile(payload):
+    return getTileCursor(lastKey(payload))
+
+
+def openJournal(opts, srids):
+    # Returns the journal of the job and the cursor to start from
+    if opts.keysFrom == '-' or opts.inventory:
+        if opts.resume:
+            logger.info('Deletions from stdin or from an inventory ' +
+                        'cannot be resumed, all the keys are sent again.')
+        return None, None
+    if opts.skipMissing or opts.allVersions or opts.listDepth > 0:
+        # Keys are not listed in order, but only the remaining ones are
+        if opts.resume:
+            logger.info('The existing keys are listed again, ' +
+                        'deleted keys will not be listed twice.')
+        return None, None
+    job = getJob(opts, srids)
+    path = opts.journal or getJournalPath(job)
+    journal = Journal(
+        path, job, lastTile if opts.bbox and not opts.keysFrom else lastKey)
+    previous = loadJournal(path)
+    if previous is None:
+        if opts.resume:
+            logger.info('No journal found at %s, starting from the ' % path +
+                        'beginning.')
+        return journal, None
+    if not opts.resume:
+        logger.warning('The journal %s of a previous run will be ' % path +
+                       'overwritten, use --resume to continue it.')
+        return journal, None
+    if previous['job'] != job:
+        logger.error('The journal %s belongs to another job: %s' % (
+            path, previous['job']))
+        sys.exit(1)
+    logger.info('Resuming after %s' % (previous['cursor'],))
+    return journal, previous['cursor']
+
+
+def createDeleter(opts, chunkSize=None, progressInterval=None):
+    # The deleter of the options of the command line
+    return Deleter(
+        opts.bucketName, profileName=opts.profileName,
+        endpointUrl=opts.endpointUrl, engine=opts.engine,
+        concurrency=opts.concurrency if opts.engine == 'asyncio'
+        else opts.nbThreads,
+        threadsPerProcess=opts.threadsPerProcess,
+        chunkSize=chunkSize or opts.chunkSize or DEFAULT_CHUNK_SIZE,
+        maxRetries=opts.maxRetries, retryBaseDelay=opts.retryBaseDelay,
+        retryMaxDelay=opts.retryMaxDelay,
+        maxRequestsPerSecond=opts.maxRequestsPerSecond,
+        maxKeysPerSecond=opts.maxKeysPerSecond,
+        maxPoolConnections=opts.maxPoolConnections,
+        connectTimeout=opts.connectTimeout, readTimeout=opts.readTimeout,
+        progressInterval=progressInterval or opts.progressInterval,
+        logLevel=logging.DEBUG if opts.debug else None)
+
+
+def runDeletion(opts, payloads, reportInterval, chunkSize, journal=None,
+                metrics=None, progress=None, total=None):
+    # The stats are yielded with each progress line, every reportInterval
+    # seconds, and at the end
+    deleter = createDeleter(opts, chunkSize, reportInterval)
+    return deleter.run(payloads, total, journal, metrics, progress)
+
+
+def reportStats(stats):
+    logger.info('Summary: %s' % stats)
+    if stats.failed:
+        logger.error('%s keys could not be deleted, for instance:\n%s' % (
+            stats.failed, '\n'.join(stats.failedKeys)))
+
+
+def reportMetrics(opts, metrics, stats):
+    summary = metrics.summary(stats)
+    latency = summary['requestLatency']
+    logger.info(
+        'Metrics: %s keys/s, request latency p50 <= %ss p99 <= %ss, ' % (
+            summary['keysPerSecond'], latency['p50'], latency['p99']) +
+        'throttles: %s, phases: %s' % (
+            metrics.counters['throttles'], summary['phases']))
     try:
-        response = S3Bucket.delete_objects(Delete=keys)
-    except (IncompleteRead, ClientError, ResponseParserError) as e:
-        logger.error(e, exc_info=True)
-        logger.error('An error occurred, retry in 30 sec...')
-        time.sleep(30)
-        return deleteKeys(keys)
-    except Exception as e:
-        logger.error(e, exc_info=True)
-        raise e
-    logger.info('result: %s' % response)
-    return response
-
-
-def deleteWithBBox(opts, S3Bucket, keys):
+        if opts.metricsJson:
+            metrics.writeJson(opts.metricsJson, stats)
+        if opts.metricsTextfile:
+            metrics.writePrometheus(opts.metricsTextfile, stats)
+    except (IOError, OSError) as e:
+        logger.error('Could not write the metrics: %s' % e)
+
+
+def createMetrics(opts):
+    labels = {'bucket': opts.bucketName}
+    if opts.shard:
+        labels['shard'] = str(opts.shard)
+    if opts.jobManifest:
+        labels['manifest'] = opts.jobManifest
+    else:
+        labels['prefix'] = opts.prefix
+    return Metrics(
+        labels=labels,
+        textfile=opts.metricsTextfile, interval=opts.metricsInterval)
+
+
+def chunkKeys(keys, chunkSize):
+    # The first keys are read, the errors of the keys source (e.g. a
+    # cursor that is not in the keys file) are errors of the options
+    try:
+        keys.chunk(chunkSize)
+    except (IOError, ValueError) as e:
+        usage()
+        logger.error(e)
+        sys.exit(1)
+
+
+def deleteWithBBox(opts, S3Bucket, keys, journal=None, metrics=None):
+    metrics = metrics or createMetrics(opts)
     # Use max chunkSize as we always delete the whole columns
-    nbKeysDeleted = 0
     nbKeysTotal = keys.countTiles()
-    chunkSize = opts.chunkSize or 1000
-    logger.info(
-        'We are about to trigger %s DELETE requests' % nbKeysTotal)
-    keys.chunk(chunkSize)
+    chunkSize = opts.chunkSize or DEFAULT_CHUNK_SIZE
+    if opts.allVersions:
+        logger.info(
+            'We will delete every version of at most %s tiles' % nbKeysTotal)
+    elif opts.skipMissing or opts.inventory or opts.keysFrom:
+        logger.info(
+            'We will at most trigger %s DELETE requests' % nbKeysTotal)
+    else:
+        logger.info(
+            'We are about to trigger %s DELETE requests' % nbKeysTotal)
+    with metrics.timer('keys'):
+        chunkKeys(keys, chunkSize)
     if startJob(keys, opts.force):
         logger.info('Deletion started...')
-        previousNumberOfKeys = keys.maxKeys
-        while len(keys) > 0 and previousNumberOfKeys == keys.maxKeys:
-            if len(keys):
-                logger.info('New batch delete')
-                logger.info(str(keys))
-                # keys are pre-chunked in lists of chunksize
-                # send one list per process
-                with ProcessPoolExecutor(
-                        max_workers=opts.nbThreads) as executor:
-                    executor.map(deleteKeys, keys, timeout=3 * 60, chunksize=1)
-            previousNumberOfKeys = len(keys)
-            keys.chunk(chunkSize)
-            nbKeysDeleted += previousNumberOfKeys
-            logger.info(
-                'We have deleted %s/%s tiles.' % (nbKeysDeleted, nbKeysTotal))
-
-
-def deleteWithPrefix(opts, S3Bucket, keys):
-    nbKeysDeleted = 0
-    nbKeysTotal = keys.countTiles()
-    logger.info(
-        'We will at most trigger %s DELETE requests' % nbKeysTotal)
+        stats = DeleteStats()
+        try:
+            for stats in runDeletion(
+                    opts, iterPayloads(keys, chunkSize),
+                    opts.progressInterval, chunkSize, journal, metrics,
+                    total=getPlannedTotal(opts) or nbKeysTotal):
+                pass
+        finally:
+            reportMetrics(opts, metrics, stats)
+        reportStats(stats)
+
+
+def deleteWithPrefix(opts, S3Bucket, keys, journal=None, metrics=None):
+    metrics = metrics or createMetrics(opts)
+    # The number of keys is only known from a plan
+    nbKeysTotal = getPlannedTotal(opts)
+    if nbKeysTotal is not None:
+        logger.info('The plan %s counted %s keys' % (
+            opts.planJson, nbKeysTotal))
     chunkSize = opts.chunkSize or getMaxChunkSize(
         opts.nbThreads, len(keys))
-    keys.chunk(chunkSize)
+    with metrics.timer('keys'):
+        chunkKeys(keys, chunkSize)
     if startJob(keys, opts.force):
         logger.info('Deletion started...')
-        # Make sure we delete the first batch
-        previousNumberOfKeys = keys.maxKeys
-        while len(keys) > 0 and previousNumberOfKeys == keys.maxKeys:
-            keys = S3Keys(S3Bucket, opts.prefix)
-            keys.chunk(chunkSize)
-            if len(keys):
-                logger.info('New batch delete')
-                logger.info(str(keys))
-                with ProcessPoolExecutor(
-                        max_workers=opts.nbThreads) as executor:
-                    executor.map(deleteKeys, keys, timeout=3 * 60, chunksize=1)
-            previousNumberOfKeys = len(keys)
-            nbKeysDeleted += previousNumberOfKeys
-            logger.info(
-                'We have deleted %s/%s tiles at most.' % (
-                    nbKeysDeleted, nbKeysTotal))
-
-
-def main():
-    global bucketName, profileName
+        stats = DeleteStats()
+        try:
+            for stats in runDeletion(
+                    opts, iterPayloads(keys, chunkSize),
+                    opts.progressInterval, chunkSize, journal, metrics,
+                    total=nbKeysTotal):
+                pass
+        finally:
+            reportMetrics(opts, metrics, stats)
+        reportStats(stats)
+
+
+def iterTargetPayloads(opts, S3Bucket, srids):
+    # The keys of a target of a job manifest are only listed (or
+    # generated) once the target is scheduled
+    keys = createKeys(opts, S3Bucket, srids)
+    chunkSize = opts.chunkSize or DEFAULT_CHUNK_SIZE
+    keys.chunk(chunkSize)
+    for payload in iterPayloads(keys, chunkSize):
+        yield payload
+
+
+def getWithin(opts):
+    if opts.geometry:
+        return ' within the geometry'
+    return ' within the bbox' if opts.bbox else ''
+
+
+def countTargetTiles(opts, srids):
+    # The number of keys of a target, if known before listing it
+    if opts.bbox and not (opts.skipMissing or opts.keysFrom or
+                          opts.inventory or opts.allVersions):
+        return sum(countTiles(
+            srid, opts.lowRes, opts.highRes, bbox=opts.bbox,
+            shard=opts.shard, geometry=opts.geometry) for srid in srids)
+    return None
+
+
+def describeTarget(name, opts, srids):
+    nbTiles = countTargetTiles(opts, srids)
+    if nbTiles is not None:
+        return '%s: %s tiles' % (name, nbTiles)
+    return '%s: every %s of the prefix%s' % (
+        name, 'version' if opts.allVersions else 'key',
+        getWithin(opts))
+
+
+def reportJob(progress):
+    for name, stats in zip(progress.names, progress.stats):
+        logger.info('Target %s: %s' % (name, stats))
+
+
+def deleteJob(opts, S3Bucket, metrics=None):
+    # The targets of a job manifest share a single pool of workers, the
+    # keys of jobParallelism targets are produced at a time and their
+    # chunks are interleaved, so that the workers keep busy while a
+    # target is being listed or when it runs out of keys
+    metrics = metrics or createMetrics(opts)
+    targets = opts.jobTargets
+    logger.info('Warning: the script will now start deleting the %s ' % (
+        len(targets)) + 'targets of %s in bucket %s:\n%s' % (
+        opts.jobManifest, opts.bucketName, '\n'.join(
+            describeTarget(name, targetOpts, srids)
+            for name, targetOpts, srids in targets)))
+    if opts.resume:
+        logger.info('Deletions of a job manifest cannot be resumed, ' +
+                    'the existing keys are listed again.')
+    if not confirm(opts.force):
+        return
+    progress = JobProgress(
+        [name for name, targetOpts, srids in targets],
+        [targetOpts.prefix for name, targetOpts, srids in targets])
+    payloads = prefetchMany(
+        [progress.tag(i, iterTargetPayloads(targetOpts, S3Bucket, srids))
+         for i, (name, targetOpts, srids) in enumerate(targets)],
+        min(opts.jobParallelism, len(targets)), PREFETCH_CHUNKS)
+    counts = [countTargetTiles(targetOpts, srids)
+              for name, targetOpts, srids in targets]
+    logger.info('Deletion started...')
+    stats = DeleteStats()
+    try:
+        for stats in runDeletion(
+                opts, payloads, opts.progressInterval,
+                opts.chunkSize, metrics=metrics, progress=progress,
+                total=None if None in counts else sum(counts)):
+            pass
+    finally:
+        reportMetrics(opts, metrics, stats)
+    progress.completed()
+    reportJob(progress)
+    reportStats(stats)
+
+
+def planDeletion(opts, S3Bucket, srids):
+    keysFilter = TilesFilter(
+        opts.prefix, srids, opts.bbox, opts.imageFormat, opts.lowRes,
+        opts.highRes, opts.shard, opts.geometry) if opts.bbox else None
+    listDepth = opts.listDepth or DEFAULT_PLAN_LIST_DEPTH
+    logger.info('Listing %s in shards %s levels deep with %s threads...' % (
+        opts.prefix, listDepth, opts.listParallelism))
+    t0 = time.time()
+    usage, latencies = getUsage(
+        S3Bucket, opts.prefix, opts.planDepth, listDepth,
+        opts.listParallelism, keysFilter, opts.allVersions,
+        None if opts.bbox else opts.shard)
+    elapsed = time.time() - t0
+    total = PrefixUsage()
+    lines = []
+    for subPrefix in sorted(usage):
+        u = usage[subPrefix]
+        total.add(u.count, u.size)
+        lines.append('%12d objects %12s  %s' % (
+            u.count, humanSize(u.size), subPrefix))
+    lines.append('%12d objects %12s  total' % (
+        total.count, humanSize(total.size)))
+    logger.info('Objects per sub-prefix%s:\n%s' % (
+        getWithin(opts), '\n'.join(lines)))
+    chunkSize = opts.chunkSize or DEFAULT_CHUNK_SIZE
+    concurrency = createDeleter(opts).requestConcurrency
+    # The latency of the listing requests is used for the DELETE requests
+    latency = median(latencies) or 0
+    estimate = estimateDeletion(total.count, chunkSize, concurrency, latency)
+    logger.info(
+        'Listed in %.1fs (%s requests, median latency %.3fs)' % (
+            elapsed, len(latencies), latency))
+    logger.info(
+        'The deletion would send %s DELETE requests of %s keys, ' % (
+            estimate['requests'], chunkSize) +
+        'it would take about %s with %s concurrent requests ' % (
+            humanDuration(estimate['seconds']), concurrency) +
+        '(%s at %.3fs per request, %s at the S3 rate limit of a prefix)' % (
+            humanDuration(estimate['latencyBound']), latency,
+            humanDuration(estimate['rateBound'])))
+    if opts.planJson:
+        with open(opts.planJson, 'w') as f:
+            json.dump({
+                'bucketName': opts.bucketName,
+                'prefix': opts.prefix,
+                'bbox': opts.bbox,
+                'geometry': opts.geometry.digest if opts.geometry else None,
+                'shard': str(opts.shard) if opts.shard else None,
+                'allVersions': opts.allVersions,
+                'subPrefixes': dict(
+                    (k, v.toDict()) for k, v in sorted(usage.items())),
+                'total': total.toDict(),
+                'listing': {'seconds': elapsed, 'requests': len(latencies),
+                            'medianLatency': latency},
+                'chunkSize': chunkSize,
+                'concurrency': concurrency,
+                'estimate': estimate
+            }, f, indent=2)
+    return usage
+
+
+def getPlannedTotal(opts):
+    # The number of objects of the JSON report of a plan of the same
+    # deletion, if any
+    if not opts.planJson or not os.path.exists(opts.planJson):
+        return None
+    try:
+        with open(opts.planJson) as f:
+            plan = json.load(f)
+        planned = dict((k, plan.get(k)) for k in (
+            'bucketName', 'prefix', 'bbox', 'geometry', 'shard',
+            'allVersions'))
+        total = plan['total']['count']
+    except (IOError, ValueError, KeyError, TypeError) as e:
+        logger.error('Could not read the plan %s: %s' % (opts.planJson, e))
+        return None
+    if planned != {
+            'bucketName': opts.bucketName, 'prefix': opts.prefix,
+            'bbox': opts.bbox,
+            'geometry': opts.geometry.digest if opts.geometry else None,
+            'shard': str(opts.shard) if opts.shard else None,
+            'allVersions': opts.allVersions}:
+        logger.info('The plan %s is the one of another deletion, ' % (
+            opts.planJson) + 'the remaining time is not estimated.')
+        return None
+    return total
+
+
+def expireWithLifecycle(opts, client):
+    rules = getLifecycleRules(client, opts.bucketName)
+    others = [r for r in rules if not isPrefixRule(r, opts.prefix)]
+    logger.info('The bucket %s has %s other lifecycle rules, ' % (
+        opts.bucketName, len(others)) + 'they will be kept.')
+    logger.info('Warning: every object of s3://%s%s will expire.' % (
+        opts.bucketName, opts.prefix))
+    if not confirm(opts.force):
+        return
+    prefixRules = addExpirationRules(client, opts.bucketName, opts.prefix)
+    logger.info('Added the lifecycle rules %s, S3 will delete the objects ' %
+                ', '.join(r['ID'] for r in prefixRules) +
+                'from tomorrow on, at no request cost.')
+    logger.info('Once it is done, remove the rules with:\n'
+                '%s --bucket-name %s --prefix %s --lifecycle-finish' % (
+                    os.path.basename(sys.argv[0]), opts.bucketName,
+                    opts.prefix))
+
+
+def finishLifecycle(opts, client):
+    # Returns whether the expiration of the prefix is complete
+    allRules = getLifecycleRules(client, opts.bucketName)
+    rules = [r for r in allRules if isPrefixRule(r, opts.prefix)]
+    pending = [r for r in allRules if r not in rules and
+               r.get('ID', '').startswith(RULE_ID_PREFIX) and
+               'Days' in r.get('Expiration', {})]
+    if pending:
+        logger.info('Other prefixes expired by s3rm: %s' % ', '.join(
+            r.get('Filter', r).get('Prefix', '') for r in pending))
+    if not rules:
+        logger.info('There is no lifecycle rule %s expiring %s.' % (
+            getRuleId(opts.prefix), opts.prefix))
+        return True
+    if not isPrefixEmpty(client, opts.bucketName, opts.prefix,
+                         isVersioned(client, opts.bucketName)):
+        logger.info('The objects of %s are still being expired, ' % (
+            opts.prefix) + 'the lifecycle rules are kept.')
+        return False
+    removeExpirationRules(client, opts.bucketName, opts.prefix)
+    logger.info('%s is empty, the lifecycle rules %s were removed.' % (
+        opts.prefix, ', '.join(r['ID'] for r in rules)))
+    return True
+
+
+def planMain():
+    # s3du, the plan of a deletion
+    main(plan=True)
+
+
+def createKeys(opts, S3Bucket, srids, cursor=None):
+    return S3Keys(S3Bucket, opts.prefix, srids=srids,
+                  bbox=opts.bbox, imageFormat=opts.imageFormat,
+                  lowRes=opts.lowRes, highRes=opts.highRes,
+                  listDepth=opts.listDepth,
+                  listParallelism=opts.listParallelism,
+                  skipMissing=opts.skipMissing,
+                  densityThreshold=opts.densityThreshold,
+                  cursor=cursor,
+                  inventory=opts.inventory,
+                  inventoryParallelism=os.cpu_count(),
+                  keysFrom=opts.keysFrom,
+                  versions=opts.allVersions,
+                  shard=opts.shard,
+                  geometry=opts.geometry)
+
+
+def main(plan=False):
     parser = createParser()
     opts, srids = parseArguments(parser, sys.argv)
-    bucketName = opts.bucketName
-    profileName = opts.profileName
+    if opts.debug:
+        # The worker processes set it from their context (createDeleter),
+        # spawned processes do not inherit it
+        logging.getLogger('tool_aws').setLevel(logging.DEBUG)
+    if plan and opts.jobManifest:
+        usage()
+        logger.error('Plan the targets of a job manifest one by one')
+        sys.exit(1)
+    # The targets of a job manifest are listed at the same time
+    listParallelism = opts.listParallelism * (
+        opts.jobParallelism if opts.jobManifest else 1)
 
-    # Maximum number of keys to be listed at a time
+    import boto3
     session = boto3.session.Session(profile_name=opts.profileName)
-    s3 = session.resource('s3')
+    # The listing threads share the client of the parent process
+    s3 = session.resource(
+        's3', endpoint_url=opts.endpointUrl,
+        config=getClientConfig(
+            maxPoolConnections=max(
+                opts.maxPoolConnections, listParallelism),
+            connectTimeout=opts.connectTimeout,
+            readTimeout=opts.readTimeout))
     S3Bucket = s3.Bucket(opts.bucketName)
-    keys = S3Keys(S3Bucket, opts.prefix, srids=srids,
-                  bbox=opts.bbox, imageFormat=opts.imageFormat,
-                  lowRes=opts.lowRes, highRes=opts.highRes)
+    if plan or opts.plan:
+        planDeletion(opts, S3Bucket, srids)
+        return
+    if opts.viaLifecycle:
+        expireWithLifecycle(opts, s3.meta.client)
+        return
+    if opts.lifecycleFinish:
+        if not finishLifecycle(opts, s3.meta.client):
+            sys.exit(1)
+        return
+    if opts.jobManifest:
+        deleteJob(opts, S3Bucket)
+        logger.info('Deletion finished...')
+        return
+    journal, cursor = openJournal(opts, srids)
+    metrics = createMetrics(opts)
+    try:
+        with metrics.timer('keys'):
+            keys = createKeys(opts, S3Bucket, srids, cursor)
+    except (IOError, ValueError) as e:
+        usage()
+        logger.error(e)
+        sys.exit(1)
     if opts.bbox:
-        deleteWithBBox(opts, S3Bucket, keys)
+        deleteWithBBox(opts, S3Bucket, keys, journal, metrics)
     else:
-        deleteWithPrefix(opts, S3Bucket, keys)
+        deleteWithPrefix(opts, S3Bucket, keys, journal, metrics)
     logger.info('Deletion finished...')
 
 
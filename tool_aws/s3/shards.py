@@ -0,0 +1,73 @@
+import hashlib
+
+
+class Shard:
+    """
+    One of count deterministic parts of a deletion, so that count hosts
+    can share it without any coordination (index starts at 1).
+    Tiles are split by ranges of the columns of the keys (the directories
+    of the zooms), the ranges are rotated from one zoom to the next so that
+    the few columns of the small zooms are spread over the shards.
+    In prefix mode, the keys are split by the hash of their sub-prefix
+    at the depth of the sharded listing, so that each shard only lists its
+    own sub-prefixes.
+    """
+
+    __slots__ = ('index', 'count')
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError('Invalid shard %s/%s' % (index, count))
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def fromString(cls, val):
+        # I/N
+        index, count = val.split('/')
+        return cls(int(index), int(count))
+
+    def __str__(self):
+        return '%s/%s' % (self.index, self.count)
+
+    def __repr__(self):
+        return 'Shard(%s, %s)' % (self.index, self.count)
+
+    def __eq__(self, other):
+        return isinstance(other, Shard) and \
+            (self.index, self.count) == (other.index, other.count)
+
+    def getRange(self, values, offset=0):
+        # Contiguous part of a range of values
+        i = (self.index - 1 + offset) % self.count
+        n = len(values)
+        return values[n * i // self.count:n * (i + 1) // self.count]
+
+    def ownsPrefix(self, prefix):
+        prefix = prefix[1:] if prefix.startswith('/') else prefix
+        digest = hashlib.md5(prefix.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.count == self.index - 1
+
+    def ownsKey(self, key, prefix, depth):
+        # The keys located above depth are split one by one
+        prefix = prefix[1:] if prefix.startswith('/') else prefix
+        parts = key[len(prefix):].split('/', depth)
+        if len(parts) <= depth:
+            return self.ownsPrefix(key)
+        return self.ownsPrefix(prefix + '/'.join(parts[:depth]) + '/')
+
+
+class ShardFilter:
+    """
+    This class tells whether a key of a prefix belongs to a shard, as the
+    keys of a sharded listing depth levels below the prefix. It only holds
+    plain data and can be sent to other processes.
+    """
+
+    def __init__(self, shard, prefix, depth):
+        self._shard = shard
+        self._prefix = prefix
+        self._depth = depth
+
+    def __call__(self, key):
+        return self._shard.ownsKey(key, self._prefix, self._depth)
@@ -0,0 +1,427 @@
+import logging
+import itertools
+from functools import lru_cache
+from tool_aws.utils import reprojectBBox
+from tool_aws.s3.geometry import selectTiles
+from tool_aws.s3.listing import getKeysPagesFromS3, getVersionsPagesFromS3
+from tool_aws.s3.pipeline import prefetchMany
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DENSITY_THRESHOLD = 0.5
+DEFAULT_DENSITY_SAMPLES = 4
+SUPPORTED_SRIDS = [21781, 2056, 4326, 3857]
+
+"""
+Function that returns the srids of the tiles of a prefix stopping at the
+timestamp level (every supported srid) or at the srid level.
+"""
+
+
+def getPrefixSrids(prefix):
+    pathSplit = [p for p in prefix.split('/') if p]
+    if len(pathSplit) > 5:
+        raise ValueError('Path should stop at the srid level definition')
+    elif len(pathSplit) < 4:
+        raise ValueError(
+            'Incorrect path definition, missing timestamp and/or layerid')
+    elif len(pathSplit) == 5:
+        if not pathSplit[4].isdigit() or \
+                int(pathSplit[4]) not in SUPPORTED_SRIDS:
+            raise ValueError('SRID %s is not supported' % pathSplit[4])
+        return [int(pathSplit[4])]
+    return list(SUPPORTED_SRIDS)
+
+
+"""
+Function that returns a cached tile grid of a srid covering a bbox in 2056.
+The reprojected bbox is clipped to the extent of the tile grid.
+"""
+
+
+@lru_cache(maxsize=None)
+def _getGrid(srid, bbox):
+    from gatilegrid import getTileGrid
+    tileGrid = getTileGrid(srid)
+    if bbox is None:
+        return tileGrid()
+    [minX, minY, maxX, maxY] = reprojectBBox(list(bbox), srid)
+    return tileGrid(extent=[
+        max(minX, tileGrid.MINX), max(minY, tileGrid.MINY),
+        min(maxX, tileGrid.MAXX), min(maxY, tileGrid.MAXY)])
+
+
+def getGrid(srid, bbox=None):
+    return _getGrid(srid, tuple(bbox) if bbox else None)
+
+
+"""
+Function that returns the tiles of a zoom of a tile grid that intersect
+a geometry, cached as the tile grids are.
+"""
+
+
+@lru_cache(maxsize=None)
+def getTileSelection(g, zoom, geometry):
+    return selectTiles(g, zoom, geometry)
+
+
+"""
+Function that returns the tiles keys base path (everything before the zoom)
+given a prefix stopping at the timestamp or srid level.
+"""
+
+
+def getTilesBase(prefix, srid):
+    pathLength = len([p for p in prefix.split('/') if p])
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    if pathLength == 4:
+        return prefix + '%s/' % srid
+    return prefix
+
+
+"""
+Function that returns the ranges of the columns and rows of the tiles keys
+at a given zoom. In the keys of 21781 the columns and rows are swapped.
+If shard is defined, only its part of the columns of the keys is returned.
+"""
+
+
+def getKeysRanges(g, zoom, shard=None):
+    [minRow, minCol, maxRow, maxCol] = g.getExtentAddress(zoom)
+    cols = range(minCol, maxCol + 1)
+    rows = range(minRow, maxRow + 1)
+    if g.spatialReference == 21781:
+        cols, rows = rows, cols
+    if shard is not None:
+        cols = shard.getRange(cols, zoom)
+    return cols, rows
+
+
+"""
+Function that returns the ranges of the rows and columns of the tile grid
+at a given zoom, restricted to the part of shard if defined.
+"""
+
+
+def getGridRanges(g, zoom, shard=None):
+    keysCols, keysRows = getKeysRanges(g, zoom, shard)
+    if g.spatialReference == 21781:
+        return keysCols, keysRows
+    return keysRows, keysCols
+
+
+"""
+Function that returns the columns of the tiles keys at a given zoom with
+at least one tile intersecting a geometry, among cols, and a function that
+returns the rows of the keys of such a column to keep.
+Without geometry, every column of cols and every row are kept.
+"""
+
+
+def getSelectedColumns(g, zoom, cols, rows, geometry=None):
+    if geometry is None:
+        return cols, lambda col: rows
+    selection = getTileSelection(g, zoom, geometry)
+    swap = g.spatialReference == 21781
+    if swap:
+        # Columns of the keys are the rows of the tile grid
+        selected = set(selection.rows())
+        cols = [col for col in cols if col in selected]
+    else:
+        cols = [col for r in selection.getColumns()
+                for col in r if col in cols]
+    return cols, lambda col: selection.getKeysColumn(col, swap)
+
+
+"""
+Function that yields pages of the keys that exist in a column of tiles
+and whose row is within rows.
+If versions is True, (key, versionId) pairs of all the versions and delete
+markers of the tiles are yielded instead.
+"""
+
+
+def getColumnKeys(s3Bucket, base, zoom, col, rows, imageFormat,
+                  versions=False):
+    columnPrefix = '%s%s/%s/' % (base, zoom, col)
+    suffix = '.%s' % imageFormat
+    if versions:
+        pages = getVersionsPagesFromS3(s3Bucket, columnPrefix)
+    else:
+        pages = getKeysPagesFromS3(s3Bucket, columnPrefix)
+    for page in pages:
+        keys = []
+        for item in page:
+            k = item[0] if versions else item
+            name = k[len(columnPrefix):]
+            if not name.endswith(suffix):
+                continue
+            row = name[:-len(suffix)]
+            if row.isdigit() and int(row) in rows:
+                keys.append(item)
+        if keys:
+            yield keys
+
+
+"""
+Function that returns nbSamples columns evenly spread over cols.
+"""
+
+
+def sampleColumns(cols, nbSamples):
+    step = max(1, len(cols) // nbSamples)
+    return list(cols[::step][:nbSamples])
+
+
+"""
+Function that returns the keys made of every head followed by every tail.
+The keys are ordered by head first, or by tail first if byHead is False.
+"""
+
+
+def joinKeys(heads, tails, byHead=True):
+    if byHead:
+        return [h + t for h in heads for t in tails]
+    return [h + t for t in tails for h in heads]
+
+
+"""
+Function that yields the keys of the tiles of some rows and columns of a zoom
+in the order of the tile grid (rows first), by blocks of about batchSize keys.
+The column and row parts of the keys are formatted once and whole blocks of
+rows are joined at a time.
+"""
+
+
+def getRowsKeysBatches(g, base, zoom, imageFormat, rows, cols, batchSize):
+    if not cols:
+        return
+    blockSize = max(1, batchSize // len(cols))
+    swap = g.spatialReference == 21781
+    if swap:
+        # zoom/row/col in the keys
+        colParts = ['%s.%s' % (col, imageFormat) for col in cols]
+    else:
+        # zoom/col/row in the keys
+        colParts = ['%s%s/%s/' % (base, zoom, col) for col in cols]
+    for i in range(0, len(rows), blockSize):
+        blockRows = rows[i:i + blockSize]
+        if swap:
+            keys = joinKeys(
+                ['%s%s/%s/' % (base, zoom, row) for row in blockRows],
+                colParts)
+        else:
+            keys = joinKeys(
+                colParts,
+                ['%s.%s' % (row, imageFormat) for row in blockRows],
+                byHead=False)
+        yield keys
+
+
+"""
+Function that yields the keys of all the tiles of a zoom in the order of
+the tile grid (rows first), by blocks of about batchSize keys.
+If after is a (row, col) tile address, only the tiles that come after it
+are yielded. If shard is defined, only the tiles of its columns of the keys
+are yielded (rows of the tile grid in 21781). If geometry is defined, only
+the tiles that intersect it are yielded, by ranges of columns of each row.
+"""
+
+
+def getZoomKeysBatches(g, base, zoom, imageFormat, batchSize=1000,
+                       after=None, shard=None, geometry=None):
+    rows, cols = getGridRanges(g, zoom, shard)
+    if geometry is not None:
+        selection = getTileSelection(g, zoom, geometry)
+        for row in selection.rows():
+            if row not in rows or (after is not None and row < after[0]):
+                continue
+            for rowCols in selection.getColumnRanges(row, cols):
+                if after is not None and row == after[0]:
+                    rowCols = range(
+                        max(rowCols.start, after[1] + 1), rowCols.stop)
+                for keys in getRowsKeysBatches(
+                        g, base, zoom, imageFormat, [row], rowCols,
+                        batchSize):
+                    yield keys
+        return
+    if after is not None:
+        # End of the row of the last tile first
+        row, col = after
+        for keys in getRowsKeysBatches(
+                g, base, zoom, imageFormat, [row],
+                range(max(cols.start, col + 1), cols.stop), batchSize):
+            yield keys
+        rows = range(max(rows.start, row + 1), rows.stop)
+    for keys in getRowsKeysBatches(
+            g, base, zoom, imageFormat, rows, cols, batchSize):
+        yield keys
+
+
+"""
+Function that returns the [srid, zoom, row, col] position of a tile key
+in the order of the tile grids.
+"""
+
+
+def getTileCursor(key):
+    [srid, zoom, first, last] = key.split('/')[-4:]
+    srid = int(srid)
+    zoom = int(zoom)
+    first = int(first)
+    last = int(last.split('.')[0])
+    if srid == 21781:
+        return [srid, zoom, first, last]
+    return [srid, zoom, last, first]
+
+
+"""
+Function that yields the keys of all the tiles of a zoom in the order of
+the tile grid (rows first).
+"""
+
+
+def generateZoomKeys(g, base, zoom, imageFormat, shard=None, geometry=None):
+    return itertools.chain.from_iterable(getZoomKeysBatches(
+        g, base, zoom, imageFormat, shard=shard, geometry=geometry))
+
+
+"""
+Function that returns tiles keys given a prefix, a bbox and an image format,
+only for the tiles that exist. For each zoom, a few columns are listed to
+estimate the density of the existing tiles. Sparse zooms are listed column
+by column, dense zooms are generated from the tile grid.
+If shard is defined, only the tiles of its columns are yielded. If geometry
+is defined, only the columns with tiles intersecting it are listed and
+only these tiles are yielded.
+"""
+
+
+def getKeysExistingTiles(s3Bucket, prefix, srids, bbox, imageFormat,
+                         lowRes, highRes,
+                         densityThreshold=DEFAULT_DENSITY_THRESHOLD,
+                         parallelism=1, nbSamples=DEFAULT_DENSITY_SAMPLES,
+                         shard=None, geometry=None):
+    for srid in srids:
+        g = getGrid(srid, bbox)
+        base = getTilesBase(prefix, g.spatialReference)
+        minZoom = g.getClosestZoom(lowRes)
+        maxZoom = g.getClosestZoom(highRes)
+        for zoom in range(minZoom, maxZoom + 1):
+            cols, rows = getKeysRanges(g, zoom, shard)
+            cols, getRows = getSelectedColumns(g, zoom, cols, rows, geometry)
+            if not cols:
+                continue
+            samples = dict(
+                (col, [k for keys in getColumnKeys(
+                    s3Bucket, base, zoom, col, getRows(col), imageFormat)
+                    for k in keys])
+                for col in sampleColumns(cols, nbSamples))
+            density = float(sum(len(keys) for keys in samples.values())) / \
+                max(1, sum(len(getRows(col)) for col in samples))
+            if density >= densityThreshold:
+                logger.info(
+                    'srid %s zoom %s: density %.2f, generating the keys' % (
+                        srid, zoom, density))
+                for k in generateZoomKeys(
+                        g, base, zoom, imageFormat, shard, geometry):
+                    yield k
+                continue
+            logger.info(
+                'srid %s zoom %s: density %.2f, listing %s columns' % (
+                    srid, zoom, density, len(cols)))
+            for keys in samples.values():
+                for k in keys:
+                    yield k
+            listers = (
+                getColumnKeys(
+                    s3Bucket, base, zoom, col, getRows(col), imageFormat)
+                for col in cols if col not in samples)
+            for keys in prefetchMany(listers, parallelism, 2 * parallelism):
+                for k in keys:
+                    yield k
+
+
+"""
+Function that yields (key, versionId) pairs of all the versions and delete
+markers of the tiles of a bbox. Every column of the bbox (of the shard, if
+defined, with tiles intersecting geometry, if defined) is listed,
+by parallelism threads.
+"""
+
+
+def getTilesVersions(s3Bucket, prefix, srids, bbox, imageFormat, lowRes,
+                     highRes, parallelism=1, shard=None, geometry=None):
+    for srid in srids:
+        g = getGrid(srid, bbox)
+        base = getTilesBase(prefix, g.spatialReference)
+        minZoom = g.getClosestZoom(lowRes)
+        maxZoom = g.getClosestZoom(highRes)
+        for zoom in range(minZoom, maxZoom + 1):
+            cols, rows = getKeysRanges(g, zoom, shard)
+            cols, getRows = getSelectedColumns(g, zoom, cols, rows, geometry)
+            listers = (
+                getColumnKeys(s3Bucket, base, zoom, col, getRows(col),
+                              imageFormat, versions=True)
+                for col in cols)
+            for versions in prefetchMany(
+                    listers, parallelism, 2 * parallelism):
+                for v in versions:
+                    yield v
+
+
+class TilesFilter:
+    """
+    This class tells whether a key is the key of a tile of the bbox, of
+    a zoom between lowRes and highRes and in one of the srids, i.e. whether
+    getKeysTilingScheme would generate it. Used to select the tiles among
+    keys coming from elsewhere. If shard is defined, only the tiles of its
+    columns are accepted. If geometry is defined, only the tiles that
+    intersect it are accepted. It only holds plain data and can be sent to
+    other processes.
+    """
+
+    def __init__(self, prefix, srids, bbox, imageFormat, lowRes, highRes,
+                 shard=None, geometry=None):
+        self._suffix = '.%s' % imageFormat
+        self._shard = shard
+        self._bbox = bbox
+        self._geometry = geometry
+        # Tile addresses by base path and by zoom
+        self._extents = {}
+        for srid in srids:
+            g = getGrid(srid, bbox)
+            base = getTilesBase(prefix, g.spatialReference)
+            minZoom = g.getClosestZoom(lowRes)
+            maxZoom = g.getClosestZoom(highRes)
+            self._extents[base] = dict(
+                (zoom, g.getExtentAddress(zoom))
+                for zoom in range(minZoom, maxZoom + 1))
+
+    def __call__(self, key):
+        if not key.endswith(self._suffix):
+            return False
+        extents = self._extents.get(key.rsplit('/', 3)[0] + '/')
+        if extents is None:
+            return False
+        try:
+            [srid, zoom, row, col] = getTileCursor(key)
+        except ValueError:
+            return False
+        if zoom not in extents:
+            return False
+        [minRow, minCol, maxRow, maxCol] = extents[zoom]
+        if not (minRow <= row <= maxRow and minCol <= col <= maxCol):
+            return False
+        if self._geometry is not None and (row, col) not in getTileSelection(
+                getGrid(srid, self._bbox), zoom, self._geometry):
+            return False
+        if self._shard is None:
+            return True
+        # Column of the key, row of the tile grid in 21781
+        if srid == 21781:
+            return row in self._shard.getRange(
+                range(minRow, maxRow + 1), zoom)
+        return col in self._shard.getRange(range(minCol, maxCol + 1), zoom)
@@ -1,25 +1,42 @@
 import sys
 import math
+import itertools
 from textwrap import dedent
-from tool_aws.utils import reprojectBBox
-from gatilegrid import getTileGrid
+from tool_aws.s3.keys import KeysChunk
+from tool_aws.s3.listing import getKeysPagesFromS3, getKeysPagesSharded, \
+    getVersionsPagesFromS3, getVersionsPagesSharded
+from tool_aws.s3.tiles import getKeysExistingTiles, getTilesBase, \
+    getZoomKeysBatches, getGrid, getTilesVersions, getKeysRanges, \
+    getGridRanges, getTileSelection, TilesFilter, \
+    DEFAULT_DENSITY_THRESHOLD
+from tool_aws.s3.inventory import getKeysFromInventory
+from tool_aws.s3.keysfile import readKeysFile
+from tool_aws.s3.shards import ShardFilter
 
 
 PY3 = sys.version_info >= (3, 0)
 
 """
-Function that returns the total number of tiles.
+Function that returns the total number of tiles (of a shard, if defined,
+intersecting geometry, if defined).
 """
 
 
-def countTiles(srid, lowRes, highRes, bbox=None):
-    if bbox:
-        g = getTileGrid(srid)(extent=reprojectBBox(bbox, srid))
-    else:
-        g = getTileGrid(srid)()
+def countTiles(srid, lowRes, highRes, bbox=None, shard=None, geometry=None):
+    g = getGrid(srid, bbox)
     minZoom = g.getClosestZoom(lowRes)
     maxZoom = g.getClosestZoom(highRes)
-    return g.totalNumberOfTiles(minZoom, maxZoom)
+    if shard is None and geometry is None:
+        return g.totalNumberOfTiles(minZoom, maxZoom)
+    c = 0
+    for zoom in range(minZoom, maxZoom + 1):
+        if geometry is not None:
+            rows, cols = getGridRanges(g, zoom, shard)
+            c += getTileSelection(g, zoom, geometry).count(rows, cols)
+            continue
+        cols, rows = getKeysRanges(g, zoom, shard)
+        c += len(cols) * len(rows)
+    return c
 
 
 """
@@ -36,6 +53,20 @@ def chunks(l, n):
             yield l[i:i + n]
 
 
+"""
+Function that yields successive n-sized chunks from any iterable.
+"""
+
+
+def iterChunks(iterable, n):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
+
+
 """
 Function that returns how many keys should be deleted at a time per process.
 """
@@ -48,15 +79,16 @@ def getMaxChunkSize(nbProc, nbKeys, maxChunkSize=1000):
 
 
 """
-Function that returns keys given a bucket object and prefix.
+Function that returns keys given a bucket object and prefix, optionally
+starting after a given key.
 """
 
 
-def getKeysFromS3(s3Bucket, prefix, maxKeys):
-    if prefix.startswith('/'):
-        prefix = prefix[1:]
-    return [{'Key': i.key}
-            for i in s3Bucket.objects.filter(Prefix=prefix).limit(maxKeys)]
+def getKeysFromS3(s3Bucket, prefix, maxKeys, startAfter=None):
+    return [{'Key': k} for k in itertools.islice(
+        itertools.chain.from_iterable(
+            getKeysPagesFromS3(s3Bucket, prefix, startAfter=startAfter)),
+        maxKeys)]
 
 
 """
@@ -67,7 +99,7 @@ Function that returns tiles keys given a prefix, a bbox and an image format.
 def getKeysTilingScheme(prefix, srids, bbox, imageFormat, lowRes, highRes):
     pathLength = len([p for p in prefix.split('/') if p])
     for s in srids:
-        g = getTileGrid(s)(extent=reprojectBBox(bbox, s))
+        g = getGrid(s, bbox)
         minZoom = g.getClosestZoom(lowRes)
         maxZoom = g.getClosestZoom(highRes)
         for tileBounds, zoom, col, row in g.iterGrid(minZoom, maxZoom):
@@ -87,29 +119,165 @@ def getKeysTilingScheme(prefix, srids, bbox, imageFormat, lowRes, highRes):
                 }
 
 
+"""
+Function that yields the same keys as getKeysTilingScheme by lists of
+batchSize keys. The keys of a zoom are generated by blocks of rows instead
+of one tile at a time.
+If start is a [srid, zoom, row, col] tile cursor, only the keys that come
+after it are yielded. If shard is defined, only the keys of its columns
+are yielded. If geometry is defined, only the keys of the tiles that
+intersect it are yielded.
+"""
+
+
+def getKeysTilingSchemeBatches(prefix, srids, bbox, imageFormat, lowRes,
+                               highRes, batchSize=1000, start=None,
+                               shard=None, geometry=None):
+    pathLength = len([p for p in prefix.split('/') if p])
+    if pathLength not in (4, 5):
+        return
+    batch = []
+    for s in srids:
+        g = getGrid(s, bbox)
+        if start is not None and g.spatialReference != start[0]:
+            # This srid has already been done
+            continue
+        base = getTilesBase(prefix, g.spatialReference)
+        minZoom = g.getClosestZoom(lowRes)
+        maxZoom = g.getClosestZoom(highRes)
+        after = None
+        if start is not None:
+            minZoom = start[1]
+            after = (start[2], start[3])
+            start = None
+        for zoom in range(minZoom, maxZoom + 1):
+            for keys in getZoomKeysBatches(
+                    g, base, zoom, imageFormat, batchSize, after, shard,
+                    geometry):
+                batch.extend(keys)
+                while len(batch) >= batchSize:
+                    yield batch[:batchSize]
+                    batch = batch[batchSize:]
+            after = None
+    if batch:
+        yield batch
+
+
+"""
+Function that yields the keys starting with prefix and accepted by
+keysFilter, if any.
+"""
+
+
+def filterKeys(keys, prefix, keysFilter=None):
+    prefix = prefix[1:] if prefix.startswith('/') else prefix
+    for k in keys:
+        if k.startswith(prefix) and (keysFilter is None or keysFilter(k)):
+            yield k
+
+
 class S3Keys:
     """
     This class is used to generate chunks of keys, based on prefix key.
+    Only the first batch of keys (at most maxKeys) is loaded, in a compact
+    form, the following keys are streamed as strings by remainingKeys.
+    If versions is True, every version and delete marker of the keys is
+    selected and streamed as (key, versionId) pairs instead.
+    If shard is defined, only the keys of the shard are selected: the
+    columns of its part of the tiles of the bbox, or the sub-prefixes
+    listDepth levels below the prefix whose hash falls in the shard.
+    If geometry is defined (bbox being its envelope), only the tiles that
+    intersect it are selected.
     """
 
     def __init__(
             self, s3Bucket, prefix,
             chunkSize=1, srids=[], bbox=[],
-            maxKeys=64000, imageFormat='png', lowRes=0, highRes=float('inf')):
+            maxKeys=64000, imageFormat='png', lowRes=0, highRes=float('inf'),
+            listDepth=0, listParallelism=1, skipMissing=False,
+            densityThreshold=DEFAULT_DENSITY_THRESHOLD, cursor=None,
+            inventory=None, inventoryParallelism=1, keysFrom=None,
+            versions=False, shard=None, geometry=None):
         self._prefix = prefix
         self._chunkSize = chunkSize
-        if not bbox:
+        self._s3Bucket = s3Bucket
+        self._maxKeys = maxKeys
+        self._shard = shard
+        self._geometry = geometry
+        if bbox:
+            keysFilter = TilesFilter(
+                prefix, srids, bbox, imageFormat, lowRes, highRes, shard,
+                geometry)
+        elif shard is not None:
+            keysFilter = ShardFilter(shard, prefix, listDepth)
+        else:
+            keysFilter = None
+        if keysFrom:
+            # Returns a generator of the keys of a file, the cursor is
+            # the last deleted key of a previous run
+            self._keys = KeysChunk('', [])
+            self._keysGenerator = filterKeys(
+                readKeysFile(keysFrom, startAfter=cursor), prefix,
+                keysFilter)
+            if not bbox:
+                self._iterKeys()
+        elif versions and bbox:
+            # Returns a generator of the versions of the tiles, listed
+            # column by column
+            self._keys = KeysChunk('', [])
+            self._keysGenerator = getTilesVersions(
+                s3Bucket, prefix, srids, bbox, imageFormat, lowRes, highRes,
+                parallelism=listParallelism, shard=shard, geometry=geometry)
+        elif versions:
+            # Returns a generator of the versions, sharded listing is
+            # not ordered
+            if listDepth > 0:
+                pages = getVersionsPagesSharded(
+                    s3Bucket, prefix, listDepth, listParallelism,
+                    shard=shard)
+            else:
+                pages = getVersionsPagesFromS3(s3Bucket, prefix)
+            self._keysGenerator = itertools.chain.from_iterable(pages)
+            self._iterKeys()
+        elif inventory:
+            # Returns a generator of the keys of an S3 Inventory,
+            # inventory files are not ordered
+            self._keys = KeysChunk('', [])
+            self._keysGenerator = getKeysFromInventory(
+                inventory, prefix, keysFilter, inventoryParallelism)
+            if not bbox:
+                self._iterKeys()
+        elif not bbox and listDepth > 0:
+            # Returns a generator, sharded listing is not ordered
+            self._keysGenerator = itertools.chain.from_iterable(
+                getKeysPagesSharded(
+                    s3Bucket, prefix, listDepth, listParallelism,
+                    shard=shard))
+            self._iterKeys()
+        elif not bbox:
             # Returns a list
-            self._keys = getKeysFromS3(s3Bucket, prefix, maxKeys)
+            # The cursor is the last deleted key of a previous run
+            self._keys = KeysChunk.fromKeys([
+                k['Key'] for k in getKeysFromS3(
+                    s3Bucket, prefix, maxKeys, startAfter=cursor)])
             self._keysGenerator = None
+        elif skipMissing:
+            # Returns a generator of the existing tiles only
+            self._keys = KeysChunk('', [])
+            self._keysGenerator = getKeysExistingTiles(
+                s3Bucket, prefix, srids, bbox, imageFormat, lowRes, highRes,
+                densityThreshold=densityThreshold,
+                parallelism=listParallelism, shard=shard, geometry=geometry)
         else:
-            # Returns a generator
-            self._keys = []
-            self._keysGenerator = getKeysTilingScheme(
-                prefix, srids, bbox, imageFormat, lowRes, highRes)
+            # Returns a generator, the cursor is the last deleted tile
+            # of a previous run
+            self._keys = KeysChunk('', [])
+            self._keysGenerator = itertools.chain.from_iterable(
+                getKeysTilingSchemeBatches(
+                    prefix, srids, bbox, imageFormat, lowRes, highRes,
+                    start=cursor, shard=shard, geometry=geometry))
         self._chunkedKeys = chunks(self._keys, self._chunkSize)
         self._bucketName = s3Bucket.name
-        self._maxKeys = maxKeys
         self._srids = srids
         self._bbox = bbox
         self._lowRes = lowRes
@@ -126,7 +294,7 @@ class S3Keys:
 
     def __iter__(self):
         for cKeys in self._chunkedKeys:
-            yield {'Objects': cKeys, 'Quiet': True}
+            yield cKeys
 
     def __len__(self):
         return len(self._keys)
@@ -139,21 +307,26 @@ class S3Keys:
             self._iterKeys()
             self._chunkedKeys = chunks(self._keys, self._chunkSize)
 
+    def remainingKeys(self):
+        # Keys that follow the current batch
+        if self._keysGenerator is not None:
+            return self._keysGenerator
+        if len(self._keys) < self._maxKeys:
+            return iter([])
+        return itertools.chain.from_iterable(getKeysPagesFromS3(
+            self._s3Bucket, self._prefix, startAfter=self.lastKey))
+
     def countTiles(self):
         c = 0
         for srid in self._srids:
             c += countTiles(
-                srid, self._lowRes, self._highRes, bbox=self._bbox)
+                srid, self._lowRes, self._highRes, bbox=self._bbox,
+                shard=self._shard, geometry=self._geometry)
         return c
 
     def _iterKeys(self):
-        i = 0
-        self._keys = []
-        for k in self._keysGenerator:
-            self._keys.append(k)
-            i += 1
-            if i == self._maxKeys:
-                break
+        self._keys = KeysChunk.fromItems(
+            list(itertools.islice(self._keysGenerator, self._maxKeys)))
 
     @property
     def prefix(self):
@@ -170,3 +343,7 @@ class S3Keys:
     @property
     def maxKeys(self):
         return self._maxKeys
+
+    @property
+    def lastKey(self):
+        return self._keys[-1] if len(self._keys) else None
@@ -1,11 +1,32 @@
-from pyproj import Proj, transform
+from functools import lru_cache
+
+
+# Number of points added on each edge of a bbox before reprojecting it
+DENSIFY_POINTS = 21
+
+"""
+Function that returns a cached transformer between two srids.
+Coordinates are always in x, y order. pyproj is only imported when
+a bbox needs to be reprojected.
+"""
+
+
+@lru_cache(maxsize=None)
+def getTransformer(sridFrom, sridTo):
+    from pyproj import Transformer
+    return Transformer.from_crs(
+        'EPSG:%s' % sridFrom, 'EPSG:%s' % sridTo, always_xy=True)
+
+
+"""
+Function that returns the bbox covering a bbox once reprojected.
+The edges are densified so that the curved edges of the reprojected bbox
+are covered too.
+"""
 
 
 def reprojectBBox(bbox, sridTo, sridFrom=2056):
     if sridTo == sridFrom:
         return bbox
-    sridIn = Proj('EPSG:%s' % sridFrom)
-    sridOut = Proj('EPSG:%s' % sridTo)
-    pLeft = transform(sridIn, sridOut, bbox[0], bbox[1])
-    pRight = transform(sridIn, sridOut, bbox[2], bbox[3])
-    return pLeft + pRight
+    return list(getTransformer(sridFrom, sridTo).transform_bounds(
+        *bbox, densify_pts=DENSIFY_POINTS))